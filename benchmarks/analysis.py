@@ -0,0 +1,68 @@
+"""Times the analyses in pictionary.analysis on synthetic trials.
+
+Usage (from the project folder, needs numpy):
+
+    python benchmarks/analysis.py [num_trials ...]
+"""
+import sys
+import time
+
+import numpy as np
+
+from harness import PROJECT_DIR
+
+sys.path.insert(0, str(PROJECT_DIR))
+
+from pictionary import analysis  # noqa: E402
+from pictionary.stims import PHASE_STIM_IDS  # noqa: E402
+
+DEFAULT_TRIAL_COUNTS = [10_000, 50_000, 200_000]
+TRIALS_PER_PAIR = 108
+
+
+def synthetic_trials(num_trials: int, seed: int = 1) -> analysis.Trials:
+    rng = np.random.default_rng(seed)
+    phase = rng.integers(1, len(PHASE_STIM_IDS) + 1, num_trials)
+    phase_ids = [np.array(ids) for ids in PHASE_STIM_IDS]
+    stim_id = np.empty(num_trials, dtype=np.int32)
+    response_id = np.empty(num_trials, dtype=np.int32)
+    for i, ids in enumerate(phase_ids, start=1):
+        in_phase = phase == i
+        stim_id[in_phase] = rng.choice(ids, in_phase.sum())
+        response_id[in_phase] = rng.choice(ids, in_phase.sum())
+    correct = rng.random(num_trials) < 0.6
+    response_id[correct] = stim_id[correct]
+    return analysis._make_trials(
+        np.arange(num_trials) // TRIALS_PER_PAIR,
+        phase=phase,
+        trial=rng.integers(1, 37, num_trials),
+        stim_id=stim_id,
+        response_id=response_id,
+        correct=correct,
+        completed=rng.random(num_trials) < 0.98,
+        drawer_role=rng.integers(1, 3, num_trials),
+        drawing_time=rng.uniform(5, 120, num_trials),
+    )
+
+
+def main(trial_counts: list[int]):
+    functions = [
+        analysis.learning_curves,
+        analysis.mean_learning_curve,
+        analysis.confusion_matrices,
+        analysis.accuracy_by_drawer_role,
+        analysis.drawing_time_distribution,
+    ]
+    print(f"{'trials':>8} " + " ".join(f"{f.__name__:>26}" for f in functions) + f" {'total ms':>9}")
+    for num_trials in trial_counts:
+        trials = synthetic_trials(num_trials)
+        timings = []
+        for function in functions:
+            start = time.perf_counter()
+            function(trials)
+            timings.append((time.perf_counter() - start) * 1000)
+        print(f"{num_trials:>8} " + " ".join(f"{ms:>26.2f}" for ms in timings) + f" {sum(timings):>9.2f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_TRIAL_COUNTS)
@@ -0,0 +1,36 @@
+"""Helpers to run oTree in-process for the benchmarks.
+
+The database is set up in memory, the same way ``otree test`` does it,
+so the benchmarks have to be started from the project folder.
+"""
+import os
+import sys
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_otree():
+    """Initializes oTree with an in-memory database and opens a database session"""
+    os.chdir(PROJECT_DIR)
+    sys.path.insert(0, str(PROJECT_DIR))
+    os.environ["OTREE_IN_MEMORY"] = "1"
+    from otree.main import setup  # type: ignore
+    from otree.database import db  # type: ignore
+
+    setup()
+    db.new_session()
+
+
+def create_session(num_participants: int, session_config_name: str = "pictionary", **config):
+    """Creates a session and commits it, returns the session"""
+    import otree.session  # type: ignore
+    from otree.database import db  # type: ignore
+
+    session = otree.session.create_session(
+        session_config_name=session_config_name,
+        num_participants=num_participants,
+        modified_session_config_fields=config,
+    )
+    db.commit()
+    return session
@@ -0,0 +1,211 @@
+"""Simulates many drawer/guesser pairs playing against Drawing.live_method.
+
+The live method is called in-process, the same way oTree calls it for a
+websocket message: each message gets a new database session, the player is
+loaded, the live method runs and the session is committed. The pairs take
+turns sending messages, so their trials are interleaved like they would be
+in a lab session.
+
+Each simulated trial sends ``init`` from both players, a stream of stroke
+operations (or full ``update``s with ``--protocol update``) from the drawer,
+``get_remaining_time`` polls from the guesser, ``drawing_complete``,
+``stimulus_selected``, ``response_complete`` and ``continue`` from both.
+With ``--spectate`` the guesser also acknowledges the relayed strokes, with
+``--reconnect-every`` the guesser reloads the page every few strokes and sends
+``init`` with the version of the drawing it already has.
+
+Usage (from the project folder):
+
+    python benchmarks/load_test.py [--pairs 50] [--trials 5] [--strokes 20] [--batch 1]
+"""
+import argparse
+import base64
+import random
+import time
+
+from harness import setup_otree, create_session
+
+
+def random_stroke(rng: random.Random, num_points: int) -> list[tuple[float, float]]:
+    """A random walk on the 800x600 canvas, like a quick pen stroke"""
+    x, y = rng.uniform(100, 700), rng.uniform(100, 500)
+    points = []
+    for _ in range(num_points):
+        x = min(max(x + rng.uniform(-15, 15), 0), 800)
+        y = min(max(y + rng.uniform(-15, 15), 0), 600)
+        points.append((round(x, 1), round(y, 1)))
+    return points
+
+
+def pair_script(rng: random.Random, players: dict, args):
+    """Generator playing one pair, yields (player id, message) and receives the response"""
+    from pictionary.codec import encode_points, path_element  # type: ignore
+    from pictionary.strokes import build_svg  # type: ignore
+
+    for _ in range(args.trials):
+        response = yield players[1], {"event": "init"}
+        if response.get(1, {}).get("event") == "continue":
+            # the phase is already over for this pair
+            return
+        drawer, guesser = (1, 2) if response[1]["drawer"] else (2, 1)
+        stims = response[1]["stims"]
+        second = yield players[2], {"event": "init"}
+        have = drawing_version((response if guesser == 1 else second)[guesser])
+
+        paths = []
+        ops = []
+        for seq in range(1, args.strokes + 1):
+            points = random_stroke(rng, args.points)
+            if args.protocol == "update":
+                paths.append(path_element(points))
+                svg = build_svg(paths)
+                message = {
+                    "event": "update",
+                    "seq": seq,
+                    "drawing": base64.b64encode(svg.encode("utf-8")).decode("utf-8"),
+                }
+            else:
+                encoded = base64.b64encode(encode_points(points)).decode("ascii")
+                ops.append({"op": "add", "points": encoded})
+                # strokes are merged into one message, like the client does within live_draw_interval
+                if len(ops) >= args.batch or seq == args.strokes:
+                    message = {"event": "strokes", "seq": seq - len(ops) + 1, "ops": ops}
+                    ops = []
+                else:
+                    message = None
+            if message is not None:
+                response = yield players[drawer], message
+                relay = response.get(guesser)
+                if relay and relay.get("event") == "strokes":
+                    # spectator mode, the guesser confirms each relayed message right away
+                    yield players[guesser], {
+                        "event": "strokes_ack",
+                        "trial": relay["trial"],
+                        "seq": relay["seq"] + len(relay["ops"]) - 1,
+                        "sent_at": relay["sent_at"],
+                        "render_ms": 0,
+                    }
+            if seq % args.poll_every == 0:
+                yield players[guesser], {"event": "get_remaining_time"}
+            if args.reconnect_every and seq % args.reconnect_every == 0:
+                reconnect = yield players[guesser], {"event": "init", "have": None if args.forget else have}
+                have = drawing_version(reconnect[guesser])
+
+        if args.protocol == "update":
+            complete = {"event": "drawing_complete", "drawing": message["drawing"], "timeout": False}
+        else:
+            complete = {"event": "drawing_complete", "seq": args.strokes, "timeout": False}
+        yield players[drawer], complete
+
+        guess = rng.choice(stims)
+        yield players[guesser], {"event": "stimulus_selected", "stim": rng.choice(stims)}
+        yield players[guesser], {"event": "stimulus_selected", "stim": guess}
+        yield players[guesser], {"event": "response_complete", "response": guess}
+        yield players[drawer], {"event": "continue"}
+        response = yield players[guesser], {"event": "continue"}
+        if response.get(0, {}).get("phase_complete"):
+            return
+
+
+def drawing_version(init: dict) -> dict:
+    """What a client keeps of the drawing in an init response, sent back when it reconnects"""
+    return {"drawing_id": init["drawing_id"], "seq": init["seq"], "digest": init["digest"]}
+
+
+class EventResults:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.queries = 0
+        self.bytes_out = 0
+
+    def percentile(self, q: float) -> float:
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(args):
+    setup_otree()
+    from sqlalchemy import event  # type: ignore
+    from otree.database import db, engine  # type: ignore
+    import pictionary  # type: ignore
+    from pictionary.instrumentation import payload_size  # type: ignore
+
+    rng = random.Random(args.seed)
+    config = dict(live_draw=True, spectate=True) if args.spectate else {}
+    session = create_session(args.pairs * pictionary.C.PLAYERS_PER_GROUP, **config)
+
+    query_count = [0]
+
+    def count_query(*_):
+        query_count[0] += 1
+
+    event.listen(engine, "before_cursor_execute", count_query)
+
+    scripts = []
+    for group in session.get_subsessions()[0].get_groups():
+        players = {p.id_in_group: p.id for p in group.get_players()}
+        scripts.append((pair_script(rng, players, args), None))
+    db.commit()
+
+    results: dict[str, EventResults] = {}
+    num_messages = 0
+    total_start = time.perf_counter()
+    while scripts:
+        remaining = []
+        for script, response in scripts:
+            try:
+                player_id, message = script.send(response)
+            except StopIteration:
+                continue
+            db.new_session()
+            player = pictionary.Player.objects_get(id=player_id)
+            query_count[0] = 0
+            start = time.perf_counter()
+            response = pictionary.Drawing.live_method(player, message)
+            db.commit()
+            elapsed = time.perf_counter() - start
+
+            stats = results.setdefault(message["event"], EventResults())
+            stats.latencies.append(elapsed * 1000)
+            stats.queries += query_count[0]
+            stats.bytes_out += payload_size(response)
+            num_messages += 1
+            remaining.append((script, response or {}))
+        scripts = remaining
+    total_elapsed = time.perf_counter() - total_start
+
+    event.remove(engine, "before_cursor_execute", count_query)
+
+    print(f"{args.pairs} pairs, {args.trials} trials each, {args.strokes} strokes per drawing ({args.protocol})")
+    print(f"{num_messages} messages in {total_elapsed:.2f}s, {num_messages / total_elapsed:.0f} messages/s")
+    print()
+    print(f"{'event':>20} {'count':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'queries':>8} {'bytes out':>10}")
+    for name, stats in sorted(results.items()):
+        count = len(stats.latencies)
+        print(
+            f"{name:>20} {count:>7} {stats.percentile(0.5):>8.2f} {stats.percentile(0.99):>8.2f} "
+            f"{max(stats.latencies):>8.2f} {stats.queries / count:>8.1f} {stats.bytes_out / count:>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=50, help="number of simulated pairs")
+    parser.add_argument("--trials", type=int, default=5, help="trials played by each pair")
+    parser.add_argument("--strokes", type=int, default=20, help="strokes per drawing")
+    parser.add_argument("--points", type=int, default=40, help="points per stroke")
+    parser.add_argument("--batch", type=int, default=1, help="strokes merged into one strokes message")
+    parser.add_argument("--poll-every", type=int, default=5, help="strokes between timer polls of the guesser")
+    parser.add_argument("--protocol", choices=["strokes", "update"], default="strokes",
+                        help="send stroke operations or full SVG updates")
+    parser.add_argument("--spectate", action="store_true", help="relay strokes to the guesser, who acknowledges them")
+    parser.add_argument("--reconnect-every", type=int, default=0,
+                        help="strokes between reconnects of the guesser, 0 never reconnects")
+    parser.add_argument("--forget", action="store_true",
+                        help="reconnect without the drawing the guesser already has, like older clients")
+    parser.add_argument("--seed", type=int, default=1)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
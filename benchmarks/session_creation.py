@@ -0,0 +1,35 @@
+"""Times session creation for an increasing number of groups.
+
+Usage (from the project folder):
+
+    python benchmarks/session_creation.py [num_groups ...]
+"""
+import sys
+import time
+
+from harness import setup_otree, create_session
+
+DEFAULT_GROUP_COUNTS = [10, 100, 1000]
+
+
+def main(group_counts: list[int]):
+    setup_otree()
+    from pictionary import C, PictionaryTrial  # type: ignore
+    from otree.database import db  # type: ignore
+
+    results = []
+    for num_groups in group_counts:
+        start = time.perf_counter()
+        session = create_session(num_groups * C.PLAYERS_PER_GROUP)
+        elapsed = time.perf_counter() - start
+        num_trials = PictionaryTrial.objects_filter().join(PictionaryTrial.subsess).filter_by(session=session).count()
+        results.append((num_groups, num_trials, elapsed))
+        db.commit()
+
+    print(f"{'groups':>8} {'trials':>8} {'seconds':>10} {'trials/s':>10}")
+    for num_groups, num_trials, elapsed in results:
+        print(f"{num_groups:>8} {num_trials:>8} {elapsed:>10.3f} {num_trials / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_GROUP_COUNTS)
@@ -1,12 +1,27 @@
 from sqlalchemy.ext.declarative import DeclarativeMeta  # type: ignore
 from otree.api import BaseConstants, BaseSubsession, BaseGroup, BasePlayer, models, Page, ExtraModel, WaitPage  # type: ignore
-from otree.models import Participant  # type: ignore
+from otree.models import Participant, Session  # type: ignore
 from otree.common import expand_choice_tuples  # type: ignore
-from .stims import PHASES
+from otree.database import db, values_flat  # type: ignore
+from sqlalchemy import func  # type: ignore
+from sqlalchemy.orm import joinedload  # type: ignore
+from sqlalchemy.orm.attributes import set_committed_value  # type: ignore
+from .stims import PHASE_STIM_IDS, PHASE_SENTENCES, STIMULI
+from .strokes import OP_ADD, OP_UNDO, OP_CLEAR, is_valid_op, replay, build_svg
+from .drawing_store import get_drawing_store
+from .codec import decode_points, path_element, parse_path_element, encode_svg, decode_svg
+from .features import geometry, strokes_from_svg
+from .simplify import DEFAULT_TOLERANCE, simplify_svg
+from .instrumentation import logger, trace, metrics, instrument_live_method, dump_metrics
+from .write_behind import get_write_behind
+from .timeline import TimelineEvent, decode_times, encode_timeline
+from .progress import GroupProgress, get_progress
 from json import dumps as json_dumps, loads as json_loads
 from random import shuffle, randint
 import base64
 import datetime
+import secrets
+import time
 
 
 doc = """
@@ -30,7 +45,7 @@ class C(BaseConstants):
     PLAYERS_PER_GROUP = 2
     NUM_PRACTICE_ROUNDS = 0
     # how many stimuli in each phase
-    NUM_PHASE_STIMS = [len(phase) for phase in PHASES]
+    NUM_PHASE_STIMS = [len(stim_ids) for stim_ids in PHASE_STIM_IDS]
 
     # how many times to repeat each item in each phase
     PHASE_STIM_REPEATS = [
@@ -44,39 +59,77 @@ class C(BaseConstants):
     NUM_ROUNDS = 3
     # Time limit for drawing
     DRAWING_TIME = 120
+    # seconds a drawing_complete is still accepted after the deadline, to allow for network delays
+    DRAWING_TIME_GRACE = 2
+    # default milliseconds between live drawing updates
+    LIVE_DRAW_INTERVAL = 500
+    # stroke operations the responder may fall behind in spectator mode,
+    # after that they get the whole drawing once they catch up
+    SPECTATE_WINDOW = 20
+    # default pixels a finished stroke may be moved by simplifying it, 0 keeps every point
+    SIMPLIFY_TOLERANCE = DEFAULT_TOLERANCE
+    # with match_by_arrival, seconds a participant waits for their partner of the previous
+    # phase before they can be paired with someone else whose partner is also missing
+    REMATCH_AFTER = 60
+    # with match_by_arrival, seconds a participant waits for any partner before they
+    # continue alone to the end of the experiment
+    MATCH_GIVE_UP_AFTER = 300
+    # seconds without a live message after which the admin report shows a player as stuck
+    PROGRESS_IDLE_AFTER = 30
+    # seconds between refreshes of the admin report
+    PROGRESS_REFRESH = 1
+    # seconds a player waits for their partner to respond or to continue from the review
+    # before the phase ends for the group, e.g. because the partner closed the page
+    PARTNER_TIMEOUT = 180
+    # seconds between the messages a waiting player sends, so the timeout is noticed
+    PARTNER_CHECK_INTERVAL = 30
+
+
+# states of the current trial of a group, it moves through them in this order and then
+# starts over with the next trial
+TRIAL_DRAWING = "drawing"
+TRIAL_RESPONDING = "responding"
+TRIAL_REVIEW = "review"
+# the partner left, the group's phase ended early (see TrialContext.abandon)
+TRIAL_ABANDONED = "abandoned"
 
 
 class Subsession(BaseSubsession, metaclass=AnnotationFreeMeta):
     pass
 
 
+GENDER_CHOICES = [
+    [0, 'Prefer not to say'],
+    [1, 'Female'],
+    [2, 'Male'],
+    [3, 'Non-binary'],
+    [4, 'Other']
+]
+NATIVE_LANGUAGE_CHOICES = [
+    [0, 'Danish'],
+    [1, 'English'],
+    [2, 'French'],
+    [3, 'German'],
+    [4, 'Spanish'],
+    [5, 'Swedish'],
+    [6, 'Other'],
+]
+
+
+# The forms need these fields on the player, but they are only filled in on the round of
+# their page. The answers are kept per participant in PictionarySurvey, see save_survey_answers.
 class Player(BasePlayer, metaclass=AnnotationFreeMeta):
-    ready: bool = models.BooleanField(initial=False)  # type: ignore
     age: int = models.IntegerField(
         label='Your age',
         min=18, max=99
     )  # type: ignore
     gender: int = models.IntegerField(
         label='Your gender',
-        choices=[
-            [0, 'Prefer not to say'],
-            [1, 'Female'],
-            [2, 'Male'],
-            [3, 'Non-binary'],
-            [4, 'Other']
-        ]
+        choices=GENDER_CHOICES
     )  # type: ignore
     native_language: str = models.IntegerField(
         label='What is your native language?',
-        choices=[
-            [0, 'Danish'],
-            [1, 'English'],
-            [2, 'French'],
-            [3, 'German'],
-            [4, 'Spanish'],
-            [5, 'Swedish'],
-            [6, 'Other'],
-        ]
+        choices=NATIVE_LANGUAGE_CHOICES
     )  # type: ignore
     language_other = models.StringField(
         label='If you selected "Other", please specify:',
@@ -99,34 +152,118 @@ class Player(BasePlayer, metaclass=AnnotationFreeMeta):
         label='In your drawings, how did you represent/distinguish between "could" and "should"?'
     )  # type: ignore
 
-    # workaround / hack for previous values that don't exist
-    def field_display(self, name):
-        if name in ['gender', 'native_language']:
-            val = None
-            try:
-                val = super().field_display(name)
-            except Exception:
-                pass
-            if val is None:
-                return "N/A"
-            return val
-        return super().field_display(name)
+
+# asked on the welcome page (first phase) and on the survey page (end of the last phase)
+DEMOGRAPHIC_FIELDS = ['age', 'gender', 'native_language', 'language_other']
+POST_SURVEY_FIELDS = ['i_you', 'present_past', 'could_should']
+SURVEY_FIELDS = DEMOGRAPHIC_FIELDS + POST_SURVEY_FIELDS
+# exported by their label
+SURVEY_CHOICES = {
+    'gender': dict(GENDER_CHOICES),
+    'native_language': dict(NATIVE_LANGUAGE_CHOICES),
+}
 
 class Group(BaseGroup, metaclass=AnnotationFreeMeta):
     phase: int = models.IntegerField()
-    stim_order: str = models.LongStringField(initial="[]")  # type: ignore
+    # comma separated stimulus ids in the order of the trials
+    stim_order: str = models.LongStringField(initial="")  # type: ignore
     current_trial: int = models.IntegerField(initial=1)  # type: ignore
+    # state of the current trial, only changed by transition()
+    trial_state: str = models.StringField(initial=TRIAL_DRAWING)  # type: ignore
+    # a bit (see ack_bit) for each player that continued from the review of the trial
+    acks: int = models.IntegerField(initial=0)  # type: ignore
+    # counts the transitions, for the compare-and-set in transition()
+    state_version: int = models.IntegerField(initial=0)  # type: ignore
+    # when the last transition happened
+    state_since: float = models.FloatField(initial=0.0)  # type: ignore
+
+
+class PictionarySurvey(ExtraModel, metaclass=AnnotationFreeMeta):
+    """The demographics and survey answers of a participant, once for all the phases"""
+    participant: Participant = models.Link(Participant)
+    # JSON object of field name -> answer, the fields in SURVEY_FIELDS that were answered so far
+    answers: str = models.LongStringField(initial="{}")  # type: ignore
+
+
+class PictionaryGroupEvent(ExtraModel, metaclass=AnnotationFreeMeta):
+    """Log of the trial state transitions of a group"""
+    group: Group = models.Link(Group)
+    phase: int = models.IntegerField()
+    trial: int = models.IntegerField()
+    # state_version of the group after the transition
+    version: int = models.IntegerField()
+    event: str = models.StringField()
+    from_state: str = models.StringField()
+    to_state: str = models.StringField()
+    # the player whose message caused it
+    id_in_group: int = models.IntegerField()
+    timestamp: float = models.FloatField()
 
 
 class PictionaryDrawing(ExtraModel):
+    # only used for drawings in progress sent as a full SVG,
+    # finished drawings are kept in the drawing store
     svg = models.LongStringField(initial="")  # type: ignore
+    svg_hash = models.StringField(initial="")  # type: ignore
+    svg_size = models.IntegerField(initial=0)  # type: ignore
+    # "strokes" if the store has the compact encoding from codec.py, "svg" for plain SVG text
+    svg_encoding = models.StringField(initial="svg")  # type: ignore
     completed = models.BooleanField(initial=False)  # type: ignore
     drawing_time = models.FloatField(initial=0.0)  # type: ignore
     start_timestamp = models.FloatField(initial=0.0)  # type: ignore
+    # set once when the timer starts, clients count down to it locally
+    deadline = models.FloatField(initial=0.0)  # type: ignore
+    # sequence number of the last stroke operation in the log (or of the last full update)
+    last_seq = models.IntegerField(initial=0)  # type: ignore
+
+
+class PictionaryStroke(ExtraModel, metaclass=AnnotationFreeMeta):
+    """One entry of the per-trial stroke log (a finished path, an undo or a clear)"""
+    drawing: PictionaryDrawing = models.Link(PictionaryDrawing)
+    seq: int = models.IntegerField()
+    op: str = models.StringField()
+    path: str = models.LongStringField(initial="")  # type: ignore
+    # when the server received the operation
+    created: float = models.FloatField()
+    # ms from the start of the timer when the drawer made the operation, by their clock
+    # (for add, when the stroke was started)
+    t: int = models.IntegerField()
+    # for add, the ms between the points of the stroke, see encode_times in timeline.py
+    times: str = models.LongStringField(initial="")  # type: ignore
+
+
+class PictionaryTimeline(ExtraModel, metaclass=AnnotationFreeMeta):
+    """How a finished drawing was made, packed as in timeline.py"""
+    drawing: PictionaryDrawing = models.Link(PictionaryDrawing)
+    # base64 of the packed timeline
+    data: str = models.LongStringField()
+    event_count: int = models.IntegerField()
+    # ms from the start of the timer to the last point
+    duration: int = models.IntegerField()
+
+
+class PictionaryDrawingFeatures(ExtraModel, metaclass=AnnotationFreeMeta):
+    """Geometry of a finished drawing, so analyses don't have to parse the SVGs"""
+    drawing: PictionaryDrawing = models.Link(PictionaryDrawing)
+    # the visible strokes, None if the SVG couldn't be parsed
+    stroke_count: int = models.IntegerField()
+    point_count: int = models.IntegerField()
+    ink_length: float = models.FloatField()
+    min_x: float = models.FloatField()
+    min_y: float = models.FloatField()
+    max_x: float = models.FloatField()
+    max_y: float = models.FloatField()
+    # from the stroke log, or without live_draw the operations sent with the drawing,
+    # None if the drawing was sent as a whole SVG without them (older clients)
+    undo_count: int = models.IntegerField()
+    clear_count: int = models.IntegerField()
+    # seconds from the start of the timer to the first stroke, by the drawer's clock
+    first_stroke_time: float = models.FloatField()
 
 
 class PictionaryResponse(ExtraModel):
-    response = models.StringField(initial="")  # type: ignore
+    # id of the selected stimulus, None until something is selected
+    response_id = models.IntegerField()  # type: ignore
     correct = models.BooleanField(initial=False)  # type: ignore
     completed = models.BooleanField(initial=False)  # type: ignore
 
@@ -138,49 +275,127 @@ class PictionaryTrial(ExtraModel, metaclass=AnnotationFreeMeta):
     response: PictionaryResponse = models.Link(PictionaryResponse)
     drawer: Player = models.Link(Player)
     responder: Player = models.Link(Player)
-    stim: str = models.StringField()
-    concepts: str = models.LongStringField()
+    # see the registry in stims.py
+    stim_id: int = models.IntegerField()
+    concept_mask: int = models.IntegerField()
     trial: int = models.IntegerField()
     phase: int = models.IntegerField()
     completed: bool = models.BooleanField(initial=False)  # type: ignore
 
 
+class PictionaryDatabase(ExtraModel, metaclass=AnnotationFreeMeta):
+    """A single row with a random token that tells this database apart from earlier ones, see write_behind.py"""
+    token: str = models.StringField()
+
+
+def get_database_token() -> str:
+    """The token of this database, made when it is first needed (e.g. after ``otree resetdb``)"""
+    row = PictionaryDatabase.objects_filter().first()
+    if row is None:
+        row = PictionaryDatabase.create(token=secrets.token_hex(8))
+    return row.token
+
+
+def bulk_insert(model, rows: list[dict]) -> list[int]:
+    """Inserts the rows in a single executemany and returns their ids in insertion order"""
+    last_id = db.query(func.max(model.id)).scalar() or 0
+    # DBWrapper has no bulk helpers, so use the SQLAlchemy session directly
+    db._db.bulk_insert_mappings(model, rows)
+    ids = values_flat(model.objects_filter(model.id > last_id).order_by(model.id), model.id)
+    if len(ids) != len(rows):
+        raise RuntimeError(f"Expected {len(rows)} new {model.__name__} rows, found {len(ids)}")
+    return ids
+
+
+def make_trial_rows(subsession: Subsession, group: Group, players: list[Player]) -> list[dict]:
+    """Randomizes the stimuli for the group and returns the column values of its trials"""
+    # load the stims and randomize for all phases
+    phase_stims = list(PHASE_STIM_IDS[subsession.round_number - 1]) * C.PHASE_STIM_REPEATS[subsession.round_number - 1]
+    shuffle(phase_stims)
+    group.stim_order = ",".join(map(str, phase_stims))
+    # Prepare all the rounds
+    drawing_player = randint(0, 1)
+    rows = []
+    for trial, stim in enumerate(phase_stims):
+        rows.append(dict(
+            subsess_id=subsession.id,
+            group_id=group.id,
+            stim_id=stim,
+            concept_mask=STIMULI[stim].concept_mask,
+            phase=subsession.round_number,
+            drawer_id=players[drawing_player].id,
+            responder_id=players[1 - drawing_player].id,
+            trial=trial + 1,
+            completed=False,
+        ))
+        # flip the drawing player
+        drawing_player = 1 - drawing_player
+    return rows
+
+
+def create_trials(rows: list[dict]):
+    """Creates the trials together with their drawings and responses in three bulk inserts"""
+    drawing_ids = bulk_insert(PictionaryDrawing, [{} for _ in rows])
+    response_ids = bulk_insert(PictionaryResponse, [{} for _ in rows])
+    for row, drawing_id, response_id in zip(rows, drawing_ids, response_ids):
+        row["drawing_id"] = drawing_id
+        row["response_id"] = response_id
+    db._db.bulk_insert_mappings(PictionaryTrial, rows)
+
+
+def group_consecutive_players(subsession: Subsession):
+    """Puts the players in groups of C.PLAYERS_PER_GROUP in order, like oTree does without a Matching page.
+
+    set_group_matrix would do the same but commits once per group.
+    """
+    # same order as id_in_subsession, which would load every participant
+    players = sorted(subsession.get_players(), key=lambda p: p.participant_id)
+    old_group_ids = [group.id for group in subsession.get_groups()]
+    group_ids = bulk_insert(Group, [
+        dict(subsession_id=subsession.id, session_id=subsession.session_id,
+             round_number=subsession.round_number, id_in_subsession=i + 1)
+        for i in range(len(players) // C.PLAYERS_PER_GROUP)
+    ])
+    db._db.bulk_update_mappings(Player, [
+        dict(id=player.id, group_id=group_ids[i // C.PLAYERS_PER_GROUP], id_in_group=i % C.PLAYERS_PER_GROUP + 1)
+        for i, player in enumerate(players)
+    ])
+    Group.objects_filter(Group.id.in_(old_group_ids)).delete(synchronize_session=False)
+    # the players were changed behind the ORM's back
+    for player in players:
+        db._db.expire(player)
+
+
+def is_matching_by_arrival(session) -> bool:
+    return session.config.get("match_by_arrival", False)
+
+
 # runs on each round
 def creating_session(subsession: Subsession):
-    # players: list[Player] = subsession.get_players()
-    print(f"Loading stimuli and randomizing order for round {subsession.round_number}")
+    # made here so it is committed before the write-behind journal is written for this database
+    get_database_token()
+    if is_matching_by_arrival(subsession.session):
+        # pairs are formed on the Matching page and their trials created when they are
+        logger.info("Matching by arrival time, no trials created for round %s", subsession.round_number)
+        return
 
-    # load the stims and randomize for all phases
-    phase_stims = PHASES[subsession.round_number - 1] * C.PHASE_STIM_REPEATS[subsession.round_number - 1]
+    # Matching is the first page, so oTree put everyone in one group
+    group_consecutive_players(subsession)
 
-    groups = subsession.get_groups()
+    logger.info("Loading stimuli and randomizing order for round %s", subsession.round_number)
+
+    # load all players at once instead of once per group
+    group_players: dict[int, list[Player]] = {}
+    for player in sorted(subsession.get_players(), key=lambda p: p.id_in_group):
+        group_players.setdefault(player.group_id, []).append(player)
+
+    rows = []
     group: Group
-    for group in groups:
-        players = group.get_players()
-        shuffle(phase_stims)
-        group.stim_order = ", ".join([stim[0] for stim in phase_stims])
-        # Prepare all the rounds
-        drawing_player = randint(0, 1)
-        print(f"Creating trials for phase {subsession.round_number}")
-        for trial, stim in enumerate(phase_stims):
-            print(f"{trial + 1}...", end="")
-            # create the round
-            PictionaryTrial().create(
-                subsess = subsession,
-                group = group,
-                drawing = PictionaryDrawing().create(),
-                response = PictionaryResponse().create(),
-                stim = stim[0],
-                concepts = ", ".join(stim[1]),
-                phase = subsession.round_number,
-                drawer = players[drawing_player],
-                responder = players[1 - drawing_player],
-                trial = trial + 1,
-                completed = False,
-            )
-            # flip the drawing player
-            drawing_player = 1 - drawing_player
-    print("done")
+    for group in subsession.get_groups():
+        rows.extend(make_trial_rows(subsession, group, group_players[group.id]))
+    logger.info("Creating %s trials for phase %s", len(rows), subsession.round_number)
+    create_trials(rows)
+    logger.info("done")
 
 
 # returns the partner of the player
@@ -188,59 +403,188 @@ def get_partner(player: Player):
     return player.get_others_in_group()[0]
 
 
+# player id -> when they were first seen on the Matching page
+_match_arrivals: dict[int, float] = {}
+
+
+def group_by_arrival_time_method(subsession: Subsession, waiting_players: list[Player]):
+    """Picks the players on the Matching page that form the next group.
+
+    In the first phase any two players are paired. In the later phases
+    players wait for their partner of the previous phase, which is still their
+    group until they are matched again. After C.REMATCH_AFTER seconds two
+    players whose partners are missing are paired with each other, and after
+    C.MATCH_GIVE_UP_AFTER seconds a player without a partner continues alone.
+    The wait page reloads itself now and then, so this also runs while nobody arrives.
+    """
+    now = time.time()
+    for player in waiting_players:
+        _match_arrivals.setdefault(player.id, now)
+    players = find_match(subsession, waiting_players, now)
+    for player in players:
+        _match_arrivals.pop(player.id, None)
+    return players
+
+
+def find_match(subsession: Subsession, waiting_players: list[Player], now: float) -> list[Player]:
+    def waited(player: Player) -> float:
+        return now - _match_arrivals[player.id]
+
+    if subsession.round_number == 1:
+        if len(waiting_players) >= C.PLAYERS_PER_GROUP:
+            return waiting_players[:C.PLAYERS_PER_GROUP]
+    else:
+        waiting = {player.participant_id: player for player in waiting_players}
+        orphans = []
+        for player in waiting_players:
+            partners = player.get_others_in_group()
+            if partners and all(partner.participant_id in waiting for partner in partners):
+                # keep the order of the previous phase
+                return sorted([player, *(waiting[partner.participant_id] for partner in partners)],
+                              key=lambda p: p.id_in_group)
+            if waited(player) >= C.REMATCH_AFTER:
+                orphans.append(player)
+        if len(orphans) >= C.PLAYERS_PER_GROUP:
+            logger.info("Re-pairing players %s", [player.id for player in orphans[:C.PLAYERS_PER_GROUP]])
+            metrics.incr("rematched_groups")
+            return orphans[:C.PLAYERS_PER_GROUP]
+
+    for player in waiting_players:
+        if waited(player) >= C.MATCH_GIVE_UP_AFTER:
+            logger.info("No partner found for player %s", player.id)
+            metrics.incr("unmatched_players")
+            return [player]
+    return []
+
+
+# whether the player has someone to play with, a player that wasn't matched with
+# anyone is in a group of their own and skips the rest of the drawing phases
+def has_partner(player: Player) -> bool:
+    if not is_matching_by_arrival(player.session):
+        # the pairs are fixed, a player whose partner left skips the rest as well
+        return not player.participant.vars.get("partner_left", False)
+    return len(player.get_others_in_group()) > 0
+
+
 # PAGES
+class Matching(WaitPage):
+    group_by_arrival_time = True
+
+    @staticmethod
+    def is_displayed(player: Player):
+        return is_matching_by_arrival(player.session) and has_partner(player)
+
+    @staticmethod
+    def after_all_players_arrive(group: Group):
+        players = sorted(group.get_players(), key=lambda p: p.id_in_group)
+        if len(players) < C.PLAYERS_PER_GROUP:
+            return
+        rows = make_trial_rows(group.subsession, group, players)
+        logger.info("Creating %s trials for group %s in phase %s", len(rows), group.id, group.round_number)
+        create_trials(rows)
+
+
+# participant id -> survey answers, see load_survey_answers
+_survey_answers: dict[int, dict] = {}
+
+
+def save_survey_answers(player: Player, fields: list[str]):
+    """Adds the answers the player gave on a form page to the survey record of their participant"""
+    answers = {name: player.field_maybe_none(name) for name in fields}
+    rows = PictionarySurvey.filter(participant=player.participant)
+    if rows:
+        answers = {**json_loads(rows[0].answers), **answers}
+        rows[0].answers = json_dumps(answers)
+    else:
+        PictionarySurvey.create(participant=player.participant, answers=json_dumps(answers))
+    _survey_answers[player.participant_id] = answers
+
+
+def load_survey_answers(participant_ids) -> dict[int, dict]:
+    """The survey answers of the participants, from the cache and with one query for the others"""
+    result = {}
+    missing = []
+    for participant_id in participant_ids:
+        if participant_id in _survey_answers:
+            result[participant_id] = _survey_answers[participant_id]
+        else:
+            result[participant_id] = {}
+            missing.append(participant_id)
+    if missing:
+        rows = (
+            db.query(PictionarySurvey.participant_id, PictionarySurvey.answers)
+            .filter(PictionarySurvey.participant_id.in_(missing))
+        )
+        for participant_id, answers in rows:
+            result[participant_id] = answers = json_loads(answers)
+            # the answers still to come may be saved by another process, e.g. when exporting from otree shell
+            if all(name in answers for name in SURVEY_FIELDS):
+                _survey_answers[participant_id] = answers
+    return result
+
+
+def survey_values(answers: dict, missing_choice=None) -> list:
+    """The answers in the order of SURVEY_FIELDS, choices by their label"""
+    values = []
+    for name in SURVEY_FIELDS:
+        value = answers.get(name)
+        if name in SURVEY_CHOICES:
+            value = SURVEY_CHOICES[name].get(value, missing_choice)
+        values.append(value)
+    return values
+
+
+def load_participant_surveys(session_code: str | None = None) -> list[tuple[str, str, dict]]:
+    """The (participant code, session code, survey answers) of every participant of the app"""
+    query = (
+        db.query(Participant.id, Participant.code, Session.code)
+        .join(Player, Player.participant_id == Participant.id)
+        .join(Session, Participant.session_id == Session.id)
+        .filter(Player.round_number == 1)
+        .order_by(Participant.id)
+    )
+    if session_code is not None:
+        query = query.filter(Session.code == session_code)
+    participants = query.all()
+    answers = load_survey_answers(participant_id for participant_id, _, _ in participants)
+    return [(code, session, answers[participant_id]) for participant_id, code, session in participants]
+
+
 class ExperimentWelcome(Page):
     form_model = 'player'
-    form_fields = ['age', 'gender', 'native_language', 'language_other']
+    form_fields = DEMOGRAPHIC_FIELDS
     @staticmethod
     def is_displayed(player: Player):
         # only show the welcome page on the first round of the FIRST phase
         return player.subsession.round_number == 1
 
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        save_survey_answers(player, DEMOGRAPHIC_FIELDS)
+
 
 class PostExperimentSurvey(Page):
     form_model = 'player'
-    form_fields = ['i_you', 'present_past', 'could_should']
+    form_fields = POST_SURVEY_FIELDS
     @staticmethod
     def is_displayed(player: Player):
         # only show the survey at the end of the last last phase
         return player.subsession.round_number == C.NUM_ROUNDS
-    
+
     @staticmethod
     def before_next_page(player: Player, timeout_happened):
-        # add the post experiment survey data to all all arounds
-        # hacky but it works
-        
-        # round one has demographic data, but post experiment survey
-        r1p = player.in_round(1)
-
-        # round 2 player has neither
-        r2p = player.in_round(2)
+        save_survey_answers(player, POST_SURVEY_FIELDS)
 
-        r1p.i_you = player.i_you
-        r1p.present_past = player.present_past
-        r1p.could_should = player.could_should
-        
-        r2p.age = r1p.age
-        r2p.gender = r1p.gender
-        r2p.native_language = r1p.native_language
-        r2p.language_other = r1p.language_other
-        r2p.i_you = player.i_you
-        r2p.present_past = player.present_past
-        r2p.could_should = player.could_should
-
-        # round 3 player has no demographic data, but post experiment survey
-        player.age = r1p.age
-        player.gender = r1p.gender
-        player.native_language = r1p.native_language
-        player.language_other = r1p.language_other
-        
 
 class PhaseInstructions(Page):
-    pass
+    @staticmethod
+    def is_displayed(player: Player):
+        return has_partner(player)
 
 class Waiting(WaitPage):
-    pass
+    @staticmethod
+    def is_displayed(player: Player):
+        return has_partner(player)
 
 class ExperimentThankYou(Page):
     @staticmethod
@@ -249,26 +593,751 @@ class ExperimentThankYou(Page):
 
 # determine if the current player is the drawer without messing up the data
 def is_drawer(player: Player, trial: PictionaryTrial):
-    return player.id_in_group == trial.drawer.id_in_group
+    # compare the foreign key so the drawer doesn't have to be loaded
+    return trial.drawer_id == player.id
 
 
 def is_phase_complete(player: Player):
-    complete = player.group.current_trial > C.NUM_PHASE_TRIALS[player.subsession.round_number - 1]
-    print("is phase complete", complete)
+    complete = player.group.current_trial > C.NUM_PHASE_TRIALS[player.round_number - 1]
+    trace.debug("is phase complete %s", complete)
     return complete
 
-def get_current_trial(player: Player) -> PictionaryTrial:
-    print("getting current trial", player.group.current_trial)
-    return PictionaryTrial.filter(group=player.group, subsess=player.subsession, trial=player.group.current_trial)[0]
 
+# group id -> (current_trial, trial id), so the trial can be loaded by primary key
+_current_trial_ids: dict[int, tuple[int, int]] = {}
+
+# group id -> when the responder first waited for the drawer, for a phase without a transition yet
+_waiting_since: dict[int, float] = {}
+
+
+class TrialContext:
+    """The current trial of a player and everything linked to it, loaded once per live message.
+
+    The trial is loaded together with its drawing and response in a single query,
+    the partner is only loaded when it is actually needed.
+    """
+
+    def __init__(self, player: Player):
+        self.player = player
+        self.group: Group = player.group
+        self.phase: int = player.round_number
+        self.trial: PictionaryTrial | None = None
+        self._partner: Player | None = None
+        if not self.phase_complete:
+            self.trial = self._load_trial()
+
+    @property
+    def phase_complete(self) -> bool:
+        return self.group.current_trial > C.NUM_PHASE_TRIALS[self.phase - 1]
+
+    def _load_trial(self) -> PictionaryTrial:
+        current_trial = self.group.current_trial
+        query = PictionaryTrial.objects_filter().options(
+            joinedload(PictionaryTrial.drawing),
+            joinedload(PictionaryTrial.response),
+        )
+        cached = _current_trial_ids.get(self.group.id)
+        if cached is not None and cached[0] == current_trial:
+            trial = query.filter_by(id=cached[1]).one()
+        else:
+            trial = query.filter_by(group_id=self.group.id, trial=current_trial).one()
+            _current_trial_ids[self.group.id] = (current_trial, trial.id)
+        # changes that are only in the write-behind buffer so far
+        get_write_behind().load(trial)
+        return trial
+
+    @property
+    def drawing(self) -> PictionaryDrawing:
+        return self.trial.drawing
+
+    @property
+    def response(self) -> PictionaryResponse:
+        return self.trial.response
+
+    @property
+    def is_drawer(self) -> bool:
+        return is_drawer(self.player, self.trial)
+
+    @property
+    def partner_id(self) -> int:
+        # groups are always pairs
+        return 3 - self.player.id_in_group
+
+    @property
+    def drawer_id(self) -> int:
+        return self.player.id_in_group if self.is_drawer else self.partner_id
+
+    @property
+    def responder_id(self) -> int:
+        return self.partner_id if self.is_drawer else self.player.id_in_group
+
+    @property
+    def partner(self) -> Player:
+        if self._partner is None:
+            self._partner = get_partner(self.player)
+        return self._partner
+
+    @property
+    def state(self) -> str:
+        return self.group.trial_state
+
+    @property
+    def ack_bit(self) -> int:
+        return 1 << (self.player.id_in_group - 1)
+
+    @property
+    def acknowledged(self) -> bool:
+        """Whether the player already continued from the review of the current trial"""
+        return self.state == TRIAL_REVIEW and bool(self.group.acks & self.ack_bit)
+
+    def advance(self) -> bool:
+        """Completes the current trial and moves the group on to the next one, False if it already was"""
+        if not transition(self, "advance", TRIAL_REVIEW, TRIAL_DRAWING, acks=0,
+                          current_trial=self.group.current_trial + 1):
+            return False
+        get_write_behind().flush(self.trial)
+        get_write_behind().discard(self.trial)
+        self.trial.completed = True
+        _current_trial_ids.pop(self.group.id, None)
+        _spectators.pop(self.group.id, None)
+        _waiting_since.pop(self.group.id, None)
+        return True
+
+    def partner_gone(self) -> bool:
+        """Whether the player has waited for their partner to draw, respond or continue for longer than C.PARTNER_TIMEOUT"""
+        if self.state == TRIAL_DRAWING:
+            # once the drawer started, the drawing has its own timer
+            waiting = not self.is_drawer and self.drawing.deadline == 0.0
+        elif self.state == TRIAL_RESPONDING:
+            waiting = self.is_drawer
+        elif self.state == TRIAL_REVIEW:
+            waiting = self.acknowledged
+        else:
+            return False
+        if not waiting:
+            return False
+        since = self.group.state_since
+        if not since:
+            # the first trial of the phase, counted from the first message of the waiting player
+            since = _waiting_since.setdefault(self.group.id, time.time())
+        return time.time() - since > C.PARTNER_TIMEOUT
+
+    def abandon(self) -> bool:
+        """Ends the phase for the group because the partner left, False if it already was"""
+        if not transition(self, "abandon", self.state, TRIAL_ABANDONED, acks=0,
+                          current_trial=C.NUM_PHASE_TRIALS[self.phase - 1] + 1):
+            return False
+        get_write_behind().flush(self.trial)
+        get_write_behind().discard(self.trial)
+        _current_trial_ids.pop(self.group.id, None)
+        _spectators.pop(self.group.id, None)
+        _waiting_since.pop(self.group.id, None)
+        # with match_by_arrival they can be paired with someone else in the next phase
+        for player in self.group.get_players():
+            player.participant.vars["partner_left"] = True
+        return True
+
+    def acknowledge_review(self) -> bool:
+        """Records that the player continued from the review, returns True once both players have"""
+        acks = self.group.acks | self.ack_bit
+        if acks == ALL_ACKS:
+            return self.advance()
+        if acks != self.group.acks:
+            transition(self, "continue", TRIAL_REVIEW, TRIAL_REVIEW, acks=acks)
+        # sent again while waiting for the partner, nothing to write
+        return False
+
+
+# ack bits of all the players of a group
+ALL_ACKS = (1 << C.PLAYERS_PER_GROUP) - 1
+
+
+def transition(ctx: TrialContext, event: str, from_state: str, to_state: str, **changes) -> bool:
+    """Moves the group's trial from from_state to to_state, with any other Group fields in changes.
+
+    The group row is only updated if its state_version is still the one that
+    was read, so of two messages that try to make the same transition only
+    the first does. Returns False if the trial wasn't in from_state or
+    another message changed the state first, in which case the group is
+    reloaded. Each transition is logged as a PictionaryGroupEvent.
+    """
+    group = ctx.group
+    if group.trial_state != from_state:
+        return False
+    version = group.state_version
+    now = time.time()
+    changes.update(trial_state=to_state, state_version=version + 1, state_since=now)
+    updated = (
+        Group.objects_filter(id=group.id, state_version=version)
+        .update(changes, synchronize_session=False)
+    )
+    if not updated:
+        logger.warning("group %s changed by another message during %s", group.id, event)
+        metrics.incr("state_conflicts")
+        db._db.refresh(group)
+        return False
+    # already written by the update above
+    for key, value in changes.items():
+        set_committed_value(group, key, value)
+    progress = get_progress().get(group.id)
+    if progress is not None:
+        progress.update_trial(group.current_trial, to_state)
+    PictionaryGroupEvent.create(
+        group=group,
+        phase=ctx.phase,
+        trial=ctx.trial.trial,
+        version=version + 1,
+        event=event,
+        from_state=from_state,
+        to_state=to_state,
+        id_in_group=ctx.player.id_in_group,
+        timestamp=now,
+    )
+    return True
+
+
+# shown in the admin report for groups that finished the phase
+PHASE_COMPLETE = "phase complete"
+
+
+def track_progress(ctx: TrialContext):
+    """Updates the admin report's progress index with a live message of the player, see progress.py"""
+    index = get_progress()
+    progress = index.get(ctx.group.id)
+    if progress is None:
+        progress = index.add(load_group_progress(ctx))
+    progress.update_trial(ctx.group.current_trial, PHASE_COMPLETE if ctx.phase_complete else ctx.state)
+    index.message(ctx.player)
+
+
+def load_group_progress(ctx: TrialContext) -> GroupProgress:
+    """The progress of a group the index doesn't have yet, e.g. after a restart, with two small queries"""
+    group = ctx.group
+    progress = GroupProgress(group.id, group.subsession_id, group.id_in_subsession, C.NUM_PHASE_TRIALS[ctx.phase - 1])
+    progress.participants = dict(
+        db.query(Player.id_in_group, Participant.code)
+        .join(Participant, Player.participant_id == Participant.id)
+        .filter(Player.group_id == group.id)
+        .all()
+    )
+    responses = (
+        db.query(PictionaryResponse.correct, func.count(PictionaryResponse.id))
+        .join(PictionaryTrial, PictionaryTrial.response_id == PictionaryResponse.id)
+        .filter(PictionaryTrial.group_id == group.id, PictionaryResponse.completed == True)  # noqa: E712
+        .group_by(PictionaryResponse.correct)
+        .all()
+    )
+    for correct, count in responses:
+        progress.responses += count
+        progress.correct += count if correct else 0
+    return progress
+
+
+def append_strokes(trial: PictionaryTrial, seq: int, ops: list) -> bool:
+    """Appends the operations to the stroke log of the trial's drawing.
+
+    ``seq`` is the sequence number of the first operation, the following
+    operations are numbered consecutively. Operations that are already in the
+    log are skipped. Returns False if there is a gap between the log and the
+    operations, in which case nothing is stored and the client has to resend.
+    The new rows go to the write-behind buffer, see write_behind.py.
+    """
+    drawing = trial.drawing
+    if seq > drawing.last_seq + 1:
+        return False
+    now = datetime.datetime.now().timestamp()
+    # operations from clients that don't send their time get the time they arrived
+    received_t = round((now - drawing.start_timestamp) * 1000) if drawing.start_timestamp else 0
+    rows = []
+    last_seq = drawing.last_seq
+    for offset, op in enumerate(ops):
+        op_seq = seq + offset
+        if op_seq <= last_seq:
+            continue
+        # an invalid operation still uses up its sequence number, so the log has no gap
+        last_seq = op_seq
+        if not is_valid_op(op):
+            logger.warning("ignoring invalid stroke operation %s for drawing %s", op_seq, drawing.id)
+            metrics.incr("invalid_stroke_ops")
+            continue
+        t, times = get_op_times(op, received_t)
+        rows.append(dict(
+            drawing_id=drawing.id,
+            seq=op_seq,
+            op=op["op"],
+            path=get_op_path(op) if op["op"] == OP_ADD else "",
+            created=now,
+            t=t,
+            times=times,
+        ))
+    if last_seq > drawing.last_seq:
+        get_write_behind().add_strokes(trial, rows, last_seq)
+    return True
+
+
+def apply_late_drawing(trial: PictionaryTrial, data: dict) -> tuple[str | None, list[tuple] | None]:
+    """Stores the drawing or strokes of a drawer's message that arrived after the deadline.
+
+    Called when the drawing is closed because of the message, so nothing the
+    drawer sent is lost. Returns the SVG and the stroke log sent with it (see
+    get_sent_drawing), or None for the SVG if the drawing is built from the
+    stroke log.
+    """
+    event = data.get("event")
+    if event == "strokes" and data.get("ops"):
+        if not append_strokes(trial, data["seq"], data["ops"]):
+            # too late to ask for the missing operations
+            logger.warning("closing drawing %s without strokes after %s", trial.drawing.id, trial.drawing.last_seq)
+            metrics.incr("late_strokes_lost")
+    elif event in ("update", "drawing_complete") and data.get("drawing"):
+        seq = data.get("seq")
+        if event == "drawing_complete" or seq is None or seq > trial.drawing.last_seq:
+            return get_sent_drawing(data)
+    return None, None
+
+
+def get_sent_drawing(data: dict) -> tuple[str, list[tuple] | None]:
+    """The SVG of a message with the whole drawing, and the stroke log of the operations sent with it.
 
-def get_stim_list(player: Player, randomize=False):
-    stims = PHASES[player.subsession.round_number - 1]
-    # we only need the first element of each stim
-    stims = [stim[0] for stim in stims]
+    Without live_draw the drawer sends the operations with drawing_complete,
+    the log is None if the client didn't send any.
+    """
+    svg = base64.b64decode(data["drawing"]).decode('utf-8')
+    if not isinstance(data.get("ops"), list):
+        return svg, None
+    log = []
+    for op in data["ops"]:
+        try:
+            if not is_valid_op(op):
+                raise ValueError(op)
+            path = get_op_path(op) if op["op"] == OP_ADD else ""
+        except ValueError:
+            metrics.incr("invalid_stroke_ops")
+            continue
+        log.append((op["op"], path, *get_op_times(op, 0)))
+    return svg, log
+
+
+def get_op_times(op: dict, default_t: int) -> tuple[int, str]:
+    """The time (ms) of an operation and for add the times of its points, as sent by the client"""
+    t = op["t"] if isinstance(op.get("t"), int) else default_t
+    times = op["times"] if op["op"] == OP_ADD and isinstance(op.get("times"), str) else ""
+    return t, times
+
+
+def get_op_path(op: dict) -> str:
+    """Returns the <path> element of an add operation"""
+    if "points" in op:
+        return path_element(decode_points(base64.b64decode(op["points"])))
+    return op["path"]
+
+
+class SpectatorState:
+    """What has been relayed to the responder of a group in spectator mode"""
+
+    def __init__(self, trial: int, seq: int):
+        self.trial = trial
+        # last operation sent to the responder, and the last one they have rendered
+        self.sent_seq = seq
+        self.acked_seq = seq
+        # set when operations were held back, the responder then gets the whole drawing
+        self.lagging = False
+
+
+# group id -> spectator state of the current trial
+_spectators: dict[int, SpectatorState] = {}
+
+# session id -> whether the responder follows the drawing live
+_spectate_sessions: dict[int, bool] = {}
+
+
+def is_spectating(player: Player) -> bool:
+    spectate = _spectate_sessions.get(player.session_id)
+    if spectate is None:
+        # the session config doesn't change, so it is only read once
+        config = player.session.config
+        spectate = bool(config.get("spectate", False) and config.get("live_draw", True))
+        _spectate_sessions[player.session_id] = spectate
+    return spectate
+
+
+def start_spectating(ctx: TrialContext):
+    _spectators[ctx.group.id] = SpectatorState(ctx.trial.trial, ctx.drawing.last_seq)
+
+
+def relay_strokes(ctx: TrialContext, seq: int, ops: list) -> dict | None:
+    """The message forwarding new operations to the responder, None if there is nothing to send"""
+    state = _spectators.get(ctx.group.id)
+    if state is None or state.trial != ctx.trial.trial:
+        return None
+    # operations relayed but not confirmed by the responder yet
+    in_flight = state.sent_seq - state.acked_seq
+    if state.lagging or seq > state.sent_seq + 1 or in_flight > C.SPECTATE_WINDOW:
+        if in_flight <= 0:
+            # no ack is coming that would catch them up, so do it now
+            return spectator_sync(ctx, state)
+        # the responder is too far behind, hold everything back until they catch up
+        state.lagging = True
+        metrics.incr("spectate_held_back")
+        return None
+    # skip operations that were relayed before (e.g. resent by the drawer)
+    start = state.sent_seq + 1 - seq
+    if start >= len(ops):
+        return None
+    state.sent_seq = ctx.drawing.last_seq
+    return dict(
+        event='strokes',
+        trial=state.trial,
+        seq=seq + start,
+        ops=ops[start:],
+        sent_at=datetime.datetime.now().timestamp(),
+    )
+
+
+def spectator_sync(ctx: TrialContext, state: SpectatorState) -> dict:
+    """The whole drawing so far, replacing everything the responder has missed"""
+    state.lagging = False
+    state.sent_seq = ctx.drawing.last_seq
+    metrics.incr("spectate_syncs")
+    return dict(
+        event='spectate_sync',
+        trial=state.trial,
+        seq=state.sent_seq,
+        drawing=base64.b64encode(get_drawing_svg(ctx.drawing).encode('utf-8')).decode('utf-8'),
+        sent_at=datetime.datetime.now().timestamp(),
+    )
+
+
+def spectator_ack(player: Player, data: dict) -> dict | None:
+    """Handles the responder confirming that relayed operations have been rendered"""
+    state = _spectators.get(player.group_id)
+    if state is None or data.get("trial") != state.trial:
+        return None
+    state.acked_seq = max(state.acked_seq, data.get("seq", 0))
+    if data.get("sent_at"):
+        # relayed by the server until rendered and confirmed by the responder
+        metrics.observe("spectate_latency", (datetime.datetime.now().timestamp() - data["sent_at"]) * 1000)
+    if data.get("render_ms") is not None:
+        metrics.observe("spectate_render", data["render_ms"])
+    if not (state.lagging or data.get("gap")):
+        return None
+    ctx = TrialContext(player)
+    if ctx.phase_complete or ctx.trial.completed or ctx.trial.trial != state.trial:
+        return None
+    return {player.id_in_group: spectator_sync(ctx, state)}
+
+
+def load_stroke_log(drawing: PictionaryDrawing) -> list[tuple]:
+    """The (op, path, t, times) of every operation in the stroke log of the drawing"""
+    strokes = (
+        db.query(PictionaryStroke.op, PictionaryStroke.path, PictionaryStroke.t, PictionaryStroke.times)
+        .filter(PictionaryStroke.drawing_id == drawing.id)
+        .order_by(PictionaryStroke.seq)
+        .all()
+    )
+    # the operations still in the write-behind buffer come after the stored ones
+    strokes += [
+        (row["op"], row["path"], row["t"], row["times"]) for row in get_write_behind().pending_strokes(drawing.id)
+    ]
+    return strokes
+
+
+def build_drawing_svg(drawing: PictionaryDrawing, log: list[tuple] | None = None) -> str:
+    """Builds the full SVG of the drawing from its stroke log"""
+    if log is None:
+        log = load_stroke_log(drawing)
+    return build_svg(replay((op, path) for op, path, *_ in log))
+
+
+def save_drawing_timeline(drawing: PictionaryDrawing, log: list[tuple]):
+    """Packs the stroke log with the times of the strokes, see timeline.py"""
+    events = []
+    for op, path, t, times in log:
+        t = t or 0
+        points: list = []
+        point_times: list = []
+        if op == OP_ADD:
+            try:
+                points = parse_path_element(path)[1]
+                point_times = decode_times(times, t) if times else []
+            except ValueError:
+                # not made by our Drawer, the stroke appears at once
+                logger.warning("invalid stroke in the timeline of drawing %s", drawing.id)
+        events.append(TimelineEvent(op, t, points, point_times))
+    data = encode_timeline(events)
+    PictionaryTimeline.create(
+        drawing=drawing,
+        data=base64.b64encode(data).decode('ascii'),
+        event_count=len(events),
+        duration=max((event.times[-1] if event.times else event.t for event in events), default=0),
+    )
+
+
+def get_drawing_timeline(drawing: PictionaryDrawing) -> bytes | None:
+    """The packed timeline of a finished drawing, None if it was sent as a whole SVG without its operations"""
+    rows = PictionaryTimeline.filter(drawing=drawing)
+    return base64.b64decode(rows[0].data) if rows else None
+
+
+def save_drawing_svg(drawing: PictionaryDrawing, svg: str):
+    """Puts the SVG in the drawing store, the drawing only keeps its hash and size"""
+    if svg:
+        try:
+            data = encode_svg(svg)
+            drawing.svg_encoding = "strokes"
+        except ValueError:
+            # not made by our Drawer, keep it as it is
+            data = svg.encode('utf-8')
+            drawing.svg_encoding = "svg"
+        drawing.svg_hash = get_drawing_store().put(data)
+        drawing.svg_size = len(data)
+    else:
+        drawing.svg_hash = ""
+        drawing.svg_size = 0
+    drawing.svg = ""
+
+
+def get_drawing_svg(drawing: PictionaryDrawing) -> str:
+    """Returns the SVG from the drawing store, or what there is of a drawing in progress"""
+    if drawing.svg_hash:
+        data = get_drawing_store().get(drawing.svg_hash)
+        if drawing.svg_encoding == "strokes":
+            return decode_svg(data)
+        return data.decode('utf-8')
+    if drawing.svg == "" and drawing.last_seq > 0:
+        return build_drawing_svg(drawing)
+    return drawing.svg
+
+
+def get_stroke_tail(drawing: PictionaryDrawing, seq: int) -> list[dict]:
+    """The operations of the stroke log after seq, in the format the client replays"""
+    rows = [
+        (stroke.op, stroke.path)
+        for stroke in PictionaryStroke.objects_filter(PictionaryStroke.seq > seq, drawing=drawing).order_by(PictionaryStroke.seq)
+    ]
+    rows += [(row["op"], row["path"]) for row in get_write_behind().pending_strokes(drawing.id) if row["seq"] > seq]
+    return [dict(op=op, path=path) if op == OP_ADD else dict(op=op) for op, path in rows]
+
+
+def get_init_drawing(drawing: PictionaryDrawing, have) -> dict:
+    """The drawing fields of an init message, with only what the client doesn't have yet.
+
+    ``have`` is the version of the drawing the client kept from earlier messages
+    (drawing_id, seq and digest). ``drawing_sync`` tells the client what it got:
+    ``unchanged`` if it has the current version, ``tail`` with the stroke
+    operations after its seq, or ``full`` with the whole drawing.
+    """
+    fields = dict(drawing_id=drawing.id, seq=drawing.last_seq, digest=drawing.svg_hash)
+    sync = "full"
+    if isinstance(have, dict) and have.get("drawing_id") == drawing.id:
+        have_seq = have.get("seq")
+        if drawing.completed:
+            if drawing.svg_hash and have.get("digest") == drawing.svg_hash:
+                sync = "unchanged"
+        elif not have.get("digest") and isinstance(have_seq, int):
+            if have_seq == drawing.last_seq:
+                sync = "unchanged"
+            elif 0 <= have_seq < drawing.last_seq and drawing.svg == "":
+                # only a drawing made of stroke operations has a tail
+                sync = "tail"
+    metrics.incr(f"init_drawing_{sync}")
+    if sync == "tail":
+        return dict(fields, drawing_sync=sync, ops=get_stroke_tail(drawing, have["seq"]))
+    if sync == "unchanged":
+        return dict(fields, drawing_sync=sync)
+    return dict(
+        fields,
+        drawing_sync=sync,
+        drawing=base64.b64encode(get_drawing_svg(drawing).encode('utf-8')).decode('utf-8'),
+    )
+
+
+def start_drawing_timer(trial: PictionaryTrial):
+    start_timestamp = datetime.datetime.now().timestamp()
+    get_write_behind().update_drawing(
+        trial, start_timestamp=start_timestamp, deadline=start_timestamp + C.DRAWING_TIME
+    )
+
+
+def get_time_left(drawing: PictionaryDrawing) -> float:
+    if drawing.deadline == 0.0:
+        # the timer has not been started yet
+        return C.DRAWING_TIME
+    return max(drawing.deadline - datetime.datetime.now().timestamp(), 0.0)
+
+
+def is_drawing_expired(drawing: PictionaryDrawing) -> bool:
+    return (
+        not drawing.completed
+        and drawing.deadline != 0.0
+        and datetime.datetime.now().timestamp() > drawing.deadline + C.DRAWING_TIME_GRACE
+    )
+
+
+def get_timer_fields(drawing: PictionaryDrawing) -> dict:
+    """The timer values sent to the clients, so they can count down without asking again"""
+    return dict(
+        deadline=drawing.deadline,
+        server_time=datetime.datetime.now().timestamp(),
+        time_left=get_time_left(drawing),
+        grace=C.DRAWING_TIME_GRACE,
+        # the stroke times are counted from here
+        started=drawing.start_timestamp,
+    )
+
+
+def complete_drawing(drawing: PictionaryDrawing, svg: str | None = None, log: list[tuple] | None = None) -> str:
+    """Finishes the drawing and returns the SVG.
+
+    Without an SVG it is built from the stroke log. The timeline is made from
+    the log, which is loaded if there is no SVG, a sent SVG may come with the
+    log of its operations (see get_sent_drawing).
+    """
+    now = datetime.datetime.now().timestamp()
+    drawing.drawing_time = min(now, drawing.deadline) - drawing.start_timestamp
+    if svg is None:
+        # the same stroke log gives the drawing and how it was made
+        log = load_stroke_log(drawing)
+        svg = build_drawing_svg(drawing, log)
+    if log is not None:
+        save_drawing_timeline(drawing, log)
+    save_drawing_svg(drawing, svg)
+    drawing.completed = True
+    save_drawing_features(drawing, svg, log)
+    return svg
+
+
+def compute_drawing_features(drawing: PictionaryDrawing, svg: str, log: list[tuple] | None = None) -> dict:
+    """The geometry of the SVG, and the undo / clear counts and first stroke time of the stroke log.
+
+    The stroke log is queried unless it is given (see load_stroke_log). A
+    drawing sent as a whole SVG without its operations has no stroke log, its
+    stroke log features are left out.
+    """
+    strokes = strokes_from_svg(svg)
+    features = geometry(strokes) if strokes is not None else {}
+    if log is None:
+        # (op, count, earliest t) in one query over the stroke log
+        ops = (
+            db.query(PictionaryStroke.op, func.count(PictionaryStroke.id), func.min(PictionaryStroke.t))
+            .filter(PictionaryStroke.drawing_id == drawing.id)
+            .group_by(PictionaryStroke.op)
+            .all()
+        )
+    else:
+        summary: dict[str, list] = {}
+        for op, _, t, _ in log:
+            entry = summary.setdefault(op, [op, 0, None])
+            entry[1] += 1
+            # like min() in SQL, rows without a time are skipped
+            if t is not None and (entry[2] is None or t < entry[2]):
+                entry[2] = t
+        ops = list(summary.values())
+    if ops:
+        counts = {op: count for op, count, _ in ops}
+        features.update(undo_count=counts.get(OP_UNDO, 0), clear_count=counts.get(OP_CLEAR, 0))
+        first_add = next((first for op, _, first in ops if op == OP_ADD), None)
+        if first_add is not None:
+            # t is in ms from the start of the timer by the drawer's clock, not when the server got it
+            features["first_stroke_time"] = round(first_add / 1000, 3)
+    return features
+
+
+def save_drawing_features(drawing: PictionaryDrawing, svg: str, log: list[tuple] | None = None):
+    PictionaryDrawingFeatures.create(drawing=drawing, **compute_drawing_features(drawing, svg, log))
+
+
+def backfill_drawing_features(batch_size: int = 500) -> int:
+    """Computes the features of finished drawings that don't have them yet, e.g. from ``otree shell``.
+
+    Returns the number of drawings processed, the caller commits.
+    """
+    done = 0
+    last_id = 0
+    while True:
+        drawings = (
+            PictionaryDrawing.objects_filter(
+                PictionaryDrawing.id > last_id,
+                ~PictionaryDrawing.id.in_(db.query(PictionaryDrawingFeatures.drawing_id)),
+                completed=True,
+            )
+            .order_by(PictionaryDrawing.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not drawings:
+            return done
+        for drawing in drawings:
+            save_drawing_features(drawing, get_drawing_svg(drawing))
+        done += len(drawings)
+        last_id = drawings[-1].id
+
+
+def simplify_stored_drawings(tolerance: float = C.SIMPLIFY_TOLERANCE, after_id: int = 0,
+                             batch_size: int = 500) -> tuple[int, int]:
+    """Simplifies the paths of finished drawings (see simplify.py), e.g. from ``otree shell``.
+
+    The simplified SVG is stored under its own hash, the original stays in the
+    drawing store. Drawings with SVGs the codec can't read are left alone. The
+    geometry features of a drawing are recomputed from its new SVG, the ones
+    from the stroke log stay as they are. A similarity index (see similarity.py)
+    keeps the old vectors until its ``refresh()`` is run.
+    Returns the number of drawings changed and the bytes saved, the caller commits.
+    """
+    changed = saved = 0
+    last_id = after_id
+    while True:
+        drawings = (
+            PictionaryDrawing.objects_filter(PictionaryDrawing.id > last_id, PictionaryDrawing.svg_hash != "")
+            .order_by(PictionaryDrawing.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not drawings:
+            return changed, saved
+        features = {
+            row.drawing_id: row
+            for row in PictionaryDrawingFeatures.objects_filter(
+                PictionaryDrawingFeatures.drawing_id.in_([drawing.id for drawing in drawings])
+            )
+        }
+        for drawing in drawings:
+            try:
+                svg = simplify_svg(get_drawing_svg(drawing), tolerance)
+            except ValueError:
+                continue
+            if not svg:
+                # no paths the codec could read
+                continue
+            digest, size = drawing.svg_hash, drawing.svg_size
+            save_drawing_svg(drawing, svg)
+            if drawing.svg_hash != digest:
+                row = features.get(drawing.id)
+                if row is None:
+                    save_drawing_features(drawing, svg)
+                else:
+                    for key, value in geometry(strokes_from_svg(svg)).items():
+                        setattr(row, key, value)
+            if drawing.svg_size < size:
+                changed += 1
+                saved += size - drawing.svg_size
+        last_id = drawings[-1].id
+
+
+def get_stim_ids(phase: int, randomize=False) -> list[int]:
+    stim_ids = list(PHASE_STIM_IDS[phase - 1])
     if randomize:
-        shuffle(stims)
-    return stims
+        shuffle(stim_ids)
+    return stim_ids
+
+
+def parse_stim_id(value, phase: int) -> int | None:
+    """The stimulus id sent by a client, None if it isn't one of the phase's stimuli"""
+    try:
+        stim_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return stim_id if stim_id in PHASE_SENTENCES[phase - 1] else None
 
 class PhaseComplete(Page):
     pass
@@ -276,26 +1345,45 @@ class PhaseComplete(Page):
 class Drawing(Page):
     @staticmethod
     def is_displayed(player: Player):
-        return not is_phase_complete(player)
-
-    @staticmethod
-    def before_next_page(player, timeout_happened = False):
-        player.ready = False
+        return has_partner(player) and not is_phase_complete(player)
 
     @staticmethod
     def vars_for_template(player: Player):
         return dict(
             current_phase=player.subsession.round_number,
-            stims=PHASES[player.subsession.round_number - 1],
             blur=player.session.config.get("blur", True),
             live_draw=player.session.config.get("live_draw", True),
             num_trials=C.NUM_PHASE_TRIALS[player.subsession.round_number - 1]
         )
 
     @staticmethod
+    def js_vars(player: Player):
+        return dict(
+            live_draw=player.session.config.get("live_draw", True),
+            # stroke operations are merged and sent at most once per interval (ms), 0 sends every stroke
+            live_draw_interval=player.session.config.get("live_draw_interval", C.LIVE_DRAW_INTERVAL),
+            simplify_tolerance=player.session.config.get("simplify_tolerance", C.SIMPLIFY_TOLERANCE),
+            # the responder watches the drawing while it is made, needs live_draw
+            spectate=is_spectating(player),
+            # the live messages only have stimulus ids
+            stim_text=PHASE_SENTENCES[player.round_number - 1],
+            partner_check_interval=C.PARTNER_CHECK_INTERVAL,
+        )
+
+    @staticmethod
+    @instrument_live_method
     def live_method(player, data):
+        # writes and commits the buffered trial changes every CHECKPOINT_INTERVAL seconds,
+        # before anything else so a message that fails can't roll them back
+        get_write_behind().maybe_checkpoint()
+        if data.get("event") == "strokes_ack":
+            # sent often in spectator mode, the trial is only loaded if the responder needs a sync
+            get_progress().message(player)
+            return spectator_ack(player, data)
+        ctx = TrialContext(player)
+        track_progress(ctx)
         # If the phase is complete the player needs to
-        if is_phase_complete(player):
+        if ctx.phase_complete:
             return {
                 player.id_in_group: dict(
                     event='continue',
@@ -303,7 +1391,7 @@ class Drawing(Page):
                 )
             }
         
-        trial = get_current_trial(player)
+        trial = ctx.trial
 
         # if the trial is complete, we need to move on
         # but if we are here we know the phase is not complete
@@ -314,74 +1402,159 @@ class Drawing(Page):
                     phase_complete=False,
                 )
             }
-        drawing_player = is_drawer(player, trial)
-        correct_stim = ""
-        stim_list = get_stim_list(player, True)
-        correct_stim = trial.stim
+        drawing_player = ctx.is_drawer
+        correct_stim = trial.stim_id
+        if ctx.state == TRIAL_DRAWING and is_drawing_expired(trial.drawing) and \
+                transition(ctx, "drawing_timeout", TRIAL_DRAWING, TRIAL_RESPONDING):
+            # the drawer ran out of time without finishing, whoever asks first
+            # gets both players past the drawing
+            logger.info("drawing timed out for group %s", player.group_id)
+            metrics.incr("drawing_timeouts")
+            # a late message of the drawer still has the end of the drawing
+            svg, log = apply_late_drawing(trial, data) if drawing_player else (None, None)
+            get_write_behind().flush(trial)
+            svg = complete_drawing(trial.drawing, svg, log)
+            return {
+                ctx.drawer_id: dict(
+                    event='drawing_complete',
+                    drawer=True,
+                    completed=True,
+                    timed_out=True,
+                ),
+                ctx.responder_id: dict(
+                    event='drawing_complete',
+                    drawer=False,
+                    drawing=base64.b64encode(svg.encode('utf-8')).decode('utf-8'),
+                    drawing_id=trial.drawing.id,
+                    seq=trial.drawing.last_seq,
+                    digest=trial.drawing.svg_hash,
+                    completed=True,
+                    timed_out=True,
+                    stims=get_stim_ids(ctx.phase, True),
+                ),
+            }
+        if ctx.partner_gone() and ctx.abandon():
+            # the partner stopped answering, whoever waited for them goes on alone
+            logger.info("partner of player %s left group %s", player.id_in_group, player.group_id)
+            metrics.incr("abandoned_groups")
+            return {
+                player.id_in_group: dict(
+                    event='continue',
+                    phase_complete=True,
+                )
+            }
         if "event" in data:
-            print("received event from ", player.id_in_group, data["event"])
+            trace.debug("received event from %s %s", player.id_in_group, data["event"])
             if data["event"] == "init":
-                print("received init from ", player.id_in_group)
-                if drawing_player and not trial.drawing.completed:
-                    # start the drawing timer
-                    if trial.drawing.start_timestamp == 0.0:
-                        trial.drawing.start_timestamp = datetime.datetime.now().timestamp()
-                    trial.drawing.drawing_time = datetime.datetime.now().timestamp() - trial.drawing.start_timestamp
-                    print("drawing time: ", trial.drawing.drawing_time)
-                    print("time left: ", C.DRAWING_TIME - trial.drawing.drawing_time)
-                return {
+                timer_started = False
+                if drawing_player and not trial.drawing.completed and trial.drawing.deadline == 0.0:
+                    # start the drawing timer, this is the only time it is set
+                    start_drawing_timer(trial)
+                    timer_started = True
+                if not drawing_player and not trial.drawing.completed and is_spectating(player):
+                    # the drawing so far is in this response, the rest is relayed as it arrives
+                    start_spectating(ctx)
+                response = {
                     player.id_in_group: dict(
                         event='init',
                         drawer=drawing_player,
-                        # this allows recovery / in case of browser reload
-                        drawing=base64.b64encode(trial.drawing.svg.encode('utf-8')).decode('utf-8'),
+                        # this allows recovery / in case of browser reload, without
+                        # sending the drawing again if the client still has it
+                        **get_init_drawing(trial.drawing, data.get("have")),
                         completed=trial.drawing.completed,
                         response_completed=trial.response.completed,
                         response_correct=trial.response.correct,
-                        response=trial.response.response,
-                        stims=stim_list,
-                        correct_stim=correct_stim if drawing_player or trial.response.completed else '',
-                        ready=player.ready,
+                        response=trial.response.response_id,
+                        stims=get_stim_ids(ctx.phase, True),
+                        correct_stim=correct_stim if drawing_player or trial.response.completed else None,
+                        player_ready=ctx.acknowledged,
                         trial_id=player.group.current_trial,
-                        time_left=C.DRAWING_TIME - trial.drawing.drawing_time, # will be 120 at the start as Drawing.drawing_time starts at 0
+                        **get_timer_fields(trial.drawing),
                     )
                 }
+                if timer_started:
+                    # let the responder know when the drawing is due
+                    response[ctx.partner_id] = dict(
+                        event='drawing_started',
+                        **get_timer_fields(trial.drawing),
+                    )
+                return response
             elif data["event"] == "update":
-                if drawing_player:
-                    print("updating drawing for ", player.id_in_group)
-                    trial.drawing.svg = base64.b64decode(data["drawing"]).decode('utf-8')
+                if drawing_player and not trial.drawing.completed:
+                    # full drawing from older clients, an update that arrives after
+                    # a newer one was applied is dropped
+                    seq = data.get("seq")
+                    if seq is not None and seq <= trial.drawing.last_seq:
+                        metrics.incr("superseded_updates")
+                    else:
+                        fields = dict(svg=base64.b64decode(data["drawing"]).decode('utf-8'))
+                        if seq is not None:
+                            fields["last_seq"] = seq
+                        get_write_behind().update_drawing(trial, **fields)
+            elif data["event"] == "strokes":
+                # incremental update, only the operations since the last message
+                if drawing_player and not trial.drawing.completed:
+                    if not append_strokes(trial, data["seq"], data["ops"]):
+                        metrics.incr("strokes_resync")
+                        return {
+                            player.id_in_group: dict(
+                                event='strokes_resync',
+                                seq=trial.drawing.last_seq,
+                            )
+                        }
+                    if is_spectating(player):
+                        relay = relay_strokes(ctx, data["seq"], data["ops"])
+                        if relay is not None:
+                            return {ctx.partner_id: relay}
             elif data["event"] == "drawing_complete":
-                if drawing_player:
-                    trial.drawing.drawing_time = datetime.datetime.now().timestamp() - trial.drawing.start_timestamp
-                    partner = get_partner(player)
-                    print("received drawing from ", player.id_in_group)
-                    trial.drawing.svg = base64.b64decode(data["drawing"]).decode('utf-8')
-                    trial.drawing.completed = True
+                if drawing_player and ctx.state == TRIAL_DRAWING:
+                    if data.get("seq", 0) > trial.drawing.last_seq:
+                        # some of the stroke operations never arrived
+                        metrics.incr("strokes_resync")
+                        return {
+                            player.id_in_group: dict(
+                                event='strokes_resync',
+                                seq=trial.drawing.last_seq,
+                            )
+                        }
+                    if not transition(ctx, "drawing_complete", TRIAL_DRAWING, TRIAL_RESPONDING):
+                        return
+                    get_write_behind().flush(trial)
+                    if data.get("drawing"):
+                        svg = complete_drawing(trial.drawing, *get_sent_drawing(data))
+                    else:
+                        svg = complete_drawing(trial.drawing)
                     return {
-                        partner.id_in_group: dict(
+                        ctx.partner_id: dict(
                             event='drawing_complete',
                             drawer=False,
-                            drawing=data["drawing"],
+                            drawing=base64.b64encode(svg.encode('utf-8')).decode('utf-8'),
+                            drawing_id=trial.drawing.id,
+                            seq=trial.drawing.last_seq,
+                            digest=trial.drawing.svg_hash,
                             completed = True,
-                            stims=stim_list,
+                            timed_out=data.get("timeout", False),
+                            stims=get_stim_ids(ctx.phase, True),
                         )}
             elif data["event"] == "stimulus_selected": # just a click, not the "completed" event
                 if not drawing_player:
-                    print(f"received stimulus selection ({data['stim']}) from {player.id_in_group}")
-                    trial.response.response = data["stim"]
+                    trace.debug("received stimulus selection (%s) from %s", data['stim'], player.id_in_group)
+                    get_write_behind().update_response(trial, response_id=parse_stim_id(data["stim"], ctx.phase))
                     
             elif data["event"] == "response_complete":
-                if not drawing_player:
-                    print(f"received response from {player.id_in_group}: response={data['response']}, correct_stim={correct_stim}")
-                    trial.response.response = data["response"]
-                    trial.response.correct = data["response"] == trial.stim
+                if not drawing_player and transition(ctx, "response_complete", TRIAL_RESPONDING, TRIAL_REVIEW):
+                    trace.debug("received response from %s: response=%s, correct_stim=%s", player.id_in_group, data['response'], correct_stim)
+                    get_write_behind().flush(trial)
+                    trial.response.response_id = parse_stim_id(data["response"], ctx.phase)
+                    trial.response.correct = trial.response.response_id == trial.stim_id
                     trial.response.completed = True
+                    get_progress().response(ctx.group.id, trial.response.correct)
                     return {
                         0: dict(
                             event='show_response',
-                            response=trial.response.response,
+                            response=trial.response.response_id,
                             correct=trial.response.correct,
-                            stims=stim_list,
+                            stims=get_stim_ids(ctx.phase, True),
                             correct_stim=correct_stim,
                             completed=True,
                         )
@@ -390,42 +1563,63 @@ class Drawing(Page):
                 # this is when both players have reviewed the response
                 # and are ready to continue to the next trial
                 # we have already checked earlier if the phase or trial is complete
-                if trial.response.completed and trial.drawing.completed:
-                    partner = get_partner(player)
-                    player.ready = True
-                    if partner.ready:
-                        player.group.current_trial += 1
-                        player.ready = False
-                        partner.ready = False
-                        trial.completed = True
+                if ctx.state == TRIAL_REVIEW:
+                    if ctx.acknowledge_review():
+                        if ctx.phase_complete and ctx.phase == C.NUM_ROUNDS:
+                            # this group is done, log what the server spent its time on so far
+                            dump_metrics()
                         return {
                             0: dict(
                                 event='continue',
-                                phase_complete=is_phase_complete(player),
+                                phase_complete=ctx.phase_complete,
                             )
                         }
                     else:
                         return {
                             player.id_in_group: dict(
                                 event='continue_wait',
-                                phase_complete=is_phase_complete(player),
+                                phase_complete=ctx.phase_complete,
                             )
                         }
+                else:
+                    # the group already moved on, e.g. a repeated continue after the partner's
+                    return {
+                        player.id_in_group: dict(
+                            event='continue',
+                            phase_complete=ctx.phase_complete,
+                        )
+                    }
+            elif data["event"] == "timeout":
+                # sent by the responder when the drawer's time is up, an expired
+                # drawing has already been handled above
+                pass
+            elif data["event"] == "partner_check":
+                # sent now and then while waiting for the partner, who is still there
+                # (or the phase was ended above)
+                pass
             elif data["event"] == "get_remaining_time":
-                if drawing_player:
-                    # start the drawing timer (it should be started already, but just in case)
-                    if trial.drawing.start_timestamp == 0.0:
-                        trial.drawing.start_timestamp = datetime.datetime.now().timestamp()
-                    trial.drawing.drawing_time = datetime.datetime.now().timestamp() - trial.drawing.start_timestamp
+                # kept for older clients, the timer is only read here
                 return {
                     player.id_in_group: dict(
                         event='remaining_time',
-                        time_left=C.DRAWING_TIME - trial.drawing.drawing_time,
+                        **get_timer_fields(trial.drawing),
                     )
                 }
 
 
+def vars_for_admin_report(subsession: Subsession):
+    return dict(
+        # kept up to date by the live method, nothing is queried, see progress.py
+        progress=get_progress().rows(subsession.id, C.PROGRESS_IDLE_AFTER),
+        progress_refresh=C.PROGRESS_REFRESH,
+        # live method metrics of this server process, see instrumentation.py
+        live_metrics=json_dumps(metrics.snapshot(), indent=2),
+    )
+
+
 page_sequence = [
+    # pairs participants as they arrive with match_by_arrival, oTree needs it to be the first page
+    Matching,
     ExperimentWelcome,
     PhaseInstructions,
     Waiting,
@@ -450,12 +1644,18 @@ def custom_export(players):
         "trial",
         "stim",
         "concepts",
+        "stim_id",
+        "concept_mask",
         "response",
         "correct",
         "response_completed",
         "drawing_completed",
         "drawing_time",
         "svg",
+        "svg_hash",
+        "svg_bytes",
+        # geometry features, see features.py
+        *FEATURE_COLUMNS,
         "stim_order",
         # survey data
         "participant_1_age",
@@ -474,54 +1674,127 @@ def custom_export(players):
         "participant_2_could_should",
     ]
 
-    trials = PictionaryTrial.filter()
+    # per-group data is loaded once per group and reused for all its trials
+    groups: dict[int, dict] = {}
+    for trials in iter_trial_chunks():
+        missing = {trial.group_id for trial in trials} - groups.keys()
+        if missing:
+            groups.update(load_group_export_data(missing))
+        features = load_drawing_features([trial.drawing_id for trial in trials])
 
-    if not trials:
-        return
-    
-    
-
-    for trial in trials:
-        # get pseudo participant_1 and 2
-        players = trial.group.get_players()
-        participant_1 = players[0]
-        participant_2 = players[1]
-        drawer = participant_1 if trial.drawer.id_in_group == 1 else participant_2
-        responder = participant_1 if trial.responder.id_in_group == 1 else participant_2
-
-        # pseudo group id
-        group_code = participant_1.participant.code + '_' + participant_2.participant.code
-        yield [
-            trial.subsess.session.code if trial.subsess else "N/A",
-            group_code,
-            participant_1.participant.code,
-            participant_2.participant.code,
-            drawer.participant.code,
-            responder.participant.code,
-            trial.phase,
-            trial.trial,
-            trial.stim,
-            trial.concepts,
-            trial.response.response if trial.response else "N/A",
-            trial.response.correct if trial.response else "N/A",
-            trial.response.completed if trial.response else "N/A",
-            trial.drawing.completed if trial.drawing else "N/A",
-            trial.drawing.drawing_time if trial.drawing else "N/A",
-            trial.drawing.svg if trial.drawing else "N/A",
-            trial.group.stim_order if trial.group else "N/A",
-            # survey data
-            participant_1.age,
-            participant_1.field_display('gender'),
-            participant_1.field_display('native_language'),
-            participant_1.language_other,
-            participant_1.i_you,
-            participant_1.present_past,
-            participant_1.could_should,
-            participant_2.age,
-            participant_2.field_display('gender'),
-            participant_2.field_display('native_language'),
-            participant_2.language_other,
-            participant_2.i_you,
-            participant_2.present_past,
-            participant_2.could_should,
-        ]
+        for trial in trials:
+            group = groups[trial.group_id]
+            yield [
+                group["session"],
+                group["group_code"],
+                group["participant_codes"][0],
+                group["participant_codes"][1],
+                group["player_codes"][trial.drawer_id],
+                group["player_codes"][trial.responder_id],
+                trial.phase,
+                trial.trial,
+                STIMULI[trial.stim_id].sentence,
+                ", ".join(STIMULI[trial.stim_id].concepts),
+                trial.stim_id,
+                trial.concept_mask,
+                get_response_sentence(trial.response) if trial.response else "N/A",
+                trial.response.correct if trial.response else "N/A",
+                trial.response.completed if trial.response else "N/A",
+                trial.drawing.completed if trial.drawing else "N/A",
+                trial.drawing.drawing_time if trial.drawing else "N/A",
+                get_drawing_svg(trial.drawing) if trial.drawing else "N/A",
+                trial.drawing.svg_hash if trial.drawing else "N/A",
+                trial.drawing.svg_size if trial.drawing else "N/A",
+                *get_feature_values(features.get(trial.drawing_id)),
+                group["stim_order"],
+                # survey data
+                *group["survey"],
+            ]
+
+
+def get_response_sentence(response: PictionaryResponse) -> str:
+    if response.response_id is None:
+        return ""
+    return STIMULI[response.response_id].sentence
+
+
+FEATURE_COLUMNS = [
+    "stroke_count",
+    "point_count",
+    "ink_length",
+    "min_x",
+    "min_y",
+    "max_x",
+    "max_y",
+    "undo_count",
+    "clear_count",
+    "first_stroke_time",
+]
+
+
+def load_drawing_features(drawing_ids) -> dict[int, PictionaryDrawingFeatures]:
+    rows = PictionaryDrawingFeatures.objects_filter(PictionaryDrawingFeatures.drawing_id.in_(drawing_ids))
+    return {row.drawing_id: row for row in rows}
+
+
+def get_feature_values(features: PictionaryDrawingFeatures | None) -> list:
+    if features is None:
+        return [""] * len(FEATURE_COLUMNS)
+    return ["" if value is None else value for value in (getattr(features, name) for name in FEATURE_COLUMNS)]
+
+
+# how many trials custom_export loads at a time
+EXPORT_CHUNK_SIZE = 500
+
+
+def iter_trial_chunks(chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Pages through all trials by id, loading drawings and responses with the same query"""
+    last_id = 0
+    while True:
+        trials = (
+            PictionaryTrial.objects_filter(PictionaryTrial.id > last_id)
+            .options(
+                joinedload(PictionaryTrial.drawing),
+                joinedload(PictionaryTrial.response),
+            )
+            .order_by(PictionaryTrial.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not trials:
+            return
+        yield trials
+        last_id = trials[-1].id
+
+
+def load_group_export_data(group_ids) -> dict[int, dict]:
+    """Loads the export columns that are the same for every trial of a group"""
+    groups = Group.objects_filter(Group.id.in_(group_ids)).options(joinedload(Group.session)).all()
+    players = (
+        Player.objects_filter(Player.group_id.in_(group_ids))
+        .options(joinedload(Player.participant))
+        .order_by(Player.id_in_group)
+        .all()
+    )
+    group_players: dict[int, list[Player]] = {}
+    for player in players:
+        group_players.setdefault(player.group_id, []).append(player)
+    answers = load_survey_answers(player.participant_id for player in players)
+
+    data = {}
+    for group in groups:
+        # pseudo participant_1 and 2
+        participant_1, participant_2 = group_players[group.id]
+        codes = [participant_1.participant.code, participant_2.participant.code]
+        data[group.id] = dict(
+            session=group.session.code,
+            # pseudo group id
+            group_code="_".join(codes),
+            participant_codes=codes,
+            player_codes={participant_1.id: codes[0], participant_2.id: codes[1]},
+            stim_order=", ".join(STIMULI[int(stim_id)].sentence for stim_id in group.stim_order.split(",") if stim_id),
+            # as before, a missing gender or native language is exported as N/A
+            survey=survey_values(answers[participant_1.participant_id], "N/A")
+            + survey_values(answers[participant_2.participant_id], "N/A"),
+        )
+    return data
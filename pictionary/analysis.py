@@ -0,0 +1,333 @@
+"""Vectorized analysis of the trials, for use while data is still being collected.
+
+The trials are loaded into NumPy arrays (one element per trial), either straight
+from the database (e.g. in ``otree shell``) or from a file written by
+``custom_export``, and every analysis is a group-by on those arrays.
+
+NumPy is only needed for this module, not for running the experiment::
+
+    pip install numpy
+
+Example::
+
+    from pictionary.analysis import load_export, learning_curves, confusion_matrices
+    trials = load_export("pictionary_custom_export.csv")
+    curves = learning_curves(trials)
+    confusion = confusion_matrices(trials)["tense"]
+
+The timelines of how the drawings were made (``load_timelines``) can only be
+loaded from the database.
+"""
+import csv
+from dataclasses import dataclass
+
+import numpy as np
+
+from .stims import ASPECT, MODALITY, PHASE_SENTENCES, PRONOUN, STIMULI, TENSE
+from .timeline import OP_CODES, iter_timeline
+
+# the concept dimensions a confusion matrix can be made for
+DIMENSIONS: dict[str, list[str]] = {
+    "pronoun": PRONOUN,
+    "tense": TENSE,
+    "modality": MODALITY,
+    "aspect": ASPECT,
+}
+
+NO_RESPONSE = -1
+
+
+@dataclass
+class Trials:
+    """Column arrays of the trials, all with one element per trial"""
+    pair: np.ndarray  # index into pair_codes
+    phase: np.ndarray
+    trial: np.ndarray
+    stim_id: np.ndarray
+    response_id: np.ndarray  # NO_RESPONSE if nothing was selected
+    correct: np.ndarray
+    completed: np.ndarray  # the response was submitted
+    drawer_role: np.ndarray  # 1 if participant_1 of the pair drew, otherwise 2
+    drawing_time: np.ndarray
+    pair_codes: list[str]
+
+    def __len__(self):
+        return len(self.trial)
+
+    def select(self, mask: np.ndarray) -> "Trials":
+        """Returns the trials where mask is True"""
+        return Trials(
+            **{name: getattr(self, name)[mask] for name in COLUMNS},
+            pair_codes=self.pair_codes,
+        )
+
+
+COLUMNS = ["pair", "phase", "trial", "stim_id", "response_id", "correct", "completed", "drawer_role", "drawing_time"]
+
+
+def _make_trials(pair_keys, **columns) -> Trials:
+    pair_codes, pair = np.unique(np.asarray(pair_keys), return_inverse=True)
+    return Trials(
+        pair=pair.astype(np.int32),
+        phase=np.asarray(columns["phase"], dtype=np.int16),
+        trial=np.asarray(columns["trial"], dtype=np.int16),
+        stim_id=np.asarray(columns["stim_id"], dtype=np.int32),
+        response_id=np.asarray(columns["response_id"], dtype=np.int32),
+        correct=np.asarray(columns["correct"], dtype=bool),
+        completed=np.asarray(columns["completed"], dtype=bool),
+        drawer_role=np.asarray(columns["drawer_role"], dtype=np.int8),
+        drawing_time=np.asarray(columns["drawing_time"], dtype=np.float64),
+        pair_codes=[str(code) for code in pair_codes],
+    )
+
+
+# loading
+
+def _parse_bool(value: str) -> bool:
+    return value in ("True", "true", "1")
+
+
+def _parse_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def load_export(path) -> Trials:
+    """Loads a CSV file written by custom_export"""
+    # sentence -> id for each phase, for the response column and for exports without stim_id
+    sentence_ids = [{sentence: stim_id for stim_id, sentence in phase.items()} for phase in PHASE_SENTENCES]
+    columns: dict[str, list] = {name: [] for name in COLUMNS if name != "pair"}
+    pair_keys = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            phase = int(row["phase"])
+            ids = sentence_ids[phase - 1]
+            pair_keys.append(row["group_id"])
+            columns["phase"].append(phase)
+            columns["trial"].append(int(row["trial"]))
+            stim_id = row.get("stim_id")
+            columns["stim_id"].append(int(stim_id) if stim_id else ids[row["stim"]])
+            columns["response_id"].append(ids.get(row["response"], NO_RESPONSE))
+            columns["correct"].append(_parse_bool(row["correct"]))
+            columns["completed"].append(_parse_bool(row["response_completed"]))
+            columns["drawer_role"].append(1 if row["drawer"] == row["participant_1"] else 2)
+            columns["drawing_time"].append(_parse_float(row["drawing_time"]))
+    return _make_trials(pair_keys, **columns)
+
+
+def load_db(session_code: str | None = None) -> Trials:
+    """Loads the trials from the oTree database, e.g. from ``otree shell``"""
+    from sqlalchemy.orm import aliased  # type: ignore
+    from otree.database import db  # type: ignore
+    from otree.models import Session  # type: ignore
+    from . import Player, PictionaryDrawing, PictionaryResponse, PictionaryTrial, Subsession
+
+    drawer = aliased(Player)
+    responder = aliased(Player)
+    query = (
+        db.query(
+            drawer.participant_id,
+            responder.participant_id,
+            drawer.id_in_group,
+            PictionaryTrial.phase,
+            PictionaryTrial.trial,
+            PictionaryTrial.stim_id,
+            PictionaryResponse.response_id,
+            PictionaryResponse.correct,
+            PictionaryResponse.completed,
+            PictionaryDrawing.drawing_time,
+        )
+        .join(drawer, PictionaryTrial.drawer_id == drawer.id)
+        .join(responder, PictionaryTrial.responder_id == responder.id)
+        .join(PictionaryResponse, PictionaryTrial.response_id == PictionaryResponse.id)
+        .join(PictionaryDrawing, PictionaryTrial.drawing_id == PictionaryDrawing.id)
+    )
+    if session_code is not None:
+        query = (
+            query.join(Subsession, PictionaryTrial.subsess_id == Subsession.id)
+            .join(Session, Subsession.session_id == Session.id)
+            .filter(Session.code == session_code)
+        )
+    rows = query.all()
+    if not rows:
+        return _make_trials([], **{name: [] for name in COLUMNS if name != "pair"})
+
+    (drawer_participant, responder_participant, drawer_role, phase, trial,
+     stim_id, response_id, correct, completed, drawing_time) = map(list, zip(*rows))
+    drawer_participant = np.asarray(drawer_participant, dtype=np.int64)
+    responder_participant = np.asarray(responder_participant, dtype=np.int64)
+    # the pair is the same whoever draws, so key it by the lower and the higher participant id
+    low = np.minimum(drawer_participant, responder_participant)
+    high = np.maximum(drawer_participant, responder_participant)
+    pair_keys = np.char.add(np.char.add(low.astype(str), "_"), high.astype(str))
+    response_id = [NO_RESPONSE if value is None else value for value in response_id]
+    return _make_trials(
+        pair_keys,
+        phase=phase,
+        trial=trial,
+        stim_id=stim_id,
+        response_id=response_id,
+        correct=correct,
+        completed=completed,
+        drawer_role=drawer_role,
+        drawing_time=drawing_time,
+    )
+
+
+@dataclass
+class Timelines:
+    """Column arrays of the timelines of drawings (see timeline.py), one element per point.
+
+    An undo or clear is a single element without coordinates (NaN).
+    """
+    drawing_id: np.ndarray
+    phase: np.ndarray
+    trial: np.ndarray
+    event: np.ndarray  # index of the operation in the drawing's timeline
+    op: np.ndarray  # OP_CODES in timeline.py
+    t: np.ndarray  # ms from the start of the drawing timer
+    x: np.ndarray
+    y: np.ndarray
+
+    def __len__(self):
+        return len(self.t)
+
+    def select(self, mask: np.ndarray) -> "Timelines":
+        """Returns the points where mask is True"""
+        return Timelines(**{name: getattr(self, name)[mask] for name in TIMELINE_COLUMNS})
+
+
+TIMELINE_COLUMNS = ["drawing_id", "phase", "trial", "event", "op", "t", "x", "y"]
+
+
+def load_timelines(phase: int | None = None, session_code: str | None = None) -> Timelines:
+    """Loads the timelines of the finished drawings from the oTree database, e.g. from ``otree shell``"""
+    import base64
+    from otree.database import db  # type: ignore
+    from otree.models import Session  # type: ignore
+    from . import PictionaryTimeline, PictionaryTrial, Subsession
+
+    query = (
+        db.query(PictionaryTimeline.drawing_id, PictionaryTrial.phase, PictionaryTrial.trial, PictionaryTimeline.data)
+        .join(PictionaryTrial, PictionaryTrial.drawing_id == PictionaryTimeline.drawing_id)
+        .order_by(PictionaryTimeline.drawing_id)
+    )
+    if phase is not None:
+        query = query.filter(PictionaryTrial.phase == phase)
+    if session_code is not None:
+        query = (
+            query.join(Subsession, PictionaryTrial.subsess_id == Subsession.id)
+            .join(Session, Subsession.session_id == Session.id)
+            .filter(Session.code == session_code)
+        )
+    columns: dict[str, list] = {name: [] for name in TIMELINE_COLUMNS}
+    for drawing_id, drawing_phase, trial, data in query.yield_per(500):
+        count = 0
+        for index, event in enumerate(iter_timeline(base64.b64decode(data))):
+            # one element for an undo or clear
+            size = max(len(event.points), 1)
+            columns["event"].append(np.full(size, index, dtype=np.int32))
+            columns["op"].append(np.full(size, OP_CODES[event.op], dtype=np.int8))
+            if event.points:
+                columns["t"].append(np.asarray(event.times, dtype=np.int32))
+                points = np.asarray(event.points, dtype=np.float32)
+                columns["x"].append(points[:, 0])
+                columns["y"].append(points[:, 1])
+            else:
+                columns["t"].append(np.full(size, event.t, dtype=np.int32))
+                columns["x"].append(np.full(size, np.nan, dtype=np.float32))
+                columns["y"].append(np.full(size, np.nan, dtype=np.float32))
+            count += size
+        columns["drawing_id"].append(np.full(count, drawing_id, dtype=np.int64))
+        columns["phase"].append(np.full(count, drawing_phase, dtype=np.int16))
+        columns["trial"].append(np.full(count, trial, dtype=np.int16))
+    dtypes = dict(drawing_id=np.int64, phase=np.int16, trial=np.int16, event=np.int32, op=np.int8,
+                  t=np.int32, x=np.float32, y=np.float32)
+    return Timelines(**{
+        name: np.concatenate(parts) if parts else np.zeros(0, dtype=dtypes[name]) for name, parts in columns.items()
+    })
+
+
+def load_surveys(session_code: str | None = None) -> dict[str, dict]:
+    """The demographics and survey answers of every participant by participant code, from the oTree database"""
+    from . import load_participant_surveys
+
+    return {code: answers for code, _, answers in load_participant_surveys(session_code)}
+
+
+# analyses
+
+def _group_mean(index: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Mean of values per group index, NaN for empty groups"""
+    counts = np.bincount(index, minlength=size)
+    sums = np.bincount(index, weights=values, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def learning_curves(trials: Trials) -> np.ndarray:
+    """Accuracy per pair, phase and trial, shape (pairs, phases, trials), NaN where there is no response"""
+    done = trials.select(trials.completed)
+    shape = (len(trials.pair_codes), int(trials.phase.max(initial=0)), int(trials.trial.max(initial=0)))
+    index = np.ravel_multi_index((done.pair, done.phase - 1, done.trial - 1), shape)
+    return _group_mean(index, done.correct.astype(np.float64), int(np.prod(shape))).reshape(shape)
+
+
+def mean_learning_curve(trials: Trials) -> np.ndarray:
+    """Accuracy per phase and trial over all pairs, shape (phases, trials)"""
+    done = trials.select(trials.completed)
+    shape = (int(trials.phase.max(initial=0)), int(trials.trial.max(initial=0)))
+    index = np.ravel_multi_index((done.phase - 1, done.trial - 1), shape)
+    return _group_mean(index, done.correct.astype(np.float64), int(np.prod(shape))).reshape(shape)
+
+
+# stimulus id -> index of its value in each dimension, -1 if it doesn't have the dimension
+_DIMENSION_INDEX = {
+    name: np.array(
+        [next((i for i, value in enumerate(values) if value in stim.concepts), -1) for stim in STIMULI],
+        dtype=np.int32,
+    )
+    for name, values in DIMENSIONS.items()
+}
+
+
+def confusion_matrices(trials: Trials) -> dict[str, np.ndarray]:
+    """Counts of (drawn, selected) concept values per dimension, rows are the drawn value"""
+    done = trials.select(trials.completed & (trials.response_id != NO_RESPONSE))
+    matrices = {}
+    for name, values in DIMENSIONS.items():
+        lookup = _DIMENSION_INDEX[name]
+        drawn = lookup[done.stim_id]
+        selected = lookup[done.response_id]
+        valid = (drawn >= 0) & (selected >= 0)
+        size = len(values)
+        counts = np.bincount(drawn[valid] * size + selected[valid], minlength=size * size)
+        matrices[name] = counts.reshape(size, size)
+    return matrices
+
+
+def accuracy_by_drawer_role(trials: Trials) -> np.ndarray:
+    """Accuracy per pair when participant_1 draws (column 0) and when participant_2 draws (column 1)"""
+    done = trials.select(trials.completed)
+    num_pairs = len(trials.pair_codes)
+    index = done.pair * 2 + (done.drawer_role - 1)
+    return _group_mean(index, done.correct.astype(np.float64), num_pairs * 2).reshape(num_pairs, 2)
+
+
+def drawing_time_distribution(trials: Trials, bins=12, max_time: float = 120.0) -> dict[int, dict]:
+    """Histogram and percentiles of the drawing time of completed drawings, per phase"""
+    edges = np.linspace(0, max_time, bins + 1) if np.isscalar(bins) else np.asarray(bins)
+    valid = ~np.isnan(trials.drawing_time) & (trials.drawing_time > 0)
+    result = {}
+    for phase in np.unique(trials.phase):
+        times = trials.drawing_time[valid & (trials.phase == phase)]
+        counts, _ = np.histogram(times, bins=edges)
+        result[int(phase)] = dict(
+            edges=edges,
+            counts=counts,
+            percentiles=dict(zip((10, 50, 90), np.percentile(times, (10, 50, 90)))) if len(times) else {},
+            mean=float(times.mean()) if len(times) else np.nan,
+        )
+    return result
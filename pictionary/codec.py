@@ -0,0 +1,221 @@
+"""Compact binary encoding for drawings.
+
+The drawer only produces paths made of absolute ``M`` and ``L`` commands, so a
+drawing can be stored as a list of strokes (lists of points) plus the stroke
+attributes, which are the same for every path of a drawing.
+
+Coordinates are quantized to integers (``scale`` steps per pixel), delta-encoded
+against the previous point and written as zigzag varints. The same point
+encoding is used by ``StrokeCodec`` in static/drawer.js for live stroke updates.
+
+Drawing layout::
+
+    b"PD1"
+    varint scale
+    varint number of attributes, then (name, value) as length-prefixed UTF-8
+    varint number of strokes
+    for each stroke: varint number of points, then the points
+"""
+import math
+import re
+
+from .strokes import build_svg
+
+MAGIC = b"PD1"
+
+# 10 steps per pixel, must match StrokeCodec.SCALE in static/drawer.js
+DEFAULT_SCALE = 10
+
+# the attributes the Drawer in template/canvas.html sets on every path
+DEFAULT_ATTRIBUTES = {
+    "fill": "none",
+    "stroke": "#cb1212",
+    "stroke-width": "8",
+    "stroke-linecap": "round",
+}
+
+_PATH_RE = re.compile(r"<path\b[^>]*?(?:/>|>\s*</path>)", re.IGNORECASE)
+_ATTRIBUTE_RE = re.compile(r'([\w:-]+)="([^"]*)"')
+_PATH_DATA_RE = re.compile(r"([MLml])|(-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|([A-Za-z])")
+
+
+# low level helpers
+
+def _write_varint(out: bytearray, value: int):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _write_string(out: bytearray, value: str):
+    data = value.encode("utf-8")
+    _write_varint(out, len(data))
+    out += data
+
+
+def _read_string(data: bytes, pos: int) -> tuple[str, int]:
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length].decode("utf-8"), pos + length
+
+
+def _quantize(value: float, scale: int) -> int:
+    # rounds halves up like Math.round in the browser
+    return math.floor(value * scale + 0.5)
+
+
+def _write_points(out: bytearray, points, scale: int):
+    prev_x = prev_y = 0
+    for x, y in points:
+        qx = _quantize(x, scale)
+        qy = _quantize(y, scale)
+        _write_varint(out, _zigzag(qx - prev_x))
+        _write_varint(out, _zigzag(qy - prev_y))
+        prev_x, prev_y = qx, qy
+
+
+def _read_points(data: bytes, pos: int, count: int | None, scale: int) -> tuple[list[tuple[float, float]], int]:
+    """Reads count points, or all remaining points if count is None"""
+    points = []
+    x = y = 0
+    while (len(points) < count) if count is not None else (pos < len(data)):
+        dx, pos = _read_varint(data, pos)
+        dy, pos = _read_varint(data, pos)
+        x += _unzigzag(dx)
+        y += _unzigzag(dy)
+        points.append((x / scale, y / scale))
+    return points, pos
+
+
+# single strokes, as sent by the client
+
+def encode_points(points, scale: int = DEFAULT_SCALE) -> bytes:
+    out = bytearray()
+    _write_points(out, points, scale)
+    return bytes(out)
+
+
+def decode_points(data: bytes, scale: int = DEFAULT_SCALE) -> list[tuple[float, float]]:
+    return _read_points(data, 0, None, scale)[0]
+
+
+# SVG paths
+
+def parse_path_data(d: str) -> list[tuple[float, float]]:
+    """Returns the points of an ``M x y L x y ...`` path, other commands raise ValueError"""
+    numbers = []
+    for command, number, other in _PATH_DATA_RE.findall(d):
+        if other or command in ("m", "l"):
+            raise ValueError(f"Unsupported path command in {d[:40]!r}")
+        if number:
+            numbers.append(float(number))
+    if len(numbers) % 2:
+        raise ValueError(f"Odd number of coordinates in {d[:40]!r}")
+    return list(zip(numbers[::2], numbers[1::2]))
+
+
+def format_path_data(points, scale: int = DEFAULT_SCALE) -> str:
+    parts = []
+    for i, (x, y) in enumerate(points):
+        # rounding to the quantization step avoids float noise like 10.200000000000001
+        x = _quantize(x, scale) / scale
+        y = _quantize(y, scale) / scale
+        parts.append(f"{'M' if i == 0 else 'L'}{x:g} {y:g}")
+    return " ".join(parts)
+
+
+def path_element(points, attributes: dict | None = None, scale: int = DEFAULT_SCALE) -> str:
+    """Builds a <path> element the way the Drawer does"""
+    attributes = DEFAULT_ATTRIBUTES if attributes is None else attributes
+    attrs = "".join(f' {name}="{value}"' for name, value in attributes.items())
+    return f'<path{attrs} d="{format_path_data(points, scale)}" data-is-user="true"></path>'
+
+
+def paths_from_svg(svg: str) -> list[str]:
+    return _PATH_RE.findall(svg)
+
+
+def parse_path_element(path: str) -> tuple[dict, list[tuple[float, float]]]:
+    """Splits a <path> element into its stroke attributes and its points"""
+    attributes = dict(_ATTRIBUTE_RE.findall(path))
+    d = attributes.pop("d", "")
+    attributes.pop("data-is-user", None)
+    attributes.pop("xmlns", None)
+    return attributes, parse_path_data(d)
+
+
+# whole drawings
+
+def encode_drawing(strokes, attributes: dict | None = None, scale: int = DEFAULT_SCALE) -> bytes:
+    attributes = DEFAULT_ATTRIBUTES if attributes is None else attributes
+    out = bytearray(MAGIC)
+    _write_varint(out, scale)
+    _write_varint(out, len(attributes))
+    for name, value in attributes.items():
+        _write_string(out, name)
+        _write_string(out, value)
+    _write_varint(out, len(strokes))
+    for points in strokes:
+        _write_varint(out, len(points))
+        _write_points(out, points, scale)
+    return bytes(out)
+
+
+def decode_drawing(data: bytes) -> tuple[dict, list[list[tuple[float, float]]], int]:
+    """Returns the attributes, the strokes and the scale of an encoded drawing"""
+    if not data.startswith(MAGIC):
+        raise ValueError("Not an encoded drawing")
+    pos = len(MAGIC)
+    scale, pos = _read_varint(data, pos)
+    num_attributes, pos = _read_varint(data, pos)
+    attributes = {}
+    for _ in range(num_attributes):
+        name, pos = _read_string(data, pos)
+        attributes[name], pos = _read_string(data, pos)
+    num_strokes, pos = _read_varint(data, pos)
+    strokes = []
+    for _ in range(num_strokes):
+        count, pos = _read_varint(data, pos)
+        points, pos = _read_points(data, pos, count, scale)
+        strokes.append(points)
+    return attributes, strokes, scale
+
+
+def encode_svg(svg: str, scale: int = DEFAULT_SCALE) -> bytes:
+    """Encodes an SVG made by the Drawer, raises ValueError if it can't be encoded"""
+    attributes = None
+    strokes = []
+    for path in paths_from_svg(svg):
+        path_attributes, points = parse_path_element(path)
+        if attributes is None:
+            attributes = path_attributes
+        elif path_attributes != attributes:
+            raise ValueError("Paths with different stroke attributes")
+        strokes.append(points)
+    return encode_drawing(strokes, attributes or {}, scale)
+
+
+def decode_svg(data: bytes) -> str:
+    """Reconstructs the SVG of an encoded drawing"""
+    attributes, strokes, scale = decode_drawing(data)
+    return build_svg([path_element(points, attributes, scale) for points in strokes])
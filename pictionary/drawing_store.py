@@ -0,0 +1,79 @@
+"""Content-addressed storage for finished drawings, outside of the oTree database.
+
+Drawings are stored under the SHA-256 hash of their contents, so identical
+drawings are only stored once and the database only needs the hash and size.
+The default store is a folder on disk, set with the PICTIONARY_DRAWING_STORE
+environment variable.
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import BinaryIO
+
+DRAWING_STORE_DIR = os.environ.get("PICTIONARY_DRAWING_STORE", "drawings")
+
+
+def hash_drawing(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class DrawingStore:
+    """Base class for drawing stores, subclasses implement put, open and exists"""
+
+    def put(self, data: bytes) -> str:
+        """Stores the data (if it isn't stored yet) and returns its hash"""
+        raise NotImplementedError
+
+    def open(self, digest: str) -> BinaryIO:
+        """Opens the stored drawing for reading"""
+        raise NotImplementedError
+
+    def exists(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def get(self, digest: str) -> bytes:
+        with self.open(digest) as f:
+            return f.read()
+
+
+class FileSystemDrawingStore(DrawingStore):
+    """Stores each drawing as a file named after its hash, e.g. root/ab/abcdef..."""
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+
+    def path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        digest = hash_drawing(data)
+        path = self.path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first so a crash never leaves a partial drawing
+            tmp_path = path.with_name(f"{digest}.{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        return digest
+
+    def open(self, digest: str) -> BinaryIO:
+        return self.path(digest).open("rb")
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+
+_store: DrawingStore | None = None
+
+
+def get_drawing_store() -> DrawingStore:
+    global _store
+    if _store is None:
+        _store = FileSystemDrawingStore(DRAWING_STORE_DIR)
+    return _store
+
+
+def set_drawing_store(store: DrawingStore):
+    """Replaces the default store, e.g. with one backed by object storage"""
+    global _store
+    _store = store
@@ -0,0 +1,213 @@
+"""Incremental export of the completed trials, for regular syncs during data collection.
+
+Unlike ``custom_export``, which writes every trial again each time, this
+remembers how far it got and only writes the trials completed since. A trial
+is completed when its group moves on to the next trial, which is logged as
+an "advance" PictionaryGroupEvent (see transition() in __init__.py). The id
+of the last exported event is the cursor.
+
+The data is split into tables keyed by id instead of being repeated on every
+row, each a folder of the output directory:
+
+- trials: one row per trial, with the ids of its drawing, players and stimuli
+- drawings: the SVG of each drawing, by drawing_id
+- participants: demographics and survey answers, by participant code
+- stimuli: sentence and concepts, by stim_id
+
+Every run adds a part file to trials and drawings, named after the range of
+events it covers, so a run that is interrupted before it saves the cursor
+writes the same file again next time. participants and stimuli are small and
+written whole every run, the survey answers of a participant come in late.
+Parts are Parquet files if pyarrow is installed and JSON lines otherwise, an
+export directory keeps the format it was started with.
+
+Example, from ``otree shell``::
+
+    from pictionary.export import export_new_trials
+    export_new_trials("export")
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+from sqlalchemy.orm import joinedload  # type: ignore
+
+from .stims import STIMULI
+
+try:
+    import pyarrow  # type: ignore
+    import pyarrow.parquet  # type: ignore
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger("pictionary.export")
+
+FORMATS = ("parquet", "ndjson")
+
+# completed trials written per query
+CHUNK_SIZE = 500
+
+
+def default_format() -> str:
+    return "parquet" if pyarrow is not None else "ndjson"
+
+
+# tables
+
+def write_table(path: Path, rows: list[dict], fmt: str):
+    """Writes the rows to path (without extension) in the format, replacing what was there"""
+    path = path.with_suffix(f".{fmt}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # like the drawing store, never leave a partial file behind
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    if fmt == "parquet":
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), tmp_path)
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, separators=(",", ":")) + "\n")
+    os.replace(tmp_path, path)
+
+
+def read_cursor(output_dir: Path) -> dict:
+    path = output_dir / "cursor.json"
+    if not path.exists():
+        return dict(event_id=0, format=None)
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_cursor(output_dir: Path, cursor: dict):
+    tmp_path = output_dir / f"cursor.json.{os.getpid()}.tmp"
+    tmp_path.write_text(json.dumps(cursor), encoding="utf-8")
+    os.replace(tmp_path, output_dir / "cursor.json")
+
+
+# rows
+
+def iter_completed_trials(after_event_id: int, chunk_size: int = CHUNK_SIZE):
+    """Yields (first event id, last event id, [(event, trial), ...]) in the order the trials were completed"""
+    from . import PictionaryGroupEvent, PictionaryTrial
+
+    while True:
+        events = (
+            PictionaryGroupEvent.objects_filter(
+                PictionaryGroupEvent.event == "advance",
+                PictionaryGroupEvent.id > after_event_id,
+            )
+            .order_by(PictionaryGroupEvent.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not events:
+            return
+        # the trials of these groups with these numbers, the exact pairs are picked below
+        candidates = (
+            PictionaryTrial.objects_filter(
+                PictionaryTrial.group_id.in_({event.group_id for event in events}),
+                PictionaryTrial.trial.in_({event.trial for event in events}),
+            )
+            .options(joinedload(PictionaryTrial.drawing), joinedload(PictionaryTrial.response))
+            .all()
+        )
+        trials = {(trial.group_id, trial.trial): trial for trial in candidates}
+        yield events[0].id, events[-1].id, [
+            (event, trials[event.group_id, event.trial]) for event in events if (event.group_id, event.trial) in trials
+        ]
+        after_event_id = events[-1].id
+
+
+def load_player_codes(player_ids) -> dict[int, str]:
+    from . import Player
+
+    players = Player.objects_filter(Player.id.in_(player_ids)).options(joinedload(Player.participant))
+    return {player.id: player.participant.code for player in players}
+
+
+def trial_row(event, trial, player_codes: dict[int, str], features) -> dict:
+    from . import FEATURE_COLUMNS
+
+    drawing, response = trial.drawing, trial.response
+    return dict(
+        trial_id=trial.id,
+        phase=trial.phase,
+        trial=trial.trial,
+        group_id=trial.group_id,
+        drawer=player_codes[trial.drawer_id],
+        responder=player_codes[trial.responder_id],
+        stim_id=trial.stim_id,
+        concept_mask=trial.concept_mask,
+        response_id=response.response_id,
+        correct=response.correct,
+        drawing_id=drawing.id,
+        drawing_time=drawing.drawing_time,
+        svg_hash=drawing.svg_hash,
+        svg_bytes=drawing.svg_size,
+        completed_at=event.timestamp,
+        **{name: getattr(features, name) if features is not None else None for name in FEATURE_COLUMNS},
+    )
+
+
+def drawing_row(drawing) -> dict:
+    from . import get_drawing_svg
+
+    return dict(drawing_id=drawing.id, svg_hash=drawing.svg_hash, svg=get_drawing_svg(drawing))
+
+
+def participant_rows() -> list[dict]:
+    """The demographics and survey answers of every participant"""
+    from . import SURVEY_FIELDS, load_participant_surveys, survey_values
+
+    return [
+        dict(participant=code, session=session, **dict(zip(SURVEY_FIELDS, survey_values(answers))))
+        for code, session, answers in load_participant_surveys()
+    ]
+
+
+def stimulus_rows() -> list[dict]:
+    return [
+        dict(stim_id=stim.id, sentence=stim.sentence, concepts=", ".join(stim.concepts), concept_mask=stim.concept_mask)
+        for stim in STIMULI
+    ]
+
+
+# export
+
+def write_trials(output_dir: Path, part: str, completed: list, fmt: str):
+    from . import load_drawing_features
+
+    trials = [trial for _, trial in completed]
+    player_codes = load_player_codes({trial.drawer_id for trial in trials} | {trial.responder_id for trial in trials})
+    features = load_drawing_features([trial.drawing_id for trial in trials])
+    write_table(output_dir / "trials" / part, [
+        trial_row(event, trial, player_codes, features.get(trial.drawing_id)) for event, trial in completed
+    ], fmt)
+    write_table(output_dir / "drawings" / part, [drawing_row(trial.drawing) for trial in trials], fmt)
+
+
+def export_new_trials(output_dir: str | Path, fmt: str | None = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """Writes the trials completed since the last export to output_dir and returns how many there were"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cursor = read_cursor(output_dir)
+    fmt = cursor["format"] or fmt or default_format()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    if fmt == "parquet" and pyarrow is None:
+        raise RuntimeError("Parquet files need pyarrow, pip install pyarrow or use the ndjson format")
+    cursor["format"] = fmt
+
+    exported = 0
+    for first_id, last_id, completed in iter_completed_trials(cursor["event_id"], chunk_size):
+        if completed:
+            write_trials(output_dir, f"part-{first_id:09d}-{last_id:09d}", completed, fmt)
+        # only move on once the parts are written
+        cursor["event_id"] = last_id
+        write_cursor(output_dir, cursor)
+        exported += len(completed)
+
+    write_table(output_dir / "participants", participant_rows(), fmt)
+    write_table(output_dir / "stimuli", stimulus_rows(), fmt)
+    write_cursor(output_dir, cursor)
+    logger.info("exported %s new trials to %s", exported, output_dir)
+    return exported
@@ -0,0 +1,35 @@
+"""Geometry features of a drawing, computed once when it is finished.
+
+The features of the visible strokes come from the final SVG, the undo and clear
+counts and the time to the first stroke come from the stroke log.
+"""
+import math
+
+from .codec import paths_from_svg, parse_path_element
+
+
+def strokes_from_svg(svg: str) -> list[list[tuple[float, float]]] | None:
+    """The points of each path, None if the SVG has paths the codec can't read"""
+    try:
+        return [parse_path_element(path)[1] for path in paths_from_svg(svg)]
+    except ValueError:
+        return None
+
+
+def stroke_length(points) -> float:
+    return sum(math.dist(a, b) for a, b in zip(points, points[1:]))
+
+
+def geometry(strokes) -> dict:
+    """Stroke count, point count, total ink length and bounding box of the strokes"""
+    xs = [x for points in strokes for x, _ in points]
+    ys = [y for points in strokes for _, y in points]
+    return dict(
+        stroke_count=len(strokes),
+        point_count=len(xs),
+        ink_length=round(sum(stroke_length(points) for points in strokes), 2),
+        min_x=min(xs, default=0.0),
+        min_y=min(ys, default=0.0),
+        max_x=max(xs, default=0.0),
+        max_y=max(ys, default=0.0),
+    )
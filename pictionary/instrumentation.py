@@ -0,0 +1,182 @@
+"""Logging and per-event metrics for the live method.
+
+Everything is logged through the ``pictionary`` logger. The per-message trace
+goes to ``pictionary.trace`` at DEBUG level, which is off unless the
+PICTIONARY_TRACE environment variable is set, so the hot path doesn't write
+to stdout for every stroke update or timer poll.
+
+The metrics are kept per event type in this process: number of messages,
+handler latency (as a histogram) and the bytes received and sent. oTree
+encodes the messages itself, so measuring a payload means encoding it again;
+only every SIZE_SAMPLE_EVERY-th message of an event type is measured and the
+totals are estimated from those.
+"""
+import functools
+import logging
+import os
+import time
+from json import dumps as json_dumps
+
+logger = logging.getLogger("pictionary")
+trace = logging.getLogger("pictionary.trace")
+
+if os.environ.get("PICTIONARY_TRACE"):
+    trace.setLevel(logging.DEBUG)
+
+# upper bounds of the latency buckets in milliseconds, the last bucket has no upper bound
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# the payload sizes of one in this many messages are measured, 1 measures all of them
+SIZE_SAMPLE_EVERY = int(os.environ.get("PICTIONARY_SIZE_SAMPLE", 20))
+
+
+class EventStats:
+    """Counters for a single event type"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        # bytes of the messages whose size was measured
+        self.size_samples = 0
+        self.sampled_bytes_in = 0
+        self.sampled_bytes_out = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms: float):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def record_size(self, bytes_in: int, bytes_out: int):
+        self.size_samples += 1
+        self.sampled_bytes_in += bytes_in
+        self.sampled_bytes_out += bytes_out
+
+    def estimated_bytes(self, sampled_bytes: int) -> int:
+        """Total bytes of all messages, extrapolated from the measured ones"""
+        if not self.size_samples:
+            return 0
+        return round(sampled_bytes * self.count / self.size_samples)
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket that holds the q-th percentile (in ms)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets[:-1]):
+            seen += n
+            if seen >= target:
+                return float(LATENCY_BUCKETS_MS[i])
+        return self.max_ms
+
+    def as_dict(self) -> dict:
+        return dict(
+            count=self.count,
+            errors=self.errors,
+            total_ms=round(self.total_ms, 3),
+            mean_ms=round(self.total_ms / self.count, 3) if self.count else 0.0,
+            max_ms=round(self.max_ms, 3),
+            p50_ms=self.percentile(0.5),
+            p99_ms=self.percentile(0.99),
+            bytes_in=self.estimated_bytes(self.sampled_bytes_in),
+            bytes_out=self.estimated_bytes(self.sampled_bytes_out),
+            size_samples=self.size_samples,
+            histogram={
+                **{f"<={bound}ms": n for bound, n in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                f">{LATENCY_BUCKETS_MS[-1]}ms": self.buckets[-1],
+            },
+        )
+
+
+class Metrics:
+    """Per-event stats, free-form counters (e.g. timeouts, resyncs) and other timings"""
+
+    def __init__(self):
+        self.events: dict[str, EventStats] = {}
+        self.counters: dict[str, int] = {}
+        self.timings: dict[str, EventStats] = {}
+        self.started = time.time()
+
+    def event(self, name: str) -> EventStats:
+        stats = self.events.get(name)
+        if stats is None:
+            stats = self.events[name] = EventStats()
+        return stats
+
+    def incr(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, elapsed_ms: float):
+        """Records a timing that isn't a live method call, e.g. reported by a client"""
+        stats = self.timings.get(name)
+        if stats is None:
+            stats = self.timings[name] = EventStats()
+        stats.record(elapsed_ms)
+
+    def snapshot(self) -> dict:
+        return dict(
+            since=self.started,
+            events={name: stats.as_dict() for name, stats in sorted(self.events.items())},
+            counters=dict(sorted(self.counters.items())),
+            timings={name: stats.as_dict() for name, stats in sorted(self.timings.items())},
+        )
+
+    def reset(self):
+        self.events.clear()
+        self.counters.clear()
+        self.timings.clear()
+        self.started = time.time()
+
+
+metrics = Metrics()
+
+
+def payload_size(data) -> int:
+    """Bytes of the payload as JSON, this encodes it so it's only used for samples"""
+    if not data:
+        return 0
+    return len(json_dumps(data))
+
+
+def instrument_live_method(func):
+    """Records count and latency of each live message by event type, and samples the payload sizes"""
+
+    @functools.wraps(func)
+    def wrapper(player, data):
+        event = data.get("event", "") if isinstance(data, dict) else ""
+        start = time.perf_counter()
+        try:
+            response = func(player, data)
+        except Exception:
+            metrics.event(event).errors += 1
+            raise
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats = metrics.event(event)
+        stats.record(elapsed_ms)
+        # the first message of each type is always measured
+        if stats.count % SIZE_SAMPLE_EVERY == 1 or SIZE_SAMPLE_EVERY == 1:
+            stats.record_size(payload_size(data), payload_size(response))
+        if trace.isEnabledFor(logging.DEBUG):
+            trace.debug(
+                "event=%s group=%s player=%s took=%.2fms",
+                event, player.group_id, player.id_in_group, elapsed_ms,
+            )
+        return response
+
+    return wrapper
+
+
+def dump_metrics(level: int = logging.INFO) -> dict:
+    """Logs the current metrics as a single line of JSON and returns them"""
+    snapshot = metrics.snapshot()
+    logger.log(level, "live metrics %s", json_dumps(snapshot))
+    return snapshot
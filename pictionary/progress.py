@@ -0,0 +1,110 @@
+"""In-memory index of how far every group is, for the admin report.
+
+Finding out which pairs are stuck from oTree's data tables means querying
+every Group and PictionaryTrial. Instead the live method keeps this index up
+to date with the messages it handles: the trial each group is on and its
+state, when the group started the trial, the responses so far and when each
+player last sent a message. vars_for_admin_report in __init__.py only reads
+it, so the report can be refreshed every second without touching the
+database.
+
+Like the other caches of the live method this is per server process. After a
+restart a group is added again with its next message, see track_progress in
+__init__.py.
+"""
+import time
+
+
+class GroupProgress:
+    """What the admin report shows of one group (the group of one phase)"""
+
+    def __init__(self, group_id: int, subsession_id: int, id_in_subsession: int, num_trials: int):
+        self.group_id = group_id
+        self.subsession_id = subsession_id
+        self.id_in_subsession = id_in_subsession
+        self.num_trials = num_trials
+        self.trial = 0
+        self.state = ""
+        self.trial_started = time.time()
+        # completed responses of the phase and how many were correct
+        self.responses = 0
+        self.correct = 0
+        # id_in_group -> participant code, and when they last sent a live message
+        self.participants: dict[int, str] = {}
+        self.last_message: dict[int, float] = {}
+
+    def update_trial(self, trial: int, state: str):
+        if trial != self.trial:
+            self.trial = trial
+            self.trial_started = time.time()
+        self.state = state
+
+    def as_row(self, now: float, idle_after: float) -> dict:
+        """The group as a row of the report, a player is idle without a message for idle_after seconds"""
+        players = []
+        for id_in_group, code in sorted(self.participants.items()):
+            last = self.last_message.get(id_in_group)
+            idle = round(now - last) if last is not None else None
+            players.append(dict(participant=code, idle=idle, stuck=idle is None or idle > idle_after))
+        return dict(
+            group=self.id_in_subsession,
+            players=players,
+            stuck=any(player["stuck"] for player in players),
+            trial=min(self.trial, self.num_trials),
+            num_trials=self.num_trials,
+            state=self.state,
+            time_in_trial=round(now - self.trial_started),
+            responses=self.responses,
+            correct=self.correct,
+            accuracy=round(self.correct / self.responses, 3) if self.responses else None,
+        )
+
+
+class ProgressIndex:
+    def __init__(self):
+        # group id -> its progress
+        self.groups: dict[int, GroupProgress] = {}
+
+    def get(self, group_id: int) -> GroupProgress | None:
+        return self.groups.get(group_id)
+
+    def add(self, progress: GroupProgress) -> GroupProgress:
+        self.groups[progress.group_id] = progress
+        return progress
+
+    def message(self, player):
+        """Records that the player sent a live message, players of groups not seen yet are ignored"""
+        progress = self.groups.get(player.group_id)
+        if progress is not None:
+            progress.last_message[player.id_in_group] = time.time()
+
+    def response(self, group_id: int, correct: bool):
+        progress = self.groups.get(group_id)
+        if progress is not None:
+            progress.responses += 1
+            progress.correct += int(correct)
+
+    def rows(self, subsession_id: int, idle_after: float) -> list[dict]:
+        """The progress of the groups of a subsession, for the admin report"""
+        now = time.time()
+        groups = [progress for progress in self.groups.values() if progress.subsession_id == subsession_id]
+        return [progress.as_row(now, idle_after) for progress in sorted(groups, key=lambda p: p.id_in_subsession)]
+
+    def clear(self):
+        self.groups.clear()
+
+
+_progress: ProgressIndex | None = None
+
+
+def get_progress() -> ProgressIndex:
+    global _progress
+    if _progress is None:
+        _progress = ProgressIndex()
+    return _progress
+
+
+def set_progress(progress: ProgressIndex):
+    """Replaces the default index, e.g. with an empty one"""
+    global _progress
+    _progress = progress
@@ -0,0 +1,229 @@
+"""Offline rasterization of finished drawings into PNG images or NumPy arrays.
+
+Drawings are read from the drawing store and rendered on a process pool. The
+strokes are drawn directly from their points (see codec.py) on the 800x600
+viewBox of the canvas in template/canvas.html, so no SVG renderer is needed.
+Results are cached on disk by drawing hash and size, drawings that were
+already rendered are skipped.
+
+Like analysis.py this needs NumPy, which the experiment itself doesn't.
+
+Example, from ``otree shell``::
+
+    from pictionary.raster import render_stored_drawings
+    render_stored_drawings("thumbnails", width=200, height=150)
+"""
+import logging
+import os
+import struct
+import zlib
+from io import BytesIO
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from .codec import DEFAULT_ATTRIBUTES, decode_drawing, parse_path_element, paths_from_svg
+from .drawing_store import get_drawing_store
+
+logger = logging.getLogger("pictionary.raster")
+
+# the viewBox of the canvas in template/canvas.html
+VIEW_BOX_WIDTH = 800
+VIEW_BOX_HEIGHT = 600
+
+FORMATS = ("png", "npy")
+
+
+# rendering
+
+def _stroke_width(attributes: dict) -> float:
+    try:
+        return float(attributes.get("stroke-width", DEFAULT_ATTRIBUTES["stroke-width"]))
+    except ValueError:
+        return float(DEFAULT_ATTRIBUTES["stroke-width"])
+
+
+def _segment_coverage(px, py, ax, ay, bx, by, radius):
+    """Coverage of pixel centres (px, py) by the round-capped segments a-b, broadcast together"""
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    # a segment of length 0 (a single point) is drawn as a dot
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.where(length2 > 0, np.clip(((px - ax) * dx + (py - ay) * dy) / length2, 0.0, 1.0), 0.0)
+    dist = np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+    # one pixel of anti-aliasing at the edge of the stroke
+    return np.clip(radius + 0.5 - dist, 0.0, 1.0)
+
+
+# short segments are rendered together in windows of at most this many pixels a side,
+# longer ones one at a time
+MAX_WINDOW = 48
+
+
+def rasterize(strokes, width: int = VIEW_BOX_WIDTH, height: int = VIEW_BOX_HEIGHT,
+              stroke_width: float = 8.0) -> np.ndarray:
+    """Renders strokes (lists of viewBox points) with round caps and joins.
+
+    Returns the ink coverage as a (height, width) uint8 array, 0 is blank and
+    255 fully covered. The viewBox is scaled to fit and centred, like the browser does.
+    """
+    scale = min(width / VIEW_BOX_WIDTH, height / VIEW_BOX_HEIGHT)
+    offset_x = (width - VIEW_BOX_WIDTH * scale) / 2
+    offset_y = (height - VIEW_BOX_HEIGHT * scale) / 2
+    radius = max(stroke_width * scale / 2, 0.5)
+    ink = np.zeros((height, width), dtype=np.float32)
+
+    segments = []
+    for points in strokes:
+        if len(points) == 0:
+            continue
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2) * scale + (offset_x, offset_y)
+        if len(pts) == 1:
+            pts = np.vstack([pts, pts])
+        segments.append(np.hstack([pts[:-1], pts[1:]]))
+    if not segments:
+        return ink.astype(np.uint8)
+    segments = np.vstack(segments)
+
+    # pixel window around each segment
+    x0 = np.floor(np.minimum(segments[:, 0], segments[:, 2]) - radius - 1).astype(np.int64)
+    y0 = np.floor(np.minimum(segments[:, 1], segments[:, 3]) - radius - 1).astype(np.int64)
+    x1 = np.ceil(np.maximum(segments[:, 0], segments[:, 2]) + radius + 1).astype(np.int64)
+    y1 = np.ceil(np.maximum(segments[:, 1], segments[:, 3]) + radius + 1).astype(np.int64)
+    extent = np.maximum(x1 - x0, y1 - y0)
+    small = extent <= MAX_WINDOW
+
+    if small.any():
+        ax, ay, bx, by = (segments[small, i][:, None, None] for i in range(4))
+        offsets = np.arange(extent[small].max())
+        px = (x0[small][:, None, None] + offsets[None, None, :])
+        py = (y0[small][:, None, None] + offsets[None, :, None])
+        coverage = _segment_coverage(px + 0.5, py + 0.5, ax, ay, bx, by, radius)
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height) & (coverage > 0)
+        index = np.broadcast_to(py * width + px, coverage.shape)[inside]
+        np.maximum.at(ink.reshape(-1), index, coverage[inside].astype(np.float32))
+
+    for (ax, ay, bx, by), sx0, sy0, sx1, sy1 in zip(segments[~small], x0[~small], y0[~small], x1[~small], y1[~small]):
+        sx0, sy0 = max(sx0, 0), max(sy0, 0)
+        sx1, sy1 = min(sx1, width), min(sy1, height)
+        if sx0 >= sx1 or sy0 >= sy1:
+            continue
+        px = np.arange(sx0, sx1, dtype=np.float64)[None, :] + 0.5
+        py = np.arange(sy0, sy1, dtype=np.float64)[:, None] + 0.5
+        region = ink[sy0:sy1, sx0:sx1]
+        np.maximum(region, _segment_coverage(px, py, ax, ay, bx, by, radius), out=region)
+
+    return (ink * 255 + 0.5).astype(np.uint8)
+
+
+def strokes_from_stored(data: bytes, encoding: str) -> tuple[list, float]:
+    """Returns the strokes and the stroke width of a drawing as it is kept in the store"""
+    if encoding == "strokes":
+        attributes, strokes, _ = decode_drawing(data)
+        return strokes, _stroke_width(attributes)
+    strokes = []
+    attributes: dict = {}
+    for path in paths_from_svg(data.decode("utf-8")):
+        attributes, points = parse_path_element(path)
+        strokes.append(points)
+    return strokes, _stroke_width(attributes)
+
+
+def encode_png(coverage: np.ndarray) -> bytes:
+    """Encodes the coverage as an 8-bit greyscale PNG, black ink on white"""
+    height, width = coverage.shape
+    pixels = 255 - coverage
+    # every scanline starts with filter type 0 (none)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), pixels]).tobytes()
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def encode_npy(coverage: np.ndarray) -> bytes:
+    out = BytesIO()
+    np.save(out, coverage)
+    return out.getvalue()
+
+
+# pipeline
+
+def output_path(output_dir: str | Path, digest: str, width: int, height: int, fmt: str) -> Path:
+    """Where the rendering of a drawing is cached, e.g. output_dir/200x150/ab/abcdef....png"""
+    return Path(output_dir) / f"{width}x{height}" / digest[:2] / f"{digest}.{fmt}"
+
+
+def render_drawing(digest: str, encoding: str, output_dir: str, width: int, height: int, fmt: str) -> str:
+    """Renders one stored drawing, returns "rendered", "cached" or "failed" """
+    path = output_path(output_dir, digest, width, height, fmt)
+    if path.exists():
+        return "cached"
+    try:
+        strokes, stroke_width = strokes_from_stored(get_drawing_store().get(digest), encoding)
+    except (OSError, ValueError) as e:
+        logger.warning("could not read drawing %s: %s", digest, e)
+        return "failed"
+    coverage = rasterize(strokes, width, height, stroke_width)
+    data = encode_png(coverage) if fmt == "png" else encode_npy(coverage)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # same as the drawing store, never leave a partial file behind
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+    return "rendered"
+
+
+def _render_job(job: tuple) -> str:
+    return render_drawing(*job)
+
+
+def render_drawings(drawings: Iterable[tuple[str, str]], output_dir: str | Path, width: int = 200,
+                    height: int = 150, fmt: str = "png", workers: int | None = None,
+                    chunksize: int = 32) -> dict[str, int]:
+    """Renders (hash, encoding) pairs on a process pool and returns how many were rendered, cached or failed.
+
+    Each worker writes its renderings to output_dir and only sends back the
+    status, which is counted as it arrives, in any order.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {FORMATS}")
+    output_dir = str(output_dir)
+    results = {"rendered": 0, "cached": 0, "failed": 0}
+
+    def jobs():
+        for digest, encoding in drawings:
+            # skipping cached drawings here saves sending them to the pool
+            if output_path(output_dir, digest, width, height, fmt).exists():
+                results["cached"] += 1
+            else:
+                yield digest, encoding, output_dir, width, height, fmt
+
+    with Pool(workers) as pool:
+        for status in pool.imap_unordered(_render_job, jobs(), chunksize=chunksize):
+            results[status] += 1
+    return results
+
+
+def iter_stored_drawings(batch_size: int = 1000) -> Iterator[tuple[str, str]]:
+    """Streams the (hash, encoding) of every finished drawing from the database, each hash once"""
+    from otree.database import db  # type: ignore
+    from . import PictionaryDrawing
+
+    query = (
+        db.query(PictionaryDrawing.svg_hash, PictionaryDrawing.svg_encoding)
+        .filter(PictionaryDrawing.svg_hash != "")
+        .distinct()
+        .yield_per(batch_size)
+    )
+    for digest, encoding in query:
+        yield digest, encoding
+
+
+def render_stored_drawings(output_dir: str | Path, **kwargs) -> dict[str, int]:
+    """Renders every finished drawing in the database, see render_drawings for the options"""
+    return render_drawings(iter_stored_drawings(), output_dir, **kwargs)
@@ -0,0 +1,376 @@
+"""Nearest-neighbour similarity between finished drawings.
+
+Every drawing is turned into a fixed-length vector: its strokes are scaled to
+fit the canvas (so position and size don't matter), rasterized at a low
+resolution (see raster.py) and normalized to unit length, so the dot product
+of two vectors is their cosine similarity. The vectors are kept in a
+memory-mapped NumPy matrix on disk together with the group, phase, trial and
+stimulus of each drawing, and the queries are batched matrix products.
+
+The index is updated incrementally: ``update()`` only vectorizes the finished
+drawings that aren't in it yet, so it can be run every few minutes while data
+is being collected. Drawings that are already in it keep their vectors, so
+after ``simplify_stored_drawings`` has replaced their SVGs run ``refresh()``. Like analysis.py this needs NumPy, which the experiment
+itself doesn't.
+
+Example, from ``otree shell``::
+
+    from pictionary.similarity import SimilarityIndex
+    index = SimilarityIndex("similarity")
+    index.update()
+    index.refresh()  # after simplify_stored_drawings
+    index.pair_similarity()[3]  # within- and between-pair similarity in phase 3
+    ids, scores = index.neighbours([drawing_id], k=5)
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from .drawing_store import get_drawing_store
+from .raster import VIEW_BOX_HEIGHT, VIEW_BOX_WIDTH, rasterize, strokes_from_stored
+
+logger = logging.getLogger("pictionary.similarity")
+
+VECTOR_WIDTH = 32
+VECTOR_HEIGHT = 24
+# about one pixel of the vector raster, thinner strokes would mostly fall between pixel centres
+VECTOR_STROKE_WIDTH = 25.0
+# margin around the scaled strokes, in viewBox units
+MARGIN = 20.0
+
+META_DTYPE = np.dtype([
+    ("drawing_id", np.int64),
+    ("group_id", np.int64),
+    ("phase", np.int16),
+    ("trial", np.int16),
+    ("stim_id", np.int32),
+])
+
+MIN_CAPACITY = 1024
+# rows of the index multiplied with the queries at once
+BLOCK_SIZE = 16384
+
+
+# vectors
+
+def normalize_strokes(strokes) -> list[np.ndarray]:
+    """Scales and centres the strokes so their bounding box fits the viewBox"""
+    strokes = [np.asarray(points, dtype=np.float64).reshape(-1, 2) for points in strokes if len(points)]
+    if not strokes:
+        return []
+    points = np.vstack(strokes)
+    low, high = points.min(axis=0), points.max(axis=0)
+    size = np.maximum(high - low, 1.0)
+    scale = min((VIEW_BOX_WIDTH - 2 * MARGIN) / size[0], (VIEW_BOX_HEIGHT - 2 * MARGIN) / size[1])
+    centre = np.array([VIEW_BOX_WIDTH / 2, VIEW_BOX_HEIGHT / 2])
+    return [(stroke - (low + high) / 2) * scale + centre for stroke in strokes]
+
+
+def drawing_vector(strokes, width: int = VECTOR_WIDTH, height: int = VECTOR_HEIGHT) -> np.ndarray:
+    """Unit length float32 vector of the strokes, all zeros for an empty drawing"""
+    coverage = rasterize(normalize_strokes(strokes), width, height, VECTOR_STROKE_WIDTH)
+    vector = coverage.reshape(-1).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def stored_drawing_vector(digest: str, encoding: str, width: int = VECTOR_WIDTH,
+                          height: int = VECTOR_HEIGHT) -> np.ndarray:
+    strokes, _ = strokes_from_stored(get_drawing_store().get(digest), encoding)
+    return drawing_vector(strokes, width, height)
+
+
+# index
+
+class SimilarityIndex:
+    """Drawing vectors in a memory-mapped matrix, with a row of metadata per drawing.
+
+    The directory holds vectors.npy and meta.npy, which are allocated in
+    advance and grown when full, and index.json with the number of rows in use.
+    A single process should update an index at a time.
+    """
+
+    def __init__(self, path: str | Path, width: int = VECTOR_WIDTH, height: int = VECTOR_HEIGHT):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.width = width
+        self.height = height
+        self.count = 0
+        info_path = self.path / "index.json"
+        if info_path.exists():
+            info = json.loads(info_path.read_text())
+            if (info["width"], info["height"]) != (width, height):
+                raise ValueError(
+                    f"Index at {self.path} has {info['width']}x{info['height']} vectors, not {width}x{height}"
+                )
+            self.count = info["count"]
+            self._vectors = np.load(self.path / "vectors.npy", mmap_mode="r+")
+            self._meta = np.load(self.path / "meta.npy", mmap_mode="r+")
+        else:
+            self._vectors, self._meta = self._allocate(MIN_CAPACITY, "")
+            self._write_info()
+
+    @property
+    def dim(self) -> int:
+        return self.width * self.height
+
+    @property
+    def capacity(self) -> int:
+        return len(self._meta)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self.count]
+
+    @property
+    def meta(self) -> np.ndarray:
+        return self._meta[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def _allocate(self, capacity: int, suffix: str) -> tuple[np.ndarray, np.ndarray]:
+        vectors = np.lib.format.open_memmap(
+            self.path / f"vectors.npy{suffix}", mode="w+", dtype=np.float32, shape=(capacity, self.dim)
+        )
+        meta = np.lib.format.open_memmap(
+            self.path / f"meta.npy{suffix}", mode="w+", dtype=META_DTYPE, shape=(capacity,)
+        )
+        return vectors, meta
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * self.capacity)
+        vectors, meta = self._allocate(capacity, ".tmp")
+        vectors[:self.count] = self.vectors
+        meta[:self.count] = self.meta
+        vectors.flush()
+        meta.flush()
+        del vectors, meta, self._vectors, self._meta
+        os.replace(self.path / "vectors.npy.tmp", self.path / "vectors.npy")
+        os.replace(self.path / "meta.npy.tmp", self.path / "meta.npy")
+        self._vectors = np.load(self.path / "vectors.npy", mmap_mode="r+")
+        self._meta = np.load(self.path / "meta.npy", mmap_mode="r+")
+
+    def _write_info(self):
+        # the rows are flushed before the count that makes them visible
+        info_path = self.path / "index.json"
+        tmp_path = info_path.with_name(f"index.json.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(dict(count=self.count, width=self.width, height=self.height)))
+        os.replace(tmp_path, info_path)
+
+    def add(self, meta: np.ndarray, vectors: np.ndarray):
+        """Appends rows of META_DTYPE metadata and their vectors"""
+        if len(meta) != len(vectors):
+            raise ValueError(f"Got {len(meta)} metadata rows for {len(vectors)} vectors")
+        if not len(meta):
+            return
+        end = self.count + len(meta)
+        if end > self.capacity:
+            self._grow(end)
+        self._vectors[self.count:end] = vectors
+        self._meta[self.count:end] = meta
+        self._vectors.flush()
+        self._meta.flush()
+        self.count = end
+        self._write_info()
+
+    def rows(self, drawing_ids) -> np.ndarray:
+        """Row of each drawing in the index, KeyError if one isn't in it"""
+        drawing_ids = np.asarray(drawing_ids, dtype=np.int64)
+        stored = self.meta["drawing_id"]
+        if not self.count:
+            rows = np.zeros(len(drawing_ids), dtype=np.int64)
+            found = np.zeros(len(drawing_ids), dtype=bool)
+        else:
+            order = np.argsort(stored)
+            positions = np.minimum(np.searchsorted(stored, drawing_ids, sorter=order), self.count - 1)
+            rows = order[positions]
+            found = stored[rows] == drawing_ids
+        if not found.all():
+            raise KeyError(f"Drawings not in the index: {drawing_ids[~found].tolist()}")
+        return rows
+
+    # queries
+
+    def knn(self, queries: np.ndarray, k: int = 10, exclude_rows=None) -> tuple[np.ndarray, np.ndarray]:
+        """The k most similar drawings to each query vector.
+
+        Returns the drawing ids and the similarities, both of shape (queries, k)
+        and best first. exclude_rows gives an index row per query to leave out,
+        e.g. the query drawing itself. Rows are -1 where there are fewer than k drawings.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, self.count, BLOCK_SIZE):
+            block = self._vectors[start:min(start + BLOCK_SIZE, self.count)]
+            scores = queries @ block.T
+            if exclude_rows is not None:
+                local = np.asarray(exclude_rows) - start
+                inside = (local >= 0) & (local < len(block))
+                scores[np.nonzero(inside)[0], local[inside]] = -np.inf
+            # keep the best k of the previous blocks and this one
+            scores = np.hstack([best_scores, scores])
+            rows = np.hstack([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))])
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, top, axis=1)
+                rows = np.take_along_axis(rows, top, axis=1)
+            best_scores, best_rows = scores, rows
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        ids = np.where(np.isfinite(best_scores), self._meta["drawing_id"][np.take_along_axis(best_rows, order, axis=1)], -1)
+        padding = k - ids.shape[1]
+        if padding > 0:
+            ids = np.pad(ids, ((0, 0), (0, padding)), constant_values=-1)
+            best_scores = np.pad(best_scores, ((0, 0), (0, padding)), constant_values=-np.inf)
+        return ids, best_scores
+
+    def neighbours(self, drawing_ids, k: int = 10) -> tuple[np.ndarray, np.ndarray]:
+        """The k most similar other drawings of drawings in the index, see knn"""
+        rows = self.rows(drawing_ids)
+        return self.knn(self._vectors[rows], k, exclude_rows=rows)
+
+    def similarity(self, ids_a, ids_b=None) -> np.ndarray:
+        """Matrix of the similarities between two lists of drawings (or one list and itself)"""
+        a = self._vectors[self.rows(ids_a)]
+        b = a if ids_b is None else self._vectors[self.rows(ids_b)]
+        return a @ b.T
+
+    def pair_similarity(self) -> dict[int, dict]:
+        """Mean similarity of drawings of the same stimulus, per phase.
+
+        ``within`` compares drawings made in the same group (pair), ``between``
+        drawings made in different groups. A pair that converges on its own
+        signs has a within similarity that grows over the phases while the
+        between similarity doesn't. ``groups`` has the within similarity of each group.
+        """
+        meta = self.meta
+        result = {}
+        for phase in np.unique(meta["phase"]):
+            in_phase = np.nonzero(meta["phase"] == phase)[0]
+            groups, group_index = np.unique(meta["group_id"][in_phase], return_inverse=True)
+            within_sums = np.zeros(len(groups))
+            within_counts = np.zeros(len(groups), dtype=np.int64)
+            between_sum = 0.0
+            between_count = 0
+            stim_ids = meta["stim_id"][in_phase]
+            for stim_id in np.unique(stim_ids):
+                same_stim = np.nonzero(stim_ids == stim_id)[0]
+                vectors = self._vectors[in_phase[same_stim]]
+                scores = vectors @ vectors.T
+                group = group_index[same_stim]
+                # every unordered pair of drawings once
+                i, j = np.triu_indices(len(same_stim), k=1)
+                same_group = group[i] == group[j]
+                pair_scores = scores[i, j]
+                within_sums += np.bincount(group[i][same_group], weights=pair_scores[same_group], minlength=len(groups))
+                within_counts += np.bincount(group[i][same_group], minlength=len(groups))
+                between_sum += float(pair_scores[~same_group].sum())
+                between_count += int((~same_group).sum())
+            with np.errstate(invalid="ignore", divide="ignore"):
+                group_means = np.where(within_counts > 0, within_sums / within_counts, np.nan)
+            result[int(phase)] = dict(
+                within=float(within_sums.sum() / within_counts.sum()) if within_counts.sum() else np.nan,
+                within_count=int(within_counts.sum()),
+                between=between_sum / between_count if between_count else np.nan,
+                between_count=between_count,
+                groups=dict(zip(groups.tolist(), group_means.tolist())),
+            )
+        return result
+
+    # incremental updates
+
+    def update(self, batch_size: int = 500) -> int:
+        """Adds the finished drawings that aren't in the index yet, returns how many were added"""
+        added = 0
+        for meta, hashes in iter_finished_drawings(self.meta["drawing_id"], batch_size):
+            vectors = np.zeros((len(meta), self.dim), dtype=np.float32)
+            keep = np.ones(len(meta), dtype=bool)
+            for i, (digest, encoding) in enumerate(hashes):
+                try:
+                    vectors[i] = stored_drawing_vector(digest, encoding, self.width, self.height)
+                except (OSError, ValueError) as e:
+                    logger.warning("could not read drawing %s: %s", digest, e)
+                    keep[i] = False
+            self.add(meta[keep], vectors[keep])
+            added += int(keep.sum())
+        return added
+
+    def refresh(self, drawing_ids=None, batch_size: int = 500) -> int:
+        """Vectorizes drawings in the index again from their current SVG, returns how many were refreshed.
+
+        By default every drawing in the index, drawing_ids that aren't in it are
+        skipped (update adds them). A drawing that can't be read keeps its old vector.
+        """
+        known = self.meta["drawing_id"]
+        ids = known.copy() if drawing_ids is None else np.asarray(drawing_ids, dtype=np.int64)
+        ids = ids[np.isin(ids, known)]
+        refreshed = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            hashes = stored_hashes(batch.tolist())
+            for row, drawing_id in zip(self.rows(batch), batch.tolist()):
+                if drawing_id not in hashes:
+                    continue
+                digest, encoding = hashes[drawing_id]
+                try:
+                    self._vectors[row] = stored_drawing_vector(digest, encoding, self.width, self.height)
+                except (OSError, ValueError) as e:
+                    logger.warning("could not read drawing %s: %s", digest, e)
+                    continue
+                refreshed += 1
+            self._vectors.flush()
+        return refreshed
+
+
+def stored_hashes(drawing_ids: list) -> dict[int, tuple[str, str]]:
+    """The current (hash, encoding) of each of the drawings that has a stored SVG"""
+    from otree.database import db  # type: ignore
+    from . import PictionaryDrawing
+
+    rows = db.query(PictionaryDrawing.id, PictionaryDrawing.svg_hash, PictionaryDrawing.svg_encoding).filter(
+        PictionaryDrawing.id.in_(drawing_ids),
+        PictionaryDrawing.svg_hash != "",
+    )
+    return {drawing_id: (digest, encoding) for drawing_id, digest, encoding in rows}
+
+
+def iter_finished_drawings(known_ids, batch_size: int = 500) -> Iterator[tuple[np.ndarray, list]]:
+    """Streams the metadata and (hash, encoding) of finished drawings that aren't in known_ids"""
+    from otree.database import db  # type: ignore
+    from . import PictionaryDrawing, PictionaryTrial
+
+    # drawings are created with their trials, so the ids of the finished ones aren't
+    # increasing, compare the full list of ids instead
+    finished = np.fromiter(
+        (drawing_id for drawing_id, in db.query(PictionaryDrawing.id).filter(
+            PictionaryDrawing.completed == True,  # noqa: E712
+            PictionaryDrawing.svg_hash != "",
+        )),
+        dtype=np.int64,
+    )
+    new_ids = np.sort(finished[~np.isin(finished, known_ids)])
+    for start in range(0, len(new_ids), batch_size):
+        batch = new_ids[start:start + batch_size].tolist()
+        rows = (
+            db.query(
+                PictionaryDrawing.id,
+                PictionaryTrial.group_id,
+                PictionaryTrial.phase,
+                PictionaryTrial.trial,
+                PictionaryTrial.stim_id,
+                PictionaryDrawing.svg_hash,
+                PictionaryDrawing.svg_encoding,
+            )
+            .join(PictionaryTrial, PictionaryTrial.drawing_id == PictionaryDrawing.id)
+            .filter(PictionaryDrawing.id.in_(batch))
+            .order_by(PictionaryDrawing.id)
+            .all()
+        )
+        meta = np.array([tuple(row[:5]) for row in rows], dtype=META_DTYPE)
+        yield meta, [row[5:] for row in rows]
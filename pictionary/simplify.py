@@ -0,0 +1,61 @@
+"""Simplification of drawn paths, the same as PathSimplifier in static/drawer.js.
+
+The Drawer adds a point on every mouse move, so a long stroke can have
+thousands of points that mostly lie on a straight line. Ramer-Douglas-Peucker
+keeps only the points that are further than ``tolerance`` pixels from the line
+between the points that are kept, which with a tolerance of about a pixel
+doesn't visibly change the drawing.
+
+New drawings are simplified by the Drawer when a stroke is finished, these
+functions do the same for drawings that were stored before, see
+simplify_stored_drawings in __init__.py.
+"""
+import math
+
+from .codec import parse_path_element, path_element, paths_from_svg
+from .strokes import build_svg
+
+# pixels, the same default as the Drawer
+DEFAULT_TOLERANCE = 1.0
+
+
+def _segment_distance(p, a, b) -> float:
+    """Distance from p to the segment a-b"""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    t = 0.0
+    if length2 > 0:
+        t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length2))
+    return math.hypot(p[0] - (a[0] + t * dx), p[1] - (a[1] + t * dy))
+
+
+def simplify_points(points, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """Returns the points Ramer-Douglas-Peucker keeps, a tolerance of 0 keeps every point"""
+    points = list(points)
+    if tolerance <= 0 or len(points) < 3:
+        return points
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    # no recursion, long strokes have thousands of points
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance, index = 0.0, -1
+        for i in range(first + 1, last):
+            distance = _segment_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index != -1 and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_svg(svg: str, tolerance: float = DEFAULT_TOLERANCE) -> str:
+    """Simplifies every path of an SVG made by the Drawer, raises ValueError for other SVGs"""
+    paths = []
+    for path in paths_from_svg(svg):
+        attributes, points = parse_path_element(path)
+        paths.append(path_element(simplify_points(points, tolerance), attributes))
+    return build_svg(paths)
@@ -8,13 +8,18 @@ class Drawer {
 
     #readOnly = false;
     #hiddenElement = null;
+    #onOperation = null;
 
     #buffer = [];
     #bufferSize = 8; // Change to decrease/increase smoothness of paths
 
     #path = null;
     #strPath;
+    #points = []; // the smoothed points of the current path, without the part near the mouse
+    #lastTime = 0; // timeStamp of the last mouse event of the current path
+    #frame = null; // pending requestAnimationFrame that updates the current path
     #userPaths = [];
+    #simplifyTolerance = 1; // finished paths are simplified with this tolerance (pixels), 0 keeps every point
 
     #pathColor = "#cb1212"; // Edit this to change the drawing color
     #pathStrokeWidth = "15"; // Edit this to change the stroke width
@@ -26,20 +31,25 @@ class Drawer {
      * @param {Object} opts An object with optional parameters
      * @param {boolean} opts.readOnly Whether the drawing should be read-only
      * @param {HTMLElement} opts.hiddenElement An input element to save the state of the SVG
+     * @param {function} opts.onOperation Called with each stroke operation ({op: 'add', element, times}, {op: 'undo', time} or {op: 'clear', time}),
+     *   times has the time of each point of the path, all times are on the clock of performance.now()
      * @param {string} opts.pathColor The color of the path
      * @param {string} opts.strokeWidth The width of the path
      * @param {string} opts.strokeEnds The ends of the path
      * @param {number} opts.bufferSize The size of the buffer
+     * @param {number} opts.simplifyTolerance How far (pixels) a finished path may be moved by simplifying it
      */
-    constructor(svgElement, opts = {readOnly: false, hiddenElement: null, pathColor: "#cb1212", strokeWidth: "15", strokeEnds: "round", bufferSize: 8}) {
+    constructor(svgElement, opts = {readOnly: false, hiddenElement: null, pathColor: "#cb1212", strokeWidth: "15", strokeEnds: "round", bufferSize: 8, simplifyTolerance: 1}) {
         this.#SVGElement = svgElement;
         this.#hiddenElement = opts.hiddenElement || this.#hiddenElement;
+        this.#onOperation = opts.onOperation || this.#onOperation;
         this.#rect = svgElement.getBoundingClientRect();
         this.#pathColor = opts.pathColor || this.#pathColor;
         this.#pathStrokeWidth = opts.strokeWidth || this.#pathStrokeWidth;
         this.#pathStrokeEnds = opts.strokeEnds || this.#pathStrokeEnds;
         this.#bufferSize = opts.bufferSize || this.#bufferSize;
         this.#readOnly = Object.prototype.hasOwnProperty.call(opts, 'readOnly') ? opts.readOnly : this.#readOnly;
+        this.#simplifyTolerance = typeof opts.simplifyTolerance === 'number' ? opts.simplifyTolerance : this.#simplifyTolerance;
         if (this.#readOnly !== true) {
             this.#SVGElement.addEventListener('mousedown', (event) => { this.startDraw(event) });
             this.#SVGElement.addEventListener('mousemove', (event) => { this.draw(event) });
@@ -68,6 +78,8 @@ class Drawer {
         this.#buffer = [];
         let pt = this.#getMousePosition(e);
         this.#appendToBuffer(pt);
+        this.#lastTime = e.timeStamp;
+        this.#points = [{x: pt.x, y: pt.y, t: e.timeStamp}];
         this.#strPath = "M" + pt.x + " " + pt.y;
         this.#path.setAttribute("d", this.#strPath);
         this.#path.setAttribute("data-is-user", "true")
@@ -81,6 +93,7 @@ class Drawer {
     draw(e) {
         if (this.#path) {
             this.#appendToBuffer(this.#getMousePosition(e));
+            this.#lastTime = e.timeStamp;
             this.#updateSvgPath();
         }
     }
@@ -92,7 +105,16 @@ class Drawer {
      */
     stopDraw() {
         if (this.#path) {
+            if (this.#frame !== null) {
+                cancelAnimationFrame(this.#frame);
+                this.#frame = null;
+            }
+            // the finished path, with the part near the mouse as it was last shown
+            const tail = this.#getTailPoints().map((pt) => ({x: pt.x, y: pt.y, t: this.#lastTime}));
+            const points = PathSimplifier.simplify(this.#points.concat(tail), this.#simplifyTolerance);
+            this.#path.setAttribute("d", PathSimplifier.pathData(points));
             this.#userPaths.push(this.#path)
+            this.#emitOperation({op: 'add', element: this.#path, times: points.map((pt) => pt.t)});
             this.#path = null;
             this.#saveState();
         }
@@ -121,6 +143,7 @@ class Drawer {
         }
         // otherwise, remove the path and save the state
         this.#userPaths.pop().remove();
+        this.#emitOperation({op: 'undo', time: performance.now()});
         this.#saveState();
     }
 
@@ -130,7 +153,7 @@ class Drawer {
      * @param {NodeListOf<SVGPathElement>} userPaths A list of SVGPathElement objects
      */
     restorePaths(userPaths) {
-        this.clearSVG();
+        this.#removePaths();
         for (let p of userPaths) {
             this.#SVGElement.appendChild(p);
             this.#userPaths.push(p);
@@ -144,11 +167,59 @@ class Drawer {
      * @return {void}
      */
     clearSVG() {
+        this.#removePaths();
+        this.#emitOperation({op: 'clear', time: performance.now()});
+        this.#clearState();
+    }
+
+    /**
+     * Applies a stroke operation drawn by someone else, e.g. to follow the drawer live
+     *
+     * @param {{op: string, d: (string|undefined)}} operation The operation, add needs the path data in d
+     * @return {void}
+     */
+    applyOperation(operation) {
+        if (operation.op === 'add' && operation.d) {
+            const path = document.createElementNS('http://www.w3.org/2000/svg', 'path');
+            path.setAttribute("fill", "none");
+            path.setAttribute("stroke", this.#pathColor);
+            path.setAttribute("stroke-width", this.#pathStrokeWidth);
+            path.setAttribute("stroke-linecap", this.#pathStrokeEnds);
+            path.setAttribute("d", operation.d);
+            path.setAttribute("data-is-user", "true");
+            this.#SVGElement.appendChild(path);
+            this.#userPaths.push(path);
+        } else if (operation.op === 'undo') {
+            if (this.#userPaths.length > 0) {
+                this.#userPaths.pop().remove();
+            }
+        } else if (operation.op === 'clear') {
+            this.#removePaths();
+        }
+    }
+
+    /**
+     * Removes the user-drawn paths from the SVG element without notifying anyone
+     *
+     * @return {void}
+     */
+    #removePaths() {
         for (let p of this.#userPaths) {
             p.remove();
         }
         this.#userPaths = [];
-        this.#clearState();
+    }
+
+    /**
+     * Passes a stroke operation to the onOperation callback, if there is one
+     *
+     * @param {{op: string, element: (SVGPathElement|undefined)}} operation The operation
+     * @return {void}
+     */
+    #emitOperation(operation) {
+        if (this.#onOperation) {
+            this.#onOperation(operation);
+        }
     }
 
     /**
@@ -207,7 +278,8 @@ class Drawer {
     }
 
     /**
-     * Gets an average of points from the buffer and appends to SVG path element
+     * Gets an average of points from the buffer and appends it to the path,
+     * the path element is updated at the next animation frame
      *
      * @return {void}
      */
@@ -217,18 +289,51 @@ class Drawer {
         if (pt) {
             // Get the smoothed part of the path that will not change
             this.#strPath += " L" + pt.x + " " + pt.y;
+            pt.t = this.#lastTime;
+            this.#points.push(pt);
 
-            // Get the last part of the path (close to the current mouse position)
-            // This part will change if the mouse moves again
-            let tmpPath = "";
-            for (let offset = 2; offset < this.#buffer.length; offset += 2) {
-                pt = this.#getAveragePoint(offset);
-                tmpPath += " L" + pt.x + " " + pt.y;
+            // several mouse events can arrive per frame, the path is only rendered once
+            if (this.#frame === null) {
+                this.#frame = requestAnimationFrame(() => this.#renderSvgPath());
             }
+        }
+    }
 
-            // Set the complete current path coordinates
-            this.#path.setAttribute("d", this.#strPath + tmpPath);
+    /**
+     * Sets the d attribute of the current path
+     *
+     * @return {void}
+     */
+    #renderSvgPath() {
+        this.#frame = null;
+        if (!this.#path) {
+            return;
+        }
+        // Get the last part of the path (close to the current mouse position)
+        // This part will change if the mouse moves again
+        let tmpPath = "";
+        for (const pt of this.#getTailPoints()) {
+            tmpPath += " L" + pt.x + " " + pt.y;
         }
+
+        // Set the complete current path coordinates
+        this.#path.setAttribute("d", this.#strPath + tmpPath);
+    }
+
+    /**
+     * Gets the points of the last part of the path, which still changes while the mouse moves
+     *
+     * @return {{x: number, y: number}[]} The points
+     */
+    #getTailPoints() {
+        const points = [];
+        if (this.#getAveragePoint(0) === null) {
+            return points;
+        }
+        for (let offset = 2; offset < this.#buffer.length; offset += 2) {
+            points.push(this.#getAveragePoint(offset));
+        }
+        return points;
     }
 
     /**
@@ -259,6 +364,193 @@ class Drawer {
     }
 }
 
+/**
+ * Simplification of finished paths, the same as simplify_points in simplify.py
+ */
+class PathSimplifier {
+    /**
+     * Ramer-Douglas-Peucker: drops the points that are closer than tolerance to
+     * the line between the points that are kept
+     *
+     * @param {{x: number, y: number}[]} points The points of the path
+     * @param {number} tolerance The largest distance (pixels) a point may be moved, 0 keeps every point
+     * @return {{x: number, y: number}[]} The points that are kept
+     */
+    static simplify(points, tolerance) {
+        if (tolerance <= 0 || points.length < 3) {
+            return points;
+        }
+        const keep = new Array(points.length).fill(false);
+        keep[0] = true;
+        keep[points.length - 1] = true;
+        // no recursion, long strokes have thousands of points
+        const stack = [[0, points.length - 1]];
+        while (stack.length > 0) {
+            const [first, last] = stack.pop();
+            let maxDistance = 0;
+            let index = -1;
+            for (let i = first + 1; i < last; i++) {
+                const distance = PathSimplifier.#segmentDistance(points[i], points[first], points[last]);
+                if (distance > maxDistance) {
+                    maxDistance = distance;
+                    index = i;
+                }
+            }
+            if (index !== -1 && maxDistance > tolerance) {
+                keep[index] = true;
+                stack.push([first, index], [index, last]);
+            }
+        }
+        return points.filter((_, i) => keep[i]);
+    }
+
+    /**
+     * Builds the d attribute of a path, with the coordinates rounded like StrokeCodec does
+     *
+     * @param {{x: number, y: number}[]} points The points
+     * @return {string} The path data
+     */
+    static pathData(points) {
+        const round = (value) => Math.round(value * StrokeCodec.SCALE) / StrokeCodec.SCALE;
+        return StrokeCodec.pathDataFromPoints(points.map((pt) => ({x: round(pt.x), y: round(pt.y)})));
+    }
+
+    /**
+     * Distance from p to the segment a-b
+     */
+    static #segmentDistance(p, a, b) {
+        const dx = b.x - a.x;
+        const dy = b.y - a.y;
+        const length2 = dx * dx + dy * dy;
+        let t = 0;
+        if (length2 > 0) {
+            t = Math.max(0, Math.min(1, ((p.x - a.x) * dx + (p.y - a.y) * dy) / length2));
+        }
+        return Math.hypot(p.x - (a.x + t * dx), p.y - (a.y + t * dy));
+    }
+}
+
+/**
+ * Compact encoding of stroke points, the same as encode_points / decode_points in codec.py
+ *
+ * Coordinates are quantized to SCALE steps per pixel, delta-encoded against the
+ * previous point, written as zigzag varints and sent as base64.
+ */
+class StrokeCodec {
+    static SCALE = 10; // must match DEFAULT_SCALE in codec.py
+
+    /**
+     * Gets the points of a path made of M and L commands
+     *
+     * @param {string} d The d attribute of a path
+     * @return {{x: number, y: number}[]} The points
+     */
+    static pointsFromPathData(d) {
+        const numbers = (d.match(/-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?/g) || []).map(Number);
+        const points = [];
+        for (let i = 0; i + 1 < numbers.length; i += 2) {
+            points.push({x: numbers[i], y: numbers[i + 1]});
+        }
+        return points;
+    }
+
+    /**
+     * Encodes a list of points
+     *
+     * @param {{x: number, y: number}[]} points The points
+     * @return {string} The base64-encoded points
+     */
+    static encodePoints(points) {
+        const bytes = [];
+        let prevX = 0;
+        let prevY = 0;
+        for (const pt of points) {
+            const x = Math.round(pt.x * StrokeCodec.SCALE);
+            const y = Math.round(pt.y * StrokeCodec.SCALE);
+            StrokeCodec.#writeVarint(bytes, x - prevX);
+            StrokeCodec.#writeVarint(bytes, y - prevY);
+            prevX = x;
+            prevY = y;
+        }
+        return StrokeCodec.#toBase64(bytes);
+    }
+
+    /**
+     * Encodes the times of the points of a path, the same as encode_times in timeline.py
+     *
+     * @param {number[]} times The times (ms) of the points
+     * @return {string} The base64-encoded ms between the points, starting with 0
+     */
+    static encodeTimes(times) {
+        const bytes = [];
+        let prev = times.length > 0 ? Math.round(times[0]) : 0;
+        for (const time of times) {
+            StrokeCodec.#writeVarint(bytes, Math.round(time) - prev);
+            prev = Math.round(time);
+        }
+        return StrokeCodec.#toBase64(bytes);
+    }
+
+    static #writeVarint(bytes, value) {
+        // zigzag, so small negative deltas stay small
+        value = value >= 0 ? value * 2 : -value * 2 - 1;
+        while (value > 0x7F) {
+            bytes.push((value & 0x7F) | 0x80);
+            value = Math.floor(value / 128);
+        }
+        bytes.push(value);
+    }
+
+    static #toBase64(bytes) {
+        let binary = '';
+        for (const b of bytes) {
+            binary += String.fromCharCode(b);
+        }
+        return btoa(binary);
+    }
+
+    /**
+     * Decodes a list of points
+     *
+     * @param {string} base64String The base64-encoded points
+     * @return {{x: number, y: number}[]} The points
+     */
+    static decodePoints(base64String) {
+        const binary = atob(base64String);
+        const points = [];
+        let pos = 0;
+        const readVarint = () => {
+            let result = 0;
+            let factor = 1;
+            let b;
+            do {
+                b = binary.charCodeAt(pos++);
+                result += (b & 0x7F) * factor;
+                factor *= 128;
+            } while (b & 0x80);
+            return result % 2 === 0 ? result / 2 : -(result + 1) / 2;
+        };
+        let x = 0;
+        let y = 0;
+        while (pos < binary.length) {
+            x += readVarint();
+            y += readVarint();
+            points.push({x: x / StrokeCodec.SCALE, y: y / StrokeCodec.SCALE});
+        }
+        return points;
+    }
+
+    /**
+     * Builds the d attribute of a path from a list of points
+     *
+     * @param {{x: number, y: number}[]} points The points
+     * @return {string} The path data
+     */
+    static pathDataFromPoints(points) {
+        return points.map((pt, i) => (i === 0 ? 'M' : 'L') + pt.x + ' ' + pt.y).join(' ');
+    }
+}
+
 /**
  * Helper class with various static functions, e.g., export and download
  */
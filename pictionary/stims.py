@@ -1,4 +1,6 @@
 """This could be JSON or in the database, for now, let's just define it here"""
+from typing import NamedTuple
+
 
 PRONOUN: list[str] = [
     "1st person",
@@ -98,3 +100,56 @@ PHASE_3: list[tuple[str, list[str]]] = [
 
 
 PHASES: list[list[tuple[str, list[str]]]] = [PHASE_1, PHASE_2, PHASE_3]
+
+
+# Compiled registry, built once at import so the app only has to pass integer ids around.
+# Each distinct (sentence, concepts) entry gets an id in order of first appearance in PHASES,
+# so ids stay the same as long as entries are only appended.
+
+CONCEPTS: list[str] = PRONOUN + TENSE + MODALITY + ASPECT
+
+# concept -> bit in Stimulus.concept_mask
+CONCEPT_BITS: dict[str, int] = {concept: 1 << i for i, concept in enumerate(CONCEPTS)}
+
+
+class Stimulus(NamedTuple):
+    id: int
+    sentence: str
+    concepts: tuple[str, ...]
+    concept_mask: int
+
+
+def concept_mask(concepts) -> int:
+    mask = 0
+    for concept in concepts:
+        mask |= CONCEPT_BITS[concept]
+    return mask
+
+
+def concepts_from_mask(mask: int) -> list[str]:
+    return [concept for concept in CONCEPTS if mask & CONCEPT_BITS[concept]]
+
+
+def _compile(phases) -> tuple[tuple[Stimulus, ...], tuple[tuple[int, ...], ...]]:
+    stimuli: list[Stimulus] = []
+    ids: dict[tuple[str, tuple[str, ...]], int] = {}
+    phase_ids = []
+    for phase in phases:
+        current = []
+        for sentence, concepts in phase:
+            key = (sentence, tuple(concepts))
+            if key not in ids:
+                ids[key] = len(stimuli)
+                stimuli.append(Stimulus(len(stimuli), sentence, key[1], concept_mask(concepts)))
+            current.append(ids[key])
+        phase_ids.append(tuple(current))
+    return tuple(stimuli), tuple(phase_ids)
+
+
+# all stimuli, indexed by id
+STIMULI, PHASE_STIM_IDS = _compile(PHASES)
+
+# id -> sentence of the stimuli of each phase, sent to the client once per page
+PHASE_SENTENCES: tuple[dict[int, str], ...] = tuple(
+    {stim_id: STIMULI[stim_id].sentence for stim_id in ids} for ids in PHASE_STIM_IDS
+)
@@ -0,0 +1,50 @@
+"""Helpers for the incremental stroke log that live drawings are sent as.
+
+The drawer sends one operation per finished stroke, undo or clear,
+and the server only turns the log back into a full SVG when it is needed.
+"""
+
+# matches the <svg> element in template/canvas.html, so rebuilt drawings
+# look exactly like the ones exported by the browser
+SVG_OPEN = '<svg xmlns="http://www.w3.org/2000/svg" class="svgElement" x="0px" y="0px" viewBox="0 0 800 600">'
+SVG_CLOSE = '</svg>'
+
+OP_ADD = "add"
+OP_UNDO = "undo"
+OP_CLEAR = "clear"
+
+OPS = (OP_ADD, OP_UNDO, OP_CLEAR)
+
+
+def is_valid_op(op: dict) -> bool:
+    """Checks a single operation received from the client"""
+    if not isinstance(op, dict) or op.get("op") not in OPS:
+        return False
+    if op["op"] == OP_ADD:
+        # either the <path> element or its points encoded with StrokeCodec
+        path = op.get("path")
+        if path is not None:
+            return isinstance(path, str) and path.startswith("<path")
+        return isinstance(op.get("points"), str)
+    return True
+
+
+def replay(ops) -> list[str]:
+    """Replays (op, path) pairs and returns the paths that are still visible"""
+    paths: list[str] = []
+    for op, path in ops:
+        if op == OP_ADD:
+            paths.append(path)
+        elif op == OP_UNDO:
+            if paths:
+                paths.pop()
+        elif op == OP_CLEAR:
+            paths = []
+    return paths
+
+
+def build_svg(paths) -> str:
+    """Wraps a list of <path> elements in the canvas <svg> element"""
+    if not paths:
+        return ""
+    return SVG_OPEN + "".join(paths) + SVG_CLOSE
@@ -0,0 +1,181 @@
+"""Compact timeline of how a drawing was made, for replaying it afterwards.
+
+The finished SVG only shows the result. The timeline keeps every operation of
+the stroke log (strokes, undos and clears) in order, with the time of each
+point of a stroke in milliseconds from the start of the drawing timer
+(``start_timestamp`` of the drawing). The times are measured by the drawer's
+browser and sent with the strokes, see queueStrokeOperation in
+template/canvas.html, so they don't depend on when the server got them.
+
+A timeline is made once, when the drawing is completed, and kept as packed
+varints like the drawings in codec.py, a few bytes per point::
+
+    b"PT1"
+    varint scale
+    varint number of events
+    for each event:
+        byte op (0 add, 1 undo, 2 clear)
+        zigzag varint time (ms) minus the time of the previous event
+        for add: varint number of points, the points, then for every point
+        after the first a varint of ms since the previous point
+
+The time of a stroke is the time of its first point.
+
+Example, from ``otree shell``::
+
+    from pictionary import PictionaryDrawing, get_drawing_timeline
+    from pictionary.timeline import drawing_at, sample_timeline
+    data = get_drawing_timeline(PictionaryDrawing.filter(completed=True)[0])
+    halfway = drawing_at(data, 30000)
+    frames = list(sample_timeline(data, range(0, 60000, 1000)))
+"""
+import base64
+from typing import Iterable, Iterator, NamedTuple
+
+from .codec import DEFAULT_SCALE, _read_points, _read_varint, _unzigzag, _write_points, _write_varint, _zigzag
+from .strokes import OP_ADD, OP_CLEAR, OP_UNDO
+
+MAGIC = b"PT1"
+
+# the op byte of each event
+OP_CODES = {OP_ADD: 0, OP_UNDO: 1, OP_CLEAR: 2}
+OP_NAMES = {code: op for op, code in OP_CODES.items()}
+
+
+class TimelineEvent(NamedTuple):
+    op: str
+    # ms from the start of the timer, for a stroke the time of its first point
+    t: int
+    points: list
+    # ms from the start of the timer of each point
+    times: list
+
+
+# times of the points of a stroke, as sent by the client
+
+def encode_times(times: Iterable[int]) -> str:
+    """Base64 of the ms between the points of a stroke, the same as StrokeCodec.encodeTimes in static/drawer.js"""
+    out = bytearray()
+    prev = None
+    for t in times:
+        _write_varint(out, _zigzag(t - prev if prev is not None else 0))
+        prev = t
+    return base64.b64encode(out).decode("ascii")
+
+
+def decode_times(encoded: str, t: int) -> list[int]:
+    """Times of the points of a stroke that started at t, raises ValueError if they can't be read"""
+    try:
+        data = base64.b64decode(encoded)
+        times = []
+        pos = 0
+        while pos < len(data):
+            delta, pos = _read_varint(data, pos)
+            t += _unzigzag(delta)
+            times.append(t)
+    except (IndexError, ValueError) as e:
+        raise ValueError(f"Invalid stroke times: {e}") from e
+    return times
+
+
+# timelines
+
+def encode_timeline(events: Iterable[TimelineEvent], scale: int = DEFAULT_SCALE) -> bytes:
+    """Packs the events, the times of a stroke must be as many as its points (or none)"""
+    events = list(events)
+    out = bytearray(MAGIC)
+    _write_varint(out, scale)
+    _write_varint(out, len(events))
+    prev_t = 0
+    for event in events:
+        out.append(OP_CODES[event.op])
+        _write_varint(out, _zigzag(event.t - prev_t))
+        prev_t = event.t
+        if event.op == OP_ADD:
+            _write_varint(out, len(event.points))
+            _write_points(out, event.points, scale)
+            # without times the whole stroke appears at once
+            times = event.times if len(event.times) == len(event.points) else [event.t] * len(event.points)
+            prev = event.t
+            for time in times[1:]:
+                # the browser never goes back in time within a stroke
+                _write_varint(out, max(time - prev, 0))
+                prev = max(time, prev)
+    return bytes(out)
+
+
+def iter_timeline(data: bytes) -> Iterator[TimelineEvent]:
+    """Yields the events of a packed timeline one at a time"""
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a drawing timeline")
+    pos = len(MAGIC)
+    scale, pos = _read_varint(data, pos)
+    count, pos = _read_varint(data, pos)
+    t = 0
+    for _ in range(count):
+        op = OP_NAMES[data[pos]]
+        delta, pos = _read_varint(data, pos + 1)
+        t += _unzigzag(delta)
+        points: list = []
+        times: list = []
+        if op == OP_ADD:
+            num_points, pos = _read_varint(data, pos)
+            points, pos = _read_points(data, pos, num_points, scale)
+            point_t = t
+            times = [t] if points else []
+            for _ in range(num_points - 1):
+                delta, pos = _read_varint(data, pos)
+                point_t += delta
+                times.append(point_t)
+        yield TimelineEvent(op, t, points, times)
+
+
+def timeline_duration(data: bytes) -> int:
+    """ms from the start of the timer to the end of the last event"""
+    end = 0
+    for event in iter_timeline(data):
+        end = max(end, event.times[-1] if event.times else event.t)
+    return end
+
+
+def sample_timeline(data: bytes, offsets: Iterable[int]) -> Iterator[tuple[int, list]]:
+    """Yields (offset, strokes) with the strokes visible at each of the ascending offsets (ms).
+
+    A stroke that is still being drawn at an offset only has its points up to
+    then. The timeline is read once for all the offsets.
+    """
+    events = iter_timeline(data)
+    strokes: list = []
+    # the next event, read but not shown at the last offset (or shown in part)
+    current = None
+    partial = False
+    for offset in offsets:
+        if partial:
+            strokes.pop()
+            partial = False
+        while True:
+            if current is None:
+                current = next(events, None)
+                if current is None:
+                    break
+            if current.t > offset:
+                break
+            if current.op == OP_UNDO:
+                if strokes:
+                    strokes.pop()
+            elif current.op == OP_CLEAR:
+                strokes = []
+            elif current.times and current.times[-1] > offset:
+                # drawn up to the offset, the rest comes at a later offset
+                strokes.append([pt for pt, t in zip(current.points, current.times) if t <= offset])
+                partial = True
+                break
+            else:
+                strokes.append(current.points)
+            current = None
+        yield offset, list(strokes)
+
+
+def drawing_at(data: bytes, offset: int) -> list:
+    """The strokes (lists of points) that were visible offset ms after the start of the timer"""
+    return next(sample_timeline(data, [offset]))[1]
@@ -0,0 +1,334 @@
+"""Write-behind buffer for the state of trials in progress.
+
+While a drawing is made, the live messages change the drawing (its SVG or
+stroke log and the timer fields) and the selected response over and over.
+Instead of writing every change to the database, the changes are kept in
+memory and appended to a journal file. They are written to
+PictionaryDrawing, PictionaryResponse and PictionaryStroke when the drawing
+or the response is completed, when the group continues to the next trial, and
+at a checkpoint every CHECKPOINT_INTERVAL seconds.
+
+When a trial is loaded the buffered values are put on its drawing and
+response as if they came from the database, so the live method reads them as
+usual without them being written back. After a crash the journal is replayed
+when the server starts again and its changes are written at the first
+checkpoint.
+
+The journal is a folder of JSON lines files, set with the PICTIONARY_JOURNAL
+environment variable. A new file is started at every checkpoint, and a file
+is deleted at the checkpoint after the one that wrote its changes, by when
+those have been committed. Like the other caches of the live method this
+assumes a single server process.
+
+The ids in the journal are only meaningful for the database it was written
+for, and a new database (e.g. after ``otree resetdb``) reuses them. So the
+first line of every file has the token of the database (see
+get_database_token in __init__.py) and every entry has the ids of its trial,
+drawing and response. Files of another database are renamed to
+``*.discarded`` instead of being replayed, and entries whose ids don't belong
+together in this database are dropped.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from otree.database import db  # type: ignore
+from sqlalchemy.orm import joinedload  # type: ignore
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value  # type: ignore
+
+from .instrumentation import metrics
+
+logger = logging.getLogger("pictionary.write_behind")
+
+JOURNAL_DIR = os.environ.get("PICTIONARY_JOURNAL", "journal")
+
+# seconds between checkpoints, a checkpoint is made by the first live message after that
+CHECKPOINT_INTERVAL = 30.0
+
+
+class TrialState:
+    """The changes to the drawing and response of a trial that aren't in the database yet"""
+
+    def __init__(self, trial_id: int, drawing_id: int, response_id: int):
+        self.trial_id = trial_id
+        self.drawing_id = drawing_id
+        self.response_id = response_id
+        self.drawing: dict = {}
+        self.response: dict = {}
+        self.strokes: list[dict] = []
+        # last_seq of the drawing in the database, the stroke operations up to it are stored
+        self.stored_seq: int | None = None
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.drawing or self.response or self.strokes)
+
+    def pending_strokes(self) -> list[dict]:
+        if self.stored_seq is None:
+            return list(self.strokes)
+        # replayed from the journal, but already written before the crash
+        return [row for row in self.strokes if row["seq"] > self.stored_seq]
+
+
+class WriteBehind:
+    def __init__(self, directory: str | Path, checkpoint_interval: float = CHECKPOINT_INTERVAL):
+        self.directory = Path(directory)
+        self.checkpoint_interval = checkpoint_interval
+        # drawing id -> buffered changes of its trial
+        self.states: dict[int, TrialState] = {}
+        self._journal = None
+        # token of the database the journal is written for
+        self.database: str | None = None
+        self._segment = 0
+        # journal files before this one can be deleted at the next checkpoint
+        self._delete_before = 0
+        self._last_checkpoint = 0.0
+
+    # journal
+
+    def _path(self, segment: int) -> Path:
+        return self.directory / f"journal-{segment:06d}.jsonl"
+
+    def _segments(self) -> list[int]:
+        return sorted(int(path.stem.split("-")[1]) for path in self.directory.glob("journal-*.jsonl"))
+
+    def _open(self):
+        """Opens the journal on first use, replaying what an earlier process left in it"""
+        from . import get_database_token
+
+        if self._journal is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.database = get_database_token()
+        segments = self._segments()
+        for segment in segments:
+            self._replay(self._path(segment))
+        self._drop_foreign_trials()
+        self._segment = segments[-1] + 1 if segments else 1
+        self._start_segment()
+        if self.states:
+            logger.info("replayed changes to %s trials from the journal", len(self.states))
+            metrics.incr("journal_recovered_trials", len(self.states))
+            # write them at the first opportunity
+            self._last_checkpoint = float("-inf")
+        else:
+            self._last_checkpoint = time.monotonic()
+
+    def _start_segment(self):
+        self._journal = open(self._path(self._segment), "a", encoding="utf-8")
+        self._write(dict(database=self.database))
+
+    def _write(self, entry: dict):
+        # flushed to the OS before the live method returns, so a crash of the server doesn't lose it
+        self._journal.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self._journal.flush()
+
+    def _replay(self, path: Path):
+        with open(path, encoding="utf-8") as f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = None
+            if not isinstance(header, dict) or header.get("database") != self.database:
+                logger.warning("discarding %s, it was written for another database", path)
+                metrics.incr("journal_discarded_segments")
+                f.close()
+                path.rename(path.with_suffix(".discarded"))
+                return
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line can be cut off by the crash
+                    logger.warning("skipping incomplete journal entry in %s", path)
+                    continue
+                self._apply(entry)
+
+    def _drop_foreign_trials(self):
+        """Drops replayed changes whose trial, drawing and response don't belong together in this database"""
+        from . import PictionaryTrial
+
+        if not self.states:
+            return
+        trial_ids = {state.trial_id for state in self.states.values()}
+        trials = {
+            trial_id: (drawing_id, response_id)
+            for trial_id, drawing_id, response_id in db.query(
+                PictionaryTrial.id, PictionaryTrial.drawing_id, PictionaryTrial.response_id
+            ).filter(PictionaryTrial.id.in_(trial_ids))
+        }
+        for drawing_id, state in list(self.states.items()):
+            if trials.get(state.trial_id) != (state.drawing_id, state.response_id):
+                logger.warning("discarding journal entries of trial %s, it isn't in this database", state.trial_id)
+                metrics.incr("journal_discarded_trials")
+                del self.states[drawing_id]
+
+    def _apply(self, entry: dict) -> TrialState:
+        state = self.states.get(entry["drawing_id"])
+        if state is None:
+            state = self.states[entry["drawing_id"]] = TrialState(
+                entry["trial_id"], entry["drawing_id"], entry["response_id"]
+            )
+        state.drawing.update(entry.get("drawing", {}))
+        state.response.update(entry.get("response", {}))
+        state.strokes.extend(entry.get("strokes", []))
+        return state
+
+    def _rotate(self):
+        # the changes in these files were written at the previous checkpoint, which has been committed
+        for segment in self._segments():
+            if segment < self._delete_before:
+                self._path(segment).unlink(missing_ok=True)
+        self._journal.close()
+        self._delete_before = self._segment + 1
+        self._segment += 1
+        self._start_segment()
+
+    def _record(self, trial, **changes):
+        self._open()
+        state = self.states.get(trial.drawing_id)
+        if state is not None:
+            self._track(state, trial)
+        entry = dict(trial_id=trial.id, drawing_id=trial.drawing_id, response_id=trial.response_id, **changes)
+        self._write(entry)
+        state = self._apply(entry)
+        self._track(state, trial)
+        self._show(trial, state)
+
+    # trials
+
+    @staticmethod
+    def _track(state: TrialState, trial):
+        """Remembers what is stored of the stroke log, before any buffered value is put on the drawing"""
+        if state.stored_seq is None:
+            state.stored_seq = trial.drawing.last_seq
+
+    @staticmethod
+    def _show(trial, state: TrialState):
+        # set_committed_value changes the loaded values without marking them as changed
+        if not trial.drawing.completed:
+            for key, value in state.drawing.items():
+                set_committed_value(trial.drawing, key, value)
+        if not trial.response.completed:
+            for key, value in state.response.items():
+                set_committed_value(trial.response, key, value)
+
+    def load(self, trial):
+        """Puts the buffered changes on a trial that was just loaded from the database"""
+        self._open()
+        state = self.states.get(trial.drawing_id)
+        if state is not None:
+            self._track(state, trial)
+            self._show(trial, state)
+
+    def update_drawing(self, trial, **fields):
+        self._record(trial, drawing=fields)
+
+    def update_response(self, trial, **fields):
+        self._record(trial, response=fields)
+
+    def add_strokes(self, trial, rows: list[dict], last_seq: int):
+        """Buffers PictionaryStroke rows, last_seq is the new last_seq of the drawing"""
+        self._record(trial, drawing=dict(last_seq=last_seq), strokes=rows)
+
+    def pending_strokes(self, drawing_id: int) -> list[dict]:
+        """The stroke log rows of the drawing that haven't been written yet"""
+        state = self.states.get(drawing_id)
+        return state.pending_strokes() if state is not None else []
+
+    def flush(self, trial):
+        """Writes the buffered changes of the trial, they are committed with the live message"""
+        state = self.states.get(trial.drawing_id)
+        if state is None or not state.dirty:
+            return
+        self._store(state, trial)
+        if not trial.drawing.completed:
+            state.stored_seq = trial.drawing.last_seq
+        state.drawing.clear()
+        state.response.clear()
+        state.strokes.clear()
+        metrics.incr("write_behind_flushes")
+
+    def discard(self, trial):
+        self.states.pop(trial.drawing_id, None)
+
+    def _store(self, state: TrialState, trial):
+        """Puts the buffered changes in the database session, the state is left as it is"""
+        from . import PictionaryStroke
+
+        self._track(state, trial)
+        # changes replayed after a crash can be older than what was completed since
+        if not trial.drawing.completed:
+            for key, value in state.drawing.items():
+                setattr(trial.drawing, key, value)
+                # the value may already be shown on the drawing, which SQLAlchemy wouldn't see as a change
+                flag_modified(trial.drawing, key)
+            rows = state.pending_strokes()
+            if rows:
+                db._db.bulk_insert_mappings(PictionaryStroke, rows)
+        if not trial.response.completed:
+            for key, value in state.response.items():
+                setattr(trial.response, key, value)
+                flag_modified(trial.response, key)
+
+    # checkpoints
+
+    def checkpoint(self):
+        """Writes and commits the changes of every trial and starts a new journal file.
+
+        The changes are committed here, not with the live message that made
+        the checkpoint, so a message that fails afterwards can't roll them
+        back. If the commit fails the changes stay buffered, and their journal
+        files are kept, for the next checkpoint.
+        """
+        from . import PictionaryTrial
+
+        self._open()
+        dirty = [state.drawing_id for state in self.states.values() if state.dirty]
+        if dirty:
+            trials = (
+                PictionaryTrial.objects_filter(PictionaryTrial.drawing_id.in_(dirty))
+                .options(joinedload(PictionaryTrial.drawing), joinedload(PictionaryTrial.response))
+                .all()
+            )
+            for trial in trials:
+                self._store(self.states[trial.drawing_id], trial)
+                metrics.incr("write_behind_flushes")
+            try:
+                db.commit()
+            except Exception:
+                logger.exception("checkpoint of %s trials failed, trying again later", len(trials))
+                metrics.incr("write_behind_checkpoint_errors")
+                self._last_checkpoint = time.monotonic()
+                return
+        # nothing is left to write, the states are made again when the trials change
+        self.states.clear()
+        self._rotate()
+        self._last_checkpoint = time.monotonic()
+        metrics.incr("write_behind_checkpoints")
+
+    def maybe_checkpoint(self) -> bool:
+        """Makes a checkpoint if it is time, it commits so it runs before the live message changes anything"""
+        self._open()
+        if time.monotonic() - self._last_checkpoint < self.checkpoint_interval:
+            return False
+        self.checkpoint()
+        return True
+
+
+_write_behind: WriteBehind | None = None
+
+
+def get_write_behind() -> WriteBehind:
+    global _write_behind
+    if _write_behind is None:
+        _write_behind = WriteBehind(JOURNAL_DIR)
+    return _write_behind
+
+
+def set_write_behind(write_behind: WriteBehind):
+    """Replaces the default buffer, e.g. with one that has its journal elsewhere"""
+    global _write_behind
+    _write_behind = write_behind
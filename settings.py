@@ -8,7 +8,11 @@ SESSION_CONFIGS = [
         ],
         num_demo_participants=4,
         live_draw=False,
+        live_draw_interval=500,
+        simplify_tolerance=1.0,
+        spectate=False,
         blur=False,
+        match_by_arrival=False,
     ),
 ]
 
@@ -0,0 +1,128 @@
+"""Runs oTree in-process with an in-memory database, the same way benchmarks/harness.py does.
+
+Run from the project folder::
+
+    python -m pytest tests
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# the app can only be imported once oTree is set up from the project folder
+os.chdir(PROJECT_DIR)
+sys.path.insert(0, str(PROJECT_DIR))
+os.environ["OTREE_IN_MEMORY"] = "1"
+from otree.main import setup  # type: ignore  # noqa: E402
+
+setup()
+
+
+@pytest.fixture
+def db():
+    """A database session, committed at the end of the test"""
+    from otree.database import db, session_scope  # type: ignore
+
+    with session_scope():
+        yield db
+
+
+@pytest.fixture
+def write_behind(tmp_path):
+    """A write-behind buffer with its journal in a temporary folder"""
+    from pictionary.write_behind import WriteBehind, get_write_behind, set_write_behind
+
+    previous = get_write_behind()
+    buffer = WriteBehind(tmp_path / "journal")
+    set_write_behind(buffer)
+    yield buffer
+    set_write_behind(previous)
+
+
+@pytest.fixture
+def drawing_store(tmp_path):
+    from pictionary.drawing_store import FileSystemDrawingStore, get_drawing_store, set_drawing_store
+
+    previous = get_drawing_store()
+    store = FileSystemDrawingStore(tmp_path / "drawings")
+    set_drawing_store(store)
+    yield store
+    set_drawing_store(previous)
+
+
+@pytest.fixture
+def make_session(db, write_behind, drawing_store):
+    """Creates sessions with the given config, returns the session"""
+    import otree.session  # type: ignore
+
+    def make(num_participants: int = 2, **config):
+        session = otree.session.create_session(
+            session_config_name="pictionary",
+            num_participants=num_participants,
+            modified_session_config_fields=config,
+        )
+        db.commit()
+        return session
+
+    return make
+
+
+class Group:
+    """The two players of a group, sends them live messages the way the server does"""
+
+    def __init__(self, db, players):
+        self.db = db
+        self.player_ids = [player.id for player in players]
+        self.drawer = self.responder = None
+
+    def player(self, player_id: int):
+        from pictionary import Player
+
+        return Player.objects_get(id=player_id)
+
+    def send(self, player_id: int, data: dict) -> dict:
+        """Calls the live method with a fresh database session, like a request does"""
+        from pictionary import Drawing
+
+        self.db.commit()
+        self.db.new_session()
+        try:
+            response = Drawing.live_method(self.player(player_id), data)
+        except Exception:
+            # oTree rolls back the changes of a message that fails
+            self.db.rollback()
+            raise
+        self.db.commit()
+        return response or {}
+
+    def init(self):
+        """Sends init for both players, after this drawer and responder are set"""
+        first, second = self.player_ids
+        response = self.send(first, {"event": "init"})
+        is_drawer = next(iter(response.values()))["drawer"]
+        self.drawer, self.responder = (first, second) if is_drawer else (second, first)
+        self.send(second, {"event": "init"})
+
+    def trial(self):
+        from pictionary import TrialContext
+
+        return TrialContext(self.player(self.drawer)).trial
+
+
+@pytest.fixture
+def session_config():
+    """Config fields of the session of the group fixture, a test module can override this"""
+    return {}
+
+
+@pytest.fixture
+def group(db, make_session, session_config):
+    """The first group of a new session with two participants"""
+    from pictionary import Player
+
+    session = make_session(2, **session_config)
+    players = sorted(Player.objects_filter(session=session, round_number=1), key=lambda player: player.id_in_subsession)
+    return Group(db, players)
@@ -0,0 +1,87 @@
+import pytest
+
+from pictionary.codec import (
+    DEFAULT_ATTRIBUTES,
+    decode_drawing,
+    decode_points,
+    decode_svg,
+    encode_drawing,
+    encode_points,
+    encode_svg,
+    format_path_data,
+    parse_path_data,
+    path_element,
+)
+from pictionary.strokes import build_svg
+from pictionary.timeline import decode_times, encode_times
+
+
+def test_points_round_trip():
+    points = [(10.5, 20.1), (11.0, 20.3), (300.2, 0.0)]
+    assert decode_points(encode_points(points)) == points
+
+
+def test_points_negative_deltas():
+    # strokes going left and up, and points outside of the canvas
+    points = [(400.0, 300.0), (12.3, 4.5), (-5.0, -0.1), (-250.7, 17.0)]
+    assert decode_points(encode_points(points)) == points
+
+
+def test_points_are_quantized():
+    assert decode_points(encode_points([(1.04, 2.06)])) == [(1.0, 2.1)]
+    assert decode_points(encode_points([(1.04, 2.06)], scale=100), scale=100) == [(1.04, 2.06)]
+
+
+def test_empty_stroke():
+    assert encode_points([]) == b""
+    assert decode_points(b"") == []
+
+
+def test_drawing_round_trip():
+    strokes = [[(1.0, 2.0), (3.5, -4.0)], [], [(0.0, 0.0)], [(-1.0, -1.0), (-2.0, -3.0), (5.0, 1.0)]]
+    attributes, decoded, scale = decode_drawing(encode_drawing(strokes))
+    assert attributes == DEFAULT_ATTRIBUTES
+    assert decoded == strokes
+    assert scale == 10
+
+
+def test_empty_drawing():
+    assert decode_drawing(encode_drawing([], {})) == ({}, [], 10)
+
+
+def test_not_a_drawing():
+    with pytest.raises(ValueError):
+        decode_drawing(b"<svg></svg>")
+
+
+def test_path_data_round_trip():
+    points = [(10.2, 3.0), (-4.5, 0.1)]
+    d = format_path_data(points)
+    assert d == "M10.2 3 L-4.5 0.1"
+    assert parse_path_data(d) == points
+
+
+def test_path_data_relative_commands():
+    with pytest.raises(ValueError):
+        parse_path_data("m1 2 l3 4")
+
+
+def test_svg_round_trip():
+    svg = build_svg([
+        path_element([(10.0, 10.0), (20.5, 5.0), (15.0, -2.0)]),
+        path_element([(100.0, 100.0)]),
+        path_element([]),
+    ])
+    assert decode_svg(encode_svg(svg)) == svg
+
+
+def test_empty_svg():
+    svg = build_svg([])
+    assert decode_svg(encode_svg(svg)) == svg
+
+
+def test_times_round_trip():
+    # the browser's clock can go back a little between the points of a stroke
+    times = [100, 116, 133, 130, 500]
+    assert decode_times(encode_times(times), 100) == times
+    assert decode_times(encode_times([]), 0) == []
@@ -0,0 +1,71 @@
+import base64
+
+from pictionary import (
+    PictionaryDrawingFeatures,
+    compute_drawing_features,
+    get_drawing_svg,
+    path_element,
+    simplify_stored_drawings,
+)
+
+# a straight line with many points, simplifying keeps only its ends
+LINE = path_element([(float(x), 10.0) for x in range(0, 101, 5)])
+
+
+def test_simplifying_updates_the_features(group):
+    group.init()
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg">{LINE}</svg>'
+    group.send(group.drawer, {"event": "drawing_complete", "drawing": base64.b64encode(svg.encode()).decode()})
+    drawing = group.trial().drawing
+    [features] = PictionaryDrawingFeatures.filter(drawing=drawing)
+    assert features.point_count == 21
+
+    simplify_stored_drawings(after_id=drawing.id - 1)
+    group.db.commit()
+
+    assert get_drawing_svg(drawing).count("L") == 1
+    [features] = PictionaryDrawingFeatures.filter(drawing=drawing)
+    assert (features.stroke_count, features.point_count) == (1, 2)
+    assert features.ink_length == 100.0
+    assert (features.min_x, features.max_x) == (0.0, 100.0)
+
+
+def test_features_from_the_stroke_log(group):
+    group.init()
+    ops = [
+        {"op": "add", "path": LINE, "t": 2500},
+        {"op": "undo", "t": 3000},
+        {"op": "add", "path": LINE, "t": 3500},
+    ]
+    group.send(group.drawer, {"event": "strokes", "seq": 1, "ops": ops})
+    group.send(group.drawer, {"event": "drawing_complete", "seq": 3})
+    [features] = PictionaryDrawingFeatures.filter(drawing=group.trial().drawing)
+    assert (features.undo_count, features.clear_count) == (1, 0)
+    # the drawer's time, not when the server got the message
+    assert features.first_stroke_time == 2.5
+    # the same from the stored stroke log, e.g. for backfill_drawing_features
+    drawing = group.trial().drawing
+    recomputed = compute_drawing_features(drawing, get_drawing_svg(drawing))
+    assert (recomputed["undo_count"], recomputed["first_stroke_time"]) == (1, 2.5)
+
+
+def test_features_from_the_operations_sent_with_the_drawing(group):
+    group.init()
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg">{LINE}</svg>'
+    ops = [
+        {"op": "add", "path": LINE, "t": 1200},
+        {"op": "clear", "t": 1500},
+        {"op": "add", "path": LINE, "t": 2000},
+    ]
+    group.send(group.drawer, {"event": "drawing_complete", "drawing": base64.b64encode(svg.encode()).decode(), "ops": ops})
+    [features] = PictionaryDrawingFeatures.filter(drawing=group.trial().drawing)
+    assert (features.undo_count, features.clear_count, features.first_stroke_time) == (0, 1, 1.2)
+
+
+def test_no_stroke_log_features_without_operations(group):
+    group.init()
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg">{LINE}</svg>'
+    group.send(group.drawer, {"event": "drawing_complete", "drawing": base64.b64encode(svg.encode()).decode()})
+    [features] = PictionaryDrawingFeatures.filter(drawing=group.trial().drawing)
+    assert features.point_count == 21
+    assert (features.undo_count, features.clear_count, features.first_stroke_time) == (None, None, None)
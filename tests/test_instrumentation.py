@@ -0,0 +1,26 @@
+from pictionary import instrumentation
+from pictionary.instrumentation import Metrics, instrument_live_method, payload_size
+
+
+def test_payload_sizes_are_sampled(monkeypatch):
+    monkeypatch.setattr(instrumentation, "metrics", Metrics())
+    monkeypatch.setattr(instrumentation, "SIZE_SAMPLE_EVERY", 10)
+    measured = []
+    real_payload_size = instrumentation.payload_size
+    monkeypatch.setattr(instrumentation, "payload_size", lambda data: measured.append(data) or real_payload_size(data))
+
+    class Player:
+        group_id = 1
+        id_in_group = 1
+
+    live_method = instrument_live_method(lambda player, data: {1: dict(event="ok")})
+    for _ in range(25):
+        live_method(Player(), {"event": "strokes"})
+
+    stats = instrumentation.metrics.event("strokes").as_dict()
+    assert stats["count"] == 25
+    # the 1st, 11th and 21st messages, the request and the response of each
+    assert stats["size_samples"] == 3
+    assert len(measured) == 6
+    assert stats["bytes_in"] == 25 * payload_size({"event": "strokes"})
+    assert stats["bytes_out"] == 25 * payload_size({1: dict(event="ok")})
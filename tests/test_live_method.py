@@ -0,0 +1,110 @@
+import base64
+
+from pictionary import (
+    C,
+    TRIAL_ABANDONED,
+    TRIAL_RESPONDING,
+    get_drawing_svg,
+    get_drawing_timeline,
+    get_write_behind,
+    has_partner,
+    is_phase_complete,
+    path_element,
+)
+
+PATH = path_element([(1.5, 2.0), (3.0, 4.0), (10.3, 7.0)])
+
+
+def expire_drawing(group):
+    # the timer is buffered like the other changes of the trial
+    get_write_behind().update_drawing(group.trial(), deadline=1.0)
+
+
+def test_late_drawing_complete_keeps_drawing(group):
+    group.init()
+    expire_drawing(group)
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg">{PATH}</svg>'
+    response = group.send(group.drawer, {
+        "event": "drawing_complete",
+        "drawing": base64.b64encode(svg.encode()).decode(),
+        "ops": [{"op": "add", "path": PATH, "t": 500}],
+        "timeout": True,
+    })
+    assert response[group.player(group.responder).id_in_group]["timed_out"]
+    trial = group.trial()
+    assert trial.drawing.completed
+    assert PATH in get_drawing_svg(trial.drawing)
+    assert trial.drawing.svg_size > 0
+    assert get_drawing_timeline(trial.drawing) is not None
+    assert group.player(group.drawer).group.trial_state == TRIAL_RESPONDING
+
+
+def test_late_strokes_are_kept(group):
+    group.init()
+    group.send(group.drawer, {"event": "strokes", "seq": 1, "ops": [{"op": "add", "path": PATH}]})
+    expire_drawing(group)
+    second = path_element([(5.0, 5.0), (6.0, 6.0)])
+    group.send(group.drawer, {"event": "strokes", "seq": 2, "ops": [{"op": "add", "path": second}]})
+    svg = get_drawing_svg(group.trial().drawing)
+    assert PATH in svg and second in svg
+
+
+def test_responder_takes_over_expired_drawing(group):
+    group.init()
+    group.send(group.drawer, {"event": "strokes", "seq": 1, "ops": [{"op": "add", "path": PATH}]})
+    expire_drawing(group)
+    response = group.send(group.responder, {"event": "timeout"})
+    assert all(message["timed_out"] for message in response.values())
+    assert PATH in get_drawing_svg(group.trial().drawing)
+
+
+def complete_drawing(group):
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg">{PATH}</svg>'
+    group.send(group.drawer, {"event": "drawing_complete", "drawing": base64.b64encode(svg.encode()).decode()})
+
+
+def wait_for_partner(group):
+    """Moves the last transition of the group back beyond the partner timeout"""
+    group_model = group.player(group.drawer).group
+    group_model.state_since -= C.PARTNER_TIMEOUT + 1
+    group.db.commit()
+
+
+def assert_phase_ended(group, response, player_id):
+    assert response == {group.player(player_id).id_in_group: dict(event="continue", phase_complete=True)}
+    player = group.player(player_id)
+    assert player.group.trial_state == TRIAL_ABANDONED
+    assert is_phase_complete(player)
+    assert not has_partner(player)
+
+
+def test_partner_leaves_while_responding(group):
+    group.init()
+    complete_drawing(group)
+    # the responder is still there
+    assert group.send(group.drawer, {"event": "partner_check"}) == {}
+    wait_for_partner(group)
+    assert_phase_ended(group, group.send(group.drawer, {"event": "partner_check"}), group.drawer)
+    # the responder comes back to a finished phase
+    response = group.send(group.responder, {"event": "init"})
+    assert next(iter(response.values())) == dict(event="continue", phase_complete=True)
+    assert not has_partner(group.player(group.responder))
+
+
+def test_partner_leaves_during_review(group):
+    group.init()
+    complete_drawing(group)
+    group.send(group.responder, {"event": "response_complete", "response": group.trial().stim_id})
+    response = group.send(group.responder, {"event": "continue"})
+    assert next(iter(response.values()))["event"] == "continue_wait"
+    wait_for_partner(group)
+    assert_phase_ended(group, group.send(group.responder, {"event": "continue"}), group.responder)
+
+
+def test_no_timeout_for_the_player_who_is_waited_for(group):
+    group.init()
+    complete_drawing(group)
+    wait_for_partner(group)
+    # the responder is the one who has to answer, the drawer may just be slow to notice
+    group.send(group.responder, {"event": "stimulus_selected", "stim": group.trial().stim_id})
+    assert group.player(group.responder).group.trial_state == TRIAL_RESPONDING
@@ -0,0 +1,32 @@
+import base64
+
+import numpy as np
+
+from pictionary import get_drawing_svg, path_element, simplify_stored_drawings
+from pictionary.features import strokes_from_svg
+from pictionary.similarity import SimilarityIndex, drawing_vector
+
+# a zigzag that a large tolerance simplifies into a straight line
+ZIGZAG = path_element([(float(x), 10.0 + 30.0 * (x // 10 % 2)) for x in range(0, 101, 10)])
+
+
+def test_refresh_after_simplifying(group, tmp_path):
+    group.init()
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg">{ZIGZAG}</svg>'
+    group.send(group.drawer, {"event": "drawing_complete", "drawing": base64.b64encode(svg.encode()).decode()})
+    drawing = group.trial().drawing
+    index = SimilarityIndex(tmp_path / "similarity")
+    index.update()
+    [row] = index.rows([drawing.id])
+    before = index.vectors[row].copy()
+
+    simplify_stored_drawings(tolerance=50.0, after_id=drawing.id - 1)
+    group.db.commit()
+    simplified = drawing_vector(strokes_from_svg(get_drawing_svg(drawing)))
+    assert not np.allclose(before, simplified)
+    # update only adds drawings that aren't in the index
+    index.update()
+    assert np.array_equal(index.vectors[row], before)
+
+    assert index.refresh([drawing.id, -1]) == 1
+    assert np.allclose(index.vectors[row], simplified)
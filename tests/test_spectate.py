@@ -0,0 +1,57 @@
+import pytest
+
+import pictionary
+
+from pictionary import C, path_element
+
+PATH = path_element([(1.0, 1.0), (2.0, 2.0)])
+
+
+@pytest.fixture
+def session_config():
+    return dict(live_draw=True, spectate=True)
+
+
+def strokes(group, seq, count):
+    response = group.send(group.drawer, {"event": "strokes", "seq": seq, "ops": [{"op": "add", "path": PATH}] * count})
+    return response.get(group.player(group.responder).id_in_group)
+
+
+def ack(group, seq):
+    trial = group.trial().trial
+    response = group.send(group.responder, {"event": "strokes_ack", "trial": trial, "seq": seq})
+    return response.get(group.player(group.responder).id_in_group)
+
+
+def test_large_batch_is_relayed(group):
+    # e.g. the drawer's queue after a reconnect
+    group.init()
+    relay = strokes(group, 1, C.SPECTATE_WINDOW + 5)
+    assert relay["event"] == "strokes"
+    assert len(relay["ops"]) == C.SPECTATE_WINDOW + 5
+
+
+def test_held_back_until_the_responder_catches_up(group):
+    group.init()
+    strokes(group, 1, C.SPECTATE_WINDOW + 1)
+    # too much in flight
+    assert strokes(group, C.SPECTATE_WINDOW + 2, 1) is None
+    assert strokes(group, C.SPECTATE_WINDOW + 3, 1) is None
+    sync = ack(group, C.SPECTATE_WINDOW + 1)
+    assert sync["event"] == "spectate_sync"
+    assert sync["seq"] == C.SPECTATE_WINDOW + 3
+    # relayed one by one again
+    assert strokes(group, C.SPECTATE_WINDOW + 4, 1)["event"] == "strokes"
+
+
+def test_lagging_with_nothing_in_flight_syncs_at_once(group):
+    group.init()
+    strokes(group, 1, 3)
+    ack(group, 3)
+    # e.g. the drawer's strokes came in before the relayed ones, nothing is in flight
+    # so no ack will come that would bring the responder up to date
+    state = pictionary._spectators[group.player(group.drawer).group_id]
+    state.sent_seq = state.acked_seq = 1
+    sync = strokes(group, 4, 2)
+    assert sync["event"] == "spectate_sync"
+    assert sync["seq"] == 5
@@ -0,0 +1,60 @@
+import base64
+
+from pictionary import build_svg, get_drawing_timeline, path_element
+from pictionary.codec import encode_points
+from pictionary.strokes import OP_ADD, OP_CLEAR, OP_UNDO
+from pictionary.timeline import TimelineEvent, drawing_at, encode_times, encode_timeline, iter_timeline
+
+FIRST = [(1.0, 1.0), (2.0, 3.0), (4.0, -1.0)]
+SECOND = [(10.0, 10.0), (5.0, 5.0)]
+
+
+def test_timeline_round_trip():
+    events = [
+        TimelineEvent(OP_ADD, 100, FIRST, [100, 120, 150]),
+        TimelineEvent(OP_UNDO, 900, [], []),
+        TimelineEvent(OP_ADD, 1000, SECOND, [1000, 1016]),
+        TimelineEvent(OP_CLEAR, 2000, [], []),
+    ]
+    assert list(iter_timeline(encode_timeline(events))) == events
+    assert drawing_at(encode_timeline(events), 130) == [FIRST[:2]]
+    assert drawing_at(encode_timeline(events), 1500) == [SECOND]
+
+
+def add_op(points, times):
+    return {
+        "op": "add",
+        "points": base64.b64encode(encode_points(points)).decode(),
+        "t": times[0],
+        "times": encode_times(times),
+    }
+
+
+def test_timeline_without_live_draw(group):
+    group.init()
+    svg = build_svg([path_element(SECOND)])
+    ops = [
+        add_op(FIRST, [100, 120, 150]),
+        {"op": "undo", "t": 900},
+        {"op": "add", "points": "not base64!"},
+        add_op(SECOND, [1000, 1016]),
+    ]
+    group.send(group.drawer, {
+        "event": "drawing_complete",
+        "drawing": base64.b64encode(svg.encode()).decode(),
+        "ops": ops,
+    })
+    events = list(iter_timeline(get_drawing_timeline(group.trial().drawing)))
+    # the invalid operation is left out
+    assert events == [
+        TimelineEvent(OP_ADD, 100, FIRST, [100, 120, 150]),
+        TimelineEvent(OP_UNDO, 900, [], []),
+        TimelineEvent(OP_ADD, 1000, SECOND, [1000, 1016]),
+    ]
+
+
+def test_no_timeline_from_older_clients(group):
+    group.init()
+    svg = build_svg([path_element(SECOND)])
+    group.send(group.drawer, {"event": "drawing_complete", "drawing": base64.b64encode(svg.encode()).decode()})
+    assert get_drawing_timeline(group.trial().drawing) is None
@@ -0,0 +1,159 @@
+import base64
+
+import pictionary
+from pictionary import (
+    C,
+    Group,
+    PictionaryGroupEvent,
+    TRIAL_ABANDONED,
+    TRIAL_DRAWING,
+    TRIAL_RESPONDING,
+    TRIAL_REVIEW,
+    TrialContext,
+    path_element,
+    transition,
+)
+from pictionary.instrumentation import metrics
+
+SVG = f'<svg xmlns="http://www.w3.org/2000/svg">{path_element([(1.0, 1.0), (2.0, 2.0)])}</svg>'
+
+
+def drawing_complete(group):
+    return group.send(group.drawer, {"event": "drawing_complete", "drawing": base64.b64encode(SVG.encode()).decode()})
+
+
+def response_complete(group):
+    return group.send(group.responder, {"event": "response_complete", "response": group.trial().stim_id})
+
+
+def events(group):
+    group_model = group.player(group.drawer).group
+    return [(event.event, event.from_state, event.to_state, event.version) for event in PictionaryGroupEvent.filter(group=group_model)]
+
+
+def state(group):
+    group_model = group.player(group.drawer).group
+    return group_model.trial_state, group_model.current_trial, group_model.acks
+
+
+def test_trial_moves_through_the_states(group):
+    group.init()
+    assert state(group) == (TRIAL_DRAWING, 1, 0)
+    drawing_complete(group)
+    assert state(group) == (TRIAL_RESPONDING, 1, 0)
+    response_complete(group)
+    assert state(group) == (TRIAL_REVIEW, 1, 0)
+    group.send(group.drawer, {"event": "continue"})
+    assert state(group)[0] == TRIAL_REVIEW
+    response = group.send(group.responder, {"event": "continue"})
+    assert response == {0: dict(event="continue", phase_complete=False)}
+    assert state(group) == (TRIAL_DRAWING, 2, 0)
+    assert group.trial().trial == 2
+    assert events(group) == [
+        ("drawing_complete", TRIAL_DRAWING, TRIAL_RESPONDING, 1),
+        ("response_complete", TRIAL_RESPONDING, TRIAL_REVIEW, 2),
+        ("continue", TRIAL_REVIEW, TRIAL_REVIEW, 3),
+        ("advance", TRIAL_REVIEW, TRIAL_DRAWING, 4),
+    ]
+
+
+def test_repeated_messages_are_ignored(group):
+    group.init()
+    drawing_complete(group)
+    assert drawing_complete(group) == {}
+    response_complete(group)
+    assert response_complete(group) == {}
+    group.send(group.drawer, {"event": "continue"})
+    response = group.send(group.drawer, {"event": "continue"})
+    assert next(iter(response.values()))["event"] == "continue_wait"
+    # only the drawer's ack bit
+    assert state(group) == (TRIAL_REVIEW, 1, 1 << (group.player(group.drawer).id_in_group - 1))
+    assert [event[0] for event in events(group)] == ["drawing_complete", "response_complete", "continue"]
+
+
+def test_messages_out_of_order_are_ignored(group):
+    group.init()
+    # nothing to respond to or continue from yet
+    response_complete(group)
+    group.send(group.drawer, {"event": "continue"})
+    assert state(group) == (TRIAL_DRAWING, 1, 0)
+    assert events(group) == []
+
+
+def test_transition_conflict(group):
+    group.init()
+    ctx = TrialContext(group.player(group.drawer))
+    # another message moved the group on after ctx was loaded
+    Group.objects_filter(id=ctx.group.id).update({"state_version": ctx.group.state_version + 1}, synchronize_session=False)
+    conflicts = metrics.counters.get("state_conflicts", 0)
+    assert not transition(ctx, "drawing_complete", TRIAL_DRAWING, TRIAL_RESPONDING)
+    assert metrics.counters["state_conflicts"] == conflicts + 1
+    # the group was reloaded, the next transition uses the new version
+    assert ctx.group.state_version == 1
+    assert transition(ctx, "drawing_complete", TRIAL_DRAWING, TRIAL_RESPONDING)
+    group.db.commit()
+    assert state(group)[0] == TRIAL_RESPONDING
+    assert events(group) == [("drawing_complete", TRIAL_DRAWING, TRIAL_RESPONDING, 2)]
+
+
+def test_transition_from_wrong_state(group):
+    group.init()
+    ctx = TrialContext(group.player(group.drawer))
+    assert not transition(ctx, "response_complete", TRIAL_RESPONDING, TRIAL_REVIEW)
+    assert ctx.group.state_version == 0
+
+
+def find_roles(group):
+    """Sets drawer and responder of the current trial without sending anything"""
+    first, second = group.player_ids
+    is_drawer = TrialContext(group.player(first)).is_drawer
+    group.drawer, group.responder = (first, second) if is_drawer else (second, first)
+
+
+def play_trial(group):
+    group.init()
+    drawing_complete(group)
+    response_complete(group)
+    group.send(group.drawer, {"event": "continue"})
+    group.send(group.responder, {"event": "continue"})
+
+
+def partner_check(group):
+    return group.send(group.responder, {"event": "partner_check"})
+
+
+def assert_abandoned(group, response):
+    assert response == {group.player(group.responder).id_in_group: dict(event="continue", phase_complete=True)}
+    assert state(group)[0] == TRIAL_ABANDONED
+
+
+def test_drawer_never_starts_the_phase(group):
+    find_roles(group)
+    group.send(group.responder, {"event": "init"})
+    assert partner_check(group) == {}
+    # there was no transition in this phase yet, the wait counts from the responder's first message
+    group_id = group.player(group.responder).group_id
+    pictionary._waiting_since[group_id] -= C.PARTNER_TIMEOUT + 1
+    assert_abandoned(group, partner_check(group))
+
+
+def test_drawer_leaves_between_trials(group):
+    play_trial(group)
+    find_roles(group)
+    assert partner_check(group) == {}
+    group_model = group.player(group.responder).group
+    group_model.state_since -= C.PARTNER_TIMEOUT + 1
+    group.db.commit()
+    assert_abandoned(group, partner_check(group))
+
+
+def test_no_partner_timeout_once_the_drawer_started(group):
+    play_trial(group)
+    find_roles(group)
+    group.send(group.drawer, {"event": "init"})
+    group_model = group.player(group.responder).group
+    group_model.state_since -= C.PARTNER_TIMEOUT + 1
+    group.db.commit()
+    # the drawing timer decides from here
+    assert partner_check(group) == {}
+    assert state(group) == (TRIAL_DRAWING, 2, 0)
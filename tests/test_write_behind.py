@@ -0,0 +1,119 @@
+import json
+
+import pytest
+
+from pictionary import PictionaryStroke, get_database_token, path_element
+from pictionary.write_behind import WriteBehind, set_write_behind
+
+PATH = path_element([(1.0, 2.0), (3.0, 4.0)])
+
+
+def restart(group, write_behind):
+    """A new buffer on the journal of the given one, as after a crash of the server"""
+    # the values the old buffer put on the loaded objects are gone with it
+    group.db.rollback()
+    group.db.new_session()
+    restarted = WriteBehind(write_behind.directory)
+    set_write_behind(restarted)
+    return restarted
+
+
+def journal_files(write_behind, pattern="journal-*.jsonl"):
+    return sorted(write_behind.directory.glob(pattern))
+
+
+def test_segments_start_with_the_database(group, write_behind):
+    group.init()
+    first_line = journal_files(write_behind)[0].read_text().splitlines()[0]
+    assert json.loads(first_line) == {"database": get_database_token()}
+
+
+def test_replay_after_crash(group, write_behind):
+    group.init()
+    group.send(group.drawer, {"event": "strokes", "seq": 1, "ops": [{"op": "add", "path": PATH}]})
+    trial = group.trial()
+    # the stroke is only in the journal
+    assert PictionaryStroke.objects_filter(drawing_id=trial.drawing_id).count() == 0
+
+    restarted = restart(group, write_behind)
+    trial = group.trial()
+    assert trial.drawing.last_seq == 1
+    assert trial.drawing.deadline > 0
+    restarted.checkpoint()
+    group.db.commit()
+    assert PictionaryStroke.objects_filter(drawing_id=trial.drawing_id).count() == 1
+
+
+def test_replay_discards_journal_of_another_database(group, write_behind):
+    group.init()
+    group.send(group.drawer, {"event": "strokes", "seq": 1, "ops": [{"op": "add", "path": PATH}]})
+    # the same ids in a journal written before e.g. otree resetdb
+    path = journal_files(write_behind)[0]
+    lines = path.read_text().splitlines()
+    path.write_text("\n".join([json.dumps({"database": "earlier"}), *lines[1:]]) + "\n")
+
+    restarted = restart(group, write_behind)
+    trial = group.trial()
+    assert restarted.states == {}
+    assert trial.drawing.last_seq == 0
+    assert [p.name for p in journal_files(restarted, "*.discarded")] == [path.with_suffix(".discarded").name]
+
+
+def test_replay_discards_journal_without_database(group, write_behind):
+    group.init()
+    path = journal_files(write_behind)[0]
+    # written before the database was recorded in the journal
+    path.write_text("\n".join(path.read_text().splitlines()[1:]) + "\n")
+
+    restarted = restart(group, write_behind)
+    group.trial()
+    assert restarted.states == {}
+    assert journal_files(restarted, "*.discarded")
+
+
+def test_replay_drops_entries_of_other_trials(group, write_behind):
+    group.init()
+    trial = group.trial()
+    write_behind.update_drawing(trial, deadline=123.0)
+    # a trial whose drawing doesn't belong to it in this database
+    entry = dict(trial_id=trial.id, drawing_id=trial.drawing_id + 1000, response_id=trial.response_id, drawing=dict(last_seq=5))
+    with journal_files(write_behind)[-1].open("a") as f:
+        f.write(json.dumps(entry) + "\n")
+    drawing_id = trial.drawing_id
+
+    restarted = restart(group, write_behind)
+    assert group.trial().drawing.deadline == 123.0
+    assert list(restarted.states) == [drawing_id]
+
+
+def test_checkpoint_survives_a_failing_message(group, write_behind):
+    group.init()
+    group.send(group.drawer, {"event": "strokes", "seq": 1, "ops": [{"op": "add", "path": PATH}]})
+    drawing_id = group.trial().drawing_id
+    # the next message makes a checkpoint, then fails
+    write_behind.checkpoint_interval = 0
+    with pytest.raises(KeyError):
+        group.send(group.drawer, {"event": "strokes", "ops": []})
+    group.db.new_session()
+    assert PictionaryStroke.objects_filter(drawing_id=drawing_id).count() == 1
+    assert group.trial().drawing.last_seq == 1
+
+
+def test_failed_checkpoint_keeps_the_changes(group, write_behind, monkeypatch):
+    group.init()
+    group.send(group.drawer, {"event": "strokes", "seq": 1, "ops": [{"op": "add", "path": PATH}]})
+    drawing_id = group.trial().drawing_id
+    segments = journal_files(write_behind)
+
+    def failing_commit():
+        group.db.rollback()
+        raise RuntimeError("database is gone")
+
+    monkeypatch.setattr(group.db, "commit", failing_commit)
+    write_behind.checkpoint()
+    monkeypatch.undo()
+    assert write_behind.pending_strokes(drawing_id)
+    assert journal_files(write_behind) == segments
+    # written by the next checkpoint
+    write_behind.checkpoint()
+    assert PictionaryStroke.objects_filter(drawing_id=drawing_id).count() == 1